@@ -0,0 +1,185 @@
+import random
+import argparse
+import unicodecsv as csv
+from tadc_import_validator.tadc_import_row import TADCImportRow
+
+__author__ = 'timhodson'
+
+
+class TADCCSVGenerator:
+    """
+    Generates realistic TADC import files for benchmarking.
+    Rows come in courses of many readings which share the same course columns (A-G), like real files do.
+    Each column can be given an error rate, and a proportion of the dates can be written in an old date
+    format so that they need fixing.
+    """
+
+    SECTION_TYPES = ['A', 'C', 'P', 'Article', 'Chapter', 'Page Range']
+    WORDS = ['teaching', 'mathematics', 'learning', 'children', 'culture', 'classroom', 'assessment',
+             'numeracy', 'reality', 'understanding', 'problem', 'solving', 'history', 'science']
+
+    def __init__(self, error_rate=0.01, column_error_rates=None, old_date_rate=0.0, old_date_format='%d/%m/%Y',
+                 readings_per_course=50, seed=None):
+        """
+        :param error_rate: chance of each column with a rule being invalid
+        :param column_error_rates: dict of column letter -> error rate, overrides error_rate for that column
+        :param old_date_rate: chance of a date being written in old_date_format
+        :param old_date_format:
+        :param readings_per_course: average number of rows which share the same course columns
+        :param seed: seed so that the same file can be generated again
+        """
+        self.error_rate = error_rate
+        self.column_error_rates = column_error_rates or {}
+        self.old_date_rate = old_date_rate
+        self.old_date_format = old_date_format
+        self.readings_per_course = readings_per_course
+        self._random = random.Random(seed)
+        self._course = None
+        self._course_rows_left = 0
+
+    def get_error_rate(self, letter):
+        if 'rule' not in TADCImportRow.validationRules[letter]:
+            return 0.0
+        return self.column_error_rates.get(letter, self.error_rate)
+
+    def words(self, count):
+        return u' '.join(self._random.choice(self.WORDS) for _ in range(count)).capitalize()
+
+    def date(self, year):
+        month = self._random.randint(1, 12)
+        day = self._random.randint(1, 28)
+        if self._random.random() < self.old_date_rate:
+            return self.format_date(year, month, day, self.old_date_format)
+        return u'%04d/%02d/%02d' % (year, month, day)
+
+    @staticmethod
+    def format_date(year, month, day, date_format):
+        return date_format.replace('%Y', '%04d' % year).replace('%m', '%02d' % month).replace('%d', '%02d' % day)
+
+    def new_course(self):
+        year = self._random.randint(2010, 2020)
+        return [
+            u'{}{}'.format(self._random.choice(['EPM', 'HIS', 'MAT', 'SCI']), self._random.randint(100, 999)),
+            self.words(4),
+            u'{}'.format(self._random.randint(10, 500)),
+            self.date(year),
+            self.date(year + 1),
+            u'Library Resources',
+            u'ereserve@example.com',
+        ]
+
+    def reading(self):
+        section_type = self._random.choice(self.SECTION_TYPES)
+        is_article = section_type.lower() in TADCImportRow.ARTICLE_SECTION_TYPES
+        start_page = self._random.randint(1, 400)
+        filename = u'scan-{}.pdf'.format(self.words(2).lower().replace(' ', '-'))
+        return [
+            section_type,
+            u'978{:010d}'.format(self._random.randint(0, 9999999999)),
+            u'',
+            self.words(5),
+            u'' if is_article else u'Lampert, Magdalene',
+            u'{}'.format(self._random.randint(1950, 2016)),
+            u'{}'.format(self._random.randint(1, 80)) if is_article else u'',
+            u'{}'.format(self._random.randint(1, 12)) if is_article else u'',
+            self.words(6),
+            u'Groves, S; Stacey, K',
+            u'' if is_article else u'Yale University Press',
+            u'New Haven',
+            u'{}'.format(start_page),
+            u'{}'.format(start_page + self._random.randint(1, 30)),
+            self._random.choice([u'A', u'C', u'D']),
+            filename,
+            u'http://example.com/attachment/{}'.format(filename),
+            u'',
+            self._random.choice([u'y', u'n', u'']),
+        ]
+
+    def invalid_value(self, letter, row):
+        """
+        A value which fails the rule for a column.
+        """
+        rule = TADCImportRow.validationRules[letter]['rule']
+        if rule == 'validate_date':
+            return self._random.choice([u'', u'99/99/2016'])
+        if rule == 'validate_section_type':
+            return u'Book'
+        if rule in ['validate_journal_year', 'validate_journal_volume']:
+            row[12] = row[13] = row[14] = u''
+            return u''
+        if rule == 'validate_extract_title':
+            row[7] = u'Chapter'
+            return u''
+        if rule == 'validate_author_of_extract':
+            row[7] = u'Article'
+            return u''
+        if rule == 'validate_publisher_name':
+            row[7] = u'Chapter'
+            return u''
+        if rule == 'validate_page_number':
+            return u'12-15'
+        if rule == 'validate_source':
+            return u'Z'
+        if rule == 'validate_incidental_artwork':
+            return u'maybe'
+        return u''
+
+    def row(self):
+        if self._course_rows_left <= 0:
+            self._course = self.new_course()
+            self._course_rows_left = self._random.randint(1, self.readings_per_course * 2)
+        self._course_rows_left -= 1
+        row = list(self._course) + self.reading()
+        for index, letter in enumerate(TADCImportRow.COLUMNS):
+            error_rate = self.get_error_rate(letter)
+            if error_rate and self._random.random() < error_rate:
+                row[index] = self.invalid_value(letter, row)
+        return row
+
+    def rows(self, count):
+        for _ in range(count):
+            yield self.row()
+
+    @staticmethod
+    def header():
+        return [TADCImportRow.validationRules[letter]['name'] for letter in TADCImportRow.COLUMNS]
+
+    def write(self, filename, count):
+        """
+        Write a CSV file with a header row and count rows.
+        :param filename:
+        :param count:
+        :return:
+        """
+        with open(filename, 'wb') as csv_fp:
+            writer = csv.writer(csv_fp, delimiter=',', dialect='excel', quotechar='"', quoting=csv.QUOTE_ALL)
+            writer.writerow(self.header())
+            for row in self.rows(count):
+                writer.writerow(row)
+
+
+def main():
+    flags = argparse.ArgumentParser(description="Generate a synthetic TADC import CSV file for benchmarking")
+    flags.add_argument('csv_file', type=str, help="Path of the CSV file to write")
+    flags.add_argument('rows', type=int, help="Number of rows to generate")
+    flags.add_argument('--error-rate', type=float, default=0.01, help="Chance of each column being invalid")
+    flags.add_argument('--column-error-rate', type=str, action='append', default=[],
+                       help="Error rate for one column, e.g. D=0.2. Can be repeated")
+    flags.add_argument('--old-date-rate', type=float, default=0.0,
+                       help="Chance of a date being written in the old date format so it needs fixing")
+    flags.add_argument('--old-date-format', type=str, default='%d/%m/%Y', help="Format of dates that need fixing")
+    flags.add_argument('--seed', type=int, default=None, help="Random seed")
+    args = flags.parse_args()
+
+    column_error_rates = {}
+    for column_error_rate in args.column_error_rate:
+        letter, rate = column_error_rate.split('=')
+        column_error_rates[letter.strip().upper()] = float(rate)
+
+    generator = TADCCSVGenerator(error_rate=args.error_rate, column_error_rates=column_error_rates,
+                                 old_date_rate=args.old_date_rate, old_date_format=args.old_date_format,
+                                 seed=args.seed)
+    generator.write(args.csv_file, args.rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+from logbook import NullHandler
+from tadc_import_validator.tadc_import_row import TADCImportRow, BatchValidator, SchemaValidator, RuleSchema
+from tadc_import_validator.csv_file_validator import CSVFileValidator
+from tadc_import_validator.csv_io import CSVIO
+from .csv_generator import TADCCSVGenerator
+
+__author__ = 'timhodson'
+
+BASELINE_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+class BenchmarkRunner:
+    """
+    Times the hot paths of the validator on a generated file and compares the results with a stored baseline.
+    Results are in rows per second, and the best of several repeats is kept to reduce noise.
+    """
+
+    OLD_DATE_FORMAT = '%d/%m/%Y'
+
+    def __init__(self, rows=50000, repeat=3, seed=1):
+        self.rows = rows
+        self.repeat = repeat
+        self.work_dir = tempfile.mkdtemp(prefix='tadc_benchmarks_')
+        self.csv_file_name = os.path.join(self.work_dir, 'benchmark.csv')
+        generator = TADCCSVGenerator(error_rate=0.01, old_date_rate=0.05, old_date_format=self.OLD_DATE_FORMAT,
+                                     seed=seed)
+        generator.write(self.csv_file_name, rows)
+        self.csv_io = CSVIO()
+        with self.csv_io.open_file(self.csv_file_name) as csv_fp:
+            self.data = list(self.csv_io.reader(csv_fp))[1:]
+        self.results = {}
+
+    def close(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def time(self, name, function):
+        """
+        Run a benchmark function several times and record the best rate.
+        :param name:
+        :param function: called with no arguments, processes self.rows rows
+        :return:
+        """
+        best = None
+        for _ in range(self.repeat):
+            start = time.time()
+            function()
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        self.results[name] = round(self.rows / best, 1)
+        print("{:<40} {:>12.1f} rows/s".format(name, self.results[name]))
+
+    def bench_row_load_is_valid(self):
+        tadc_row = TADCImportRow(old_date_format=self.OLD_DATE_FORMAT, fix_missing=True)
+        for row in self.data:
+            try:
+                tadc_row.load(row)
+                tadc_row.is_valid()
+            except Exception:
+                # counted as a failed row by the validator, we only care about the time here
+                pass
+
+    def bench_batch_validate(self):
+        batch_validator = BatchValidator(old_date_format=self.OLD_DATE_FORMAT, fix_missing=True)
+        for start in range(0, len(self.data), 1000):
+            batch_validator.validate_batch(self.data[start:start + 1000])
+
+    def bench_schema_validate(self):
+        schema_validator = SchemaValidator(RuleSchema.default(), old_date_format=self.OLD_DATE_FORMAT,
+                                           fix_missing=True)
+        for start in range(0, len(self.data), 1000):
+            schema_validator.validate_batch(self.data[start:start + 1000])
+
+    def validate_file(self, fix_missing, engine='batch'):
+        with CSVFileValidator(csv_file=self.csv_file_name, output_dir=self.work_dir,
+                              old_date_format=self.OLD_DATE_FORMAT, header_rows=1,
+                              fix_missing=fix_missing, engine=engine) as validator:
+            validator.validate_file()
+        if validator.get_fixed_filename():
+            os.remove(validator.get_fixed_filename())
+
+    def bench_csv_read(self):
+        with self.csv_io.open_file(self.csv_file_name) as csv_fp:
+            for _ in self.csv_io.reader(csv_fp):
+                pass
+
+    def bench_csv_write(self):
+        output = io.StringIO() if self.csv_io.native else io.BytesIO()
+        writer = self.csv_io.writer(output)
+        for row in self.data:
+            writer.writerow(row)
+
+    def run(self):
+        with NullHandler().applicationbound():
+            self.time('csv_read', self.bench_csv_read)
+            self.time('csv_write', self.bench_csv_write)
+            self.time('row_load_is_valid', self.bench_row_load_is_valid)
+            self.time('batch_validate', self.bench_batch_validate)
+            self.time('schema_validate', self.bench_schema_validate)
+            self.time('validate_file', lambda: self.validate_file(fix_missing=False))
+            self.time('validate_file_fix_missing', lambda: self.validate_file(fix_missing=True))
+            self.time('validate_file_row_engine', lambda: self.validate_file(fix_missing=True, engine='row'))
+        return self.results
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with the baseline.
+    :return: list of names of benchmarks which were slower than the baseline by more than the tolerance
+    """
+    regressions = []
+    for name in sorted(results):
+        expected = baseline.get("results", {}).get(name)
+        if not expected:
+            print("{:<40} {:>8} no baseline, record one with --save-baseline".format(name, ''))
+            continue
+        change = (results[name] - expected) / expected
+        flag = ''
+        if change < -tolerance:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        print("{:<40} {:>+8.1%} against baseline {}".format(name, change, flag))
+    return regressions
+
+
+def main():
+    flags = argparse.ArgumentParser(description="Benchmark the TADC import validator")
+    flags.add_argument('--rows', type=int, default=50000, help="Number of rows in the generated file")
+    flags.add_argument('--repeat', type=int, default=3, help="Number of times to repeat each benchmark")
+    flags.add_argument('--baseline', type=str, default=BASELINE_FILENAME, help="Baseline results file")
+    flags.add_argument('--save-baseline', action='store_true', help="Save these results as the new baseline")
+    flags.add_argument('--tolerance', type=float, default=0.2,
+                       help="How much slower than the baseline a benchmark can be before it is a regression")
+    args = flags.parse_args()
+
+    runner = BenchmarkRunner(rows=args.rows, repeat=args.repeat)
+    try:
+        results = runner.run()
+    finally:
+        runner.close()
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_fp:
+            json.dump({"rows": args.rows, "environment": environment(), "results": results}, baseline_fp,
+                      indent=2, sort_keys=True, separators=(",", ": "))
+        print("Baseline saved to {}".format(args.baseline))
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found at {}".format(args.baseline))
+        return
+    with open(args.baseline) as baseline_fp:
+        baseline = json.load(baseline_fp)
+    if baseline.get("environment") != environment():
+        print("Warning: the baseline was recorded on {}".format(baseline.get("environment")))
+    if compare(results, baseline, args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
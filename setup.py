@@ -9,7 +9,8 @@ setup(name='tadc_import_validator',
       author='Talis Education Ltd',
       author_email='tgh@talis.com',
       license='MIT',
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks', 'benchmarks.*', 'tests', 'tests.*']),
+      package_data={'tadc_import_validator.tadc_import_row': ['default_schema.json']},
       install_requires=[
           'unicodecsv',
           'logbook',
@@ -18,6 +19,7 @@ setup(name='tadc_import_validator',
       classifiers=[
           'Programming Language :: Python',
           'Programming Language :: Python :: 2.7',
+          'Programming Language :: Python :: 3',
           'Development Status :: 4 - Beta',
           'Environment :: Other Environment',
           'Intended Audience :: Developers',
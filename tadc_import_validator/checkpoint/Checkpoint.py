@@ -0,0 +1,69 @@
+import os
+import json
+from logbook import Logger
+
+__author__ = 'timhodson'
+
+log = Logger('Checkpoint')
+
+
+class Checkpoint:
+    """
+    A sidecar file recording how far through a file a validation run has got, so that a run which is killed
+    part way through can carry on from there rather than from the first row.
+    Each save replaces the file in one step, so a run killed while saving leaves the last checkpoint whole.
+    A checkpoint is ignored if the file being validated or the settings which change the results are not the
+    same as when it was saved.
+    """
+
+    # Version of what is saved. Bump this whenever it changes so old checkpoints are ignored.
+    CHECKPOINT_VERSION = 3
+
+    def __init__(self, checkpoint_filename, settings):
+        """
+        :param checkpoint_filename:
+        :param settings: dict of everything a checkpoint depends on, it must be saved as JSON
+        """
+        self.checkpoint_filename = checkpoint_filename
+        self.settings = dict(settings, checkpoint_version=self.CHECKPOINT_VERSION)
+
+    def load(self):
+        """
+        Load the last checkpoint.
+        :return: the state it was saved with, or None if there isn't one which can be used
+        """
+        if not os.path.exists(self.checkpoint_filename):
+            log.info("No checkpoint found at {}, starting from the first row".format(self.checkpoint_filename))
+            return None
+        try:
+            with open(self.checkpoint_filename) as checkpoint_fp:
+                checkpoint = json.load(checkpoint_fp)
+        except ValueError:
+            log.warning("Ignoring unreadable checkpoint {}".format(self.checkpoint_filename))
+            return None
+        if checkpoint.get("settings") != self.settings:
+            log.warning("Checkpoint {} was saved for a different file or settings, starting from the first row".format(
+                self.checkpoint_filename))
+            return None
+        return checkpoint["state"]
+
+    def save(self, state):
+        """
+        Replace the checkpoint with a new state.
+        :param state: dict which can be saved as JSON
+        :return:
+        """
+        temp_filename = "{}.{}.tmp".format(self.checkpoint_filename, os.getpid())
+        with open(temp_filename, 'w') as checkpoint_fp:
+            json.dump({"settings": self.settings, "state": state}, checkpoint_fp)
+            checkpoint_fp.flush()
+            os.fsync(checkpoint_fp.fileno())
+        os.rename(temp_filename, self.checkpoint_filename)
+
+    def remove(self):
+        """
+        Remove the checkpoint, e.g. once the run has finished.
+        :return:
+        """
+        if os.path.exists(self.checkpoint_filename):
+            os.remove(self.checkpoint_filename)
@@ -0,0 +1 @@
+from .Checkpoint import Checkpoint
@@ -1,9 +1,15 @@
 import time
 import sys
+import errno
 import datetime
 import os
 from logbook import Logger, FileHandler, StreamHandler
 from tadc_import_validator.csv_file_validator import CSVFileValidator
+from tadc_import_validator.profiler import Profiler
+from tadc_import_validator.csv_io import CSVIO, PY2
+from tadc_import_validator.multi_file_validator import MultiFileValidator, find_csv_files
+from tadc_import_validator.validation_server import ValidationServer
+from tadc_import_validator.tadc_import_row import RuleSchema
 import argparse
 
 __author__ = 'timhodson'
@@ -11,22 +17,129 @@ __author__ = 'timhodson'
 log = Logger("validate_csv_file")
 
 
+def serve(argv):
+    """
+    Run a validation server, e.g. tadc-import-csv-validator serve --port 8765
+    :param argv: arguments after 'serve'
+    :return:
+    """
+    flags = argparse.ArgumentParser(prog='tadc-import-csv-validator serve',
+                                    description="Run a server which validates CSV files for TADC imports")
+    flags.add_argument('--host', type=str, default='127.0.0.1', help="Address to listen on")
+    flags.add_argument('--port', type=int, default=8765, help="Port to listen on")
+    flags.add_argument('--socket', type=str, help="Listen on this unix socket rather than a port")
+    flags.add_argument('--workers', '-w', type=int, default=1, help="Number of worker processes to validate with")
+    flags.add_argument('--header-rows', type=int, default=1, help="Number of header rows, unless a request says")
+    flags.add_argument('--fix-missing', '-f', action='store_true', help="Fix missing fields, unless a request says")
+    flags.add_argument('--old-date-format', type=str, default='%d/%m/%Y', help="the format of dates that will be fixed")
+    flags.add_argument('--engine', type=str, choices=['batch', 'row'], default='batch',
+                       help="Validate blocks of rows a column at a time (batch) or one row at a time (row)")
+    flags.add_argument('--encoding', type=str, default='utf-8', help="Encoding of the CSV files")
+    flags.add_argument('--max-rows', type=int, default=1000,
+                       help="Most invalid rows described in a response, unless a request says")
+    flags.add_argument('--max-body-size', type=float, default=100,
+                       help="Largest request body in megabytes, send the path of larger files")
+    flags.add_argument('--root-dir', type=str,
+                       help="Directory of the files which can be validated by path, which is refused without it")
+    flags.add_argument('--log-level', type=str, help='Choose a log level', default='INFO')
+    args = flags.parse_args(argv)
+
+    with StreamHandler(sys.stdout, level=args.log_level, bubble=True).applicationbound():
+        log.info("Arguments: {}".format(args))
+        server = ValidationServer(old_date_format=args.old_date_format, header_rows=args.header_rows,
+                                  fix_missing=args.fix_missing, engine=args.engine, encoding=args.encoding,
+                                  max_rows=args.max_rows, workers=args.workers, host=args.host, port=args.port,
+                                  socket_path=args.socket, max_body_size=args.max_body_size * 1024 * 1024,
+                                  root_dir=args.root_dir)
+        server.serve_forever()
+
+
 def main():
     """
     The main routine which kicks everything off
     :return:
     """
+    if sys.argv[1:2] == ['serve']:
+        serve(sys.argv[2:])
+        return
 
     # Setup the command line arguments
-    flags = argparse.ArgumentParser(description="Tool to validate and fix errors in CSV files for TADC imports")
-    flags.add_argument('csv_file', type=str, help="Path to a CSV file to validate")
+    flags = argparse.ArgumentParser(description="Tool to validate and fix errors in CSV files for TADC imports",
+                                    epilog="Run tadc-import-csv-validator serve --help for the options of the "
+                                           "validation server")
+    flags.add_argument('csv_file', type=str, nargs='+',
+                       help="Paths of CSV files to validate, directories of CSV files or glob patterns. "
+                            "Use - to read stdin and write valid rows to stdout")
     flags.add_argument('header_rows', type=str, help="Number of header rows")
-    flags.add_argument('--fix-missing', '-f', action='store_true', help="Fix missing fields by inserting the value 'unknown'")
+    flags.add_argument('--fix-missing', '-f', action='store_true',
+                       help="Fix missing titles, authors and publishers with 'Unknown title' etc. "
+                            "and convert dates in the old format")
     flags.add_argument('--output-dir', '-o', type=str, help='Where to put output files', default=os.getcwd())
     flags.add_argument('--log-dir', '-l', type=str, help='Where to put log files', default='/tmp')
     flags.add_argument('--log-level', type=str, help='Choose a log level', default='INFO')
     flags.add_argument('--old-date-format', type=str, help="the format of dates that will be fixed", default='%d/%m/%Y')
+    flags.add_argument('--max-examples', type=int, default=20,
+                       help="Number of example errors to show for each column in the summary")
+    flags.add_argument('--sample-examples', action='store_true',
+                       help="Show a random sample of errors for each column rather than the first ones")
+    flags.add_argument('--log-rows', action='store_true',
+                       help="Log a message for every row rather than periodic progress messages")
+    flags.add_argument('--progress-every', type=int, default=100000,
+                       help="Log a progress message every N rows, 0 to turn off")
+    flags.add_argument('--progress-interval', type=float,
+                       help="Also log a progress message when this many seconds have passed since the last one")
+    flags.add_argument('--metrics-file', type=str,
+                       help="Write the counters and throughput to this file with each progress message and at the end")
+    flags.add_argument('--metrics-format', type=str, choices=['json', 'prometheus'], default='json',
+                       help="Format of the metrics file, prometheus is for the node exporter's textfile collector")
+    flags.add_argument('--report-file', type=str, help="Write a report of invalid rows to this file")
+    flags.add_argument('--report-format', type=str, choices=['jsonl', 'csv'], default='jsonl',
+                       help="Format of the report file")
+    flags.add_argument('--kev-file', type=str,
+                       help="Write the KEV (OpenURL) payload for each valid row, after any fixes, to this file")
+    flags.add_argument('--kev-format', type=str, choices=['kev', 'jsonl'], default='kev',
+                       help="One OpenURL query string per line (kev) or JSON Lines of the KEV pairs (jsonl)")
+    flags.add_argument('--cache', action='store_true',
+                       help="Remember results between runs so that only new or changed rows are validated again")
+    flags.add_argument('--engine', type=str, choices=['batch', 'row'], default='batch',
+                       help="Validate blocks of rows a column at a time (batch) or one row at a time (row)")
+    flags.add_argument('--workers', '-w', type=int, default=1,
+                       help="Number of worker processes to validate with. When validating several files, "
+                            "this many files are validated at once")
+    flags.add_argument('--max-errors', type=int, help="Stop once this many rows are invalid")
+    flags.add_argument('--max-error-rate', type=float,
+                       help="Stop once more than this fraction of recent rows (see --error-rate-window) are invalid")
+    flags.add_argument('--error-rate-window', type=int, default=1000,
+                       help="Number of recent rows --max-error-rate is checked over")
+    flags.add_argument('--sample', type=int,
+                       help="Validate a sample of this many rows spread through the file and estimate the error rates")
+    flags.add_argument('--sample-random', action='store_true',
+                       help="Sample rows from random places in the file rather than evenly spread ones")
+    flags.add_argument('--encoding', type=str, default='utf-8', help="Encoding of the CSV files")
+    flags.add_argument('--schema', type=str,
+                       help="Validate with the rules in this JSON (or YAML) schema rather than the built in rules")
+    flags.add_argument('--check-duplicates', action='store_true',
+                       help="Report rows with the same course code, ISBN / ISSN and pages as an earlier row")
+    flags.add_argument('--scan-dir', type=str, help="Report rows whose FILENAME is not in this directory")
+    flags.add_argument('--compress-output', type=str, choices=['gz', 'bz2', 'xz'],
+                       help="Compress the fixed and invalid files")
+    flags.add_argument('--checkpoint-every', type=int,
+                       help="Save a checkpoint every N rows so that a run which is stopped can be resumed")
+    flags.add_argument('--resume', action='store_true',
+                       help="Carry on from the last checkpoint, if there is one, rather than the first row")
+    flags.add_argument('--unicodecsv', action='store_true',
+                       help="Read and write CSV files through unicodecsv, as on Python 2, rather than the csv module")
+    flags.add_argument('--profile', action='store_true',
+                       help="Time each stage of validation and each column rule and log a report at the end")
+    flags.add_argument('--profile-json', type=str,
+                       help="Also write the profile report to this JSON file, implies --profile")
     args = flags.parse_args()
+    # in a pipeline stdout carries the valid rows, so log messages go to stderr
+    streaming = args.csv_file == [CSVFileValidator.STREAM]
+    if CSVFileValidator.STREAM in args.csv_file and not streaming:
+        flags.error("- (stdin) can't be validated along with other files")
+    if args.schema and args.engine == 'row':
+        flags.error("--schema needs the batch engine")
 
     log_filename = os.path.join(
             args.log_dir,
@@ -40,7 +153,7 @@ def main():
         level=args.log_level,
         bubble=True
     )
-    stdout_handler = StreamHandler(sys.stdout, level=args.log_level, bubble=True)
+    stdout_handler = StreamHandler(sys.stderr if streaming else sys.stdout, level=args.log_level, bubble=True)
 
     with stdout_handler.applicationbound():
         with log_handler.applicationbound():
@@ -48,16 +161,74 @@ def main():
             start = time.time()
             log.info("starting at {}".format(time.strftime('%l:%M%p %Z on %b %d, %Y')))
 
-            with CSVFileValidator(
-                    csv_file=args.csv_file,
-                    header_rows=args.header_rows,
-                    output_dir=args.output_dir,
-                    old_date_format=args.old_date_format,
-                    fix_missing=args.fix_missing) as validator:
-                validator.validate_file()
-                log.info("Running time: {}".format(str(datetime.timedelta(seconds=(round(time.time() - start, 3))))))
-                log.info("Log written to {}:".format(log_filename))
+            options = dict(
+                header_rows=args.header_rows,
+                output_dir=args.output_dir,
+                old_date_format=args.old_date_format,
+                fix_missing=args.fix_missing,
+                max_examples=args.max_examples,
+                sample_examples=args.sample_examples,
+                log_rows=args.log_rows,
+                progress_every=args.progress_every,
+                report_file=args.report_file,
+                report_format=args.report_format,
+                use_cache=args.cache,
+                engine=args.engine,
+                csv_io=CSVIO(encoding=args.encoding, native=not (PY2 or args.unicodecsv)),
+                max_errors=args.max_errors,
+                max_error_rate=args.max_error_rate,
+                error_rate_window=args.error_rate_window,
+                sample_size=args.sample,
+                sample_random=args.sample_random,
+                compress_output=args.compress_output,
+                check_duplicates=args.check_duplicates,
+                scan_dir=args.scan_dir,
+                schema=RuleSchema.load(args.schema) if args.schema else None,
+                checkpoint_every=args.checkpoint_every,
+                resume=args.resume,
+                progress_interval=args.progress_interval,
+                metrics_file=args.metrics_file,
+                metrics_format=args.metrics_format,
+                kev_file=args.kev_file,
+                kev_format=args.kev_format)
+            profiler = Profiler() if args.profile or args.profile_json else None
+
+            csv_files = find_csv_files(args.csv_file)
+            if not csv_files:
+                log.error("No CSV files found for {}".format(' '.join(args.csv_file)))
+                sys.exit(1)
+            if len(csv_files) == 1 and csv_files == args.csv_file:
+                try:
+                    with CSVFileValidator(csv_file=csv_files[0], workers=args.workers, profiler=profiler,
+                                          **options) as validator:
+                        validator.validate_file()
+                except IOError as e:
+                    # whatever reads stdout has stopped, e.g. head, so there is no point carrying on
+                    if not streaming or e.errno != errno.EPIPE:
+                        raise
+                    log.warning("stdout was closed before all the rows were written")
+                    sys.exit(1)
+            else:
+                # several files share the worker processes, each file is validated in a single process
+                validator = MultiFileValidator(csv_files, workers=args.workers, profiler=profiler, **options)
+                validator.validate_files()
+            log.info("Running time: {}".format(str(datetime.timedelta(seconds=(round(time.time() - start, 3))))))
+            if profiler is not None:
+                profiler.log_report()
+                if args.profile_json:
+                    profiler.write_json(args.profile_json)
+            log.info("Log written to {}:".format(log_filename))
+            if streaming:
+                log.info("Valid rows were written to stdout")
+            elif isinstance(validator, CSVFileValidator):
                 log.info("Fixed data is in: {}".format(validator.get_fixed_filename()))
+                if validator.get_invalid_filename():
+                    log.info("Invalid rows are in: {}".format(validator.get_invalid_filename()))
+    if streaming and validator.stopped_early:
+        # the rows on stdout stop part way through the input, so fail the pipeline
+        sys.exit(1)
+    if isinstance(validator, MultiFileValidator) and validator.failed_count:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,194 @@
+import os
+import json
+from logbook import Logger
+from ..tadc_import_row import TADCImportRow
+
+__author__ = 'timhodson'
+
+log = Logger('CrossRowChecker')
+
+
+class CrossRowChecker:
+    """
+    Checks which need more than one row, run on each RowResult in file order after the row has been validated.
+    Duplicate requests (the same course code, ISBN / ISSN and pages as an earlier row) are found with a dict of
+    the rows seen so far, and FILENAME values are looked up in a set of the files in the scan directory, which
+    is listed once at the start. Each row costs a couple of hash lookups however long the file is.
+    For checkpoints the rows seen are appended to a file as they are saved, rather than all of them going into
+    every checkpoint, so saving costs the same however far through the file the run is.
+    """
+
+    # columns which identify a request, a later row with the same values is a duplicate
+    DUPLICATE_COLUMNS = ['A', 'I', 'T', 'U']
+    FILENAME_COLUMN = 'W'
+
+    def __init__(self, check_duplicates=False, scan_dir=None, seen_filename=None):
+        """
+        :param check_duplicates: report rows which repeat an earlier request
+        :param scan_dir: report rows whose FILENAME isn't in this directory, None to not check
+        :param seen_filename: file the rows seen are kept in by get_state(), e.g. next to a checkpoint
+        """
+        self.check_duplicates = check_duplicates
+        self.scan_dir = scan_dir
+        self._key_indexes = [TADCImportRow.COLUMN_INDEX[letter] for letter in self.DUPLICATE_COLUMNS]
+        self._filename_index = TADCImportRow.COLUMN_INDEX[self.FILENAME_COLUMN]
+        # duplicate key -> row number of the first row with it
+        self._seen = {}
+        self.seen_filename = seen_filename
+        self._seen_fp = None
+        # (key, row number) of the rows seen since get_state() was last called
+        self._unsaved = []
+        self._scan_files = None
+        if scan_dir is not None:
+            self._scan_files = self.list_scan_dir(scan_dir)
+            log.info("Found {} files in {}".format(len(self._scan_files), scan_dir))
+        self.duplicate_count = 0
+        self.missing_count = 0
+
+    @staticmethod
+    def list_scan_dir(scan_dir):
+        """
+        The paths of all files under a directory, relative to it and separated with /.
+        :param scan_dir:
+        :return: set of paths
+        """
+        if not os.path.isdir(scan_dir):
+            raise ValueError("Scan directory {} does not exist".format(scan_dir))
+        scan_files = set()
+        for dir_path, dir_names, file_names in os.walk(scan_dir):
+            relative_dir = os.path.relpath(dir_path, scan_dir)
+            for file_name in file_names:
+                if relative_dir != os.curdir:
+                    file_name = os.path.join(relative_dir, file_name)
+                scan_files.add(file_name.replace(os.sep, '/'))
+        return scan_files
+
+    def duplicate_key(self, values):
+        """
+        The values which identify a request. ISBNs are compared without hyphens or spaces and case is ignored.
+        :param values:
+        :return: a string key, or None if the row has no course code or ISBN / ISSN to compare
+        """
+        course_code, isbn, start_page, end_page = [values[index] for index in self._key_indexes]
+        if not course_code or not isbn:
+            return None
+        isbn = isbn.replace(u'-', u'').replace(u' ', u'')
+        return u'\x1f'.join([course_code, isbn, start_page, end_page]).upper()
+
+    def get_errors(self, row_number, values):
+        """
+        Run the checks on the values of one row.
+        :param row_number: zero based row number
+        :param values: the row values after any fixes, e.g. RowResult.fixed
+        :return: list of {"column": ..., "rule": ..., "message": ...} dicts
+        """
+        errors = []
+        if self.check_duplicates:
+            key = self.duplicate_key(values)
+            if key is not None:
+                first_row = self._seen.setdefault(key, row_number)
+                if first_row == row_number:
+                    if self.seen_filename:
+                        self._unsaved.append((key, row_number))
+                else:
+                    self.duplicate_count += 1
+                    errors.append({
+                        "column": 'A',
+                        "rule": "check_duplicate",
+                        "message": u"{} value: '{}' error: Duplicate of row {} (same course code, ISBN / ISSN and "
+                                   u"pages)".format(TADCImportRow.validationRules['A']['name'], values[0],
+                                                    first_row + 1)
+                    })
+        if self._scan_files is not None:
+            filename = values[self._filename_index]
+            # an empty FILENAME is already an error from the column rules
+            if filename and filename.replace(u'\\', u'/').lstrip(u'/') not in self._scan_files:
+                self.missing_count += 1
+                errors.append({
+                    "column": self.FILENAME_COLUMN,
+                    "rule": "check_scan_exists",
+                    "message": u"{} value: '{}' error: File not found in {}".format(
+                        TADCImportRow.validationRules[self.FILENAME_COLUMN]['name'], filename, self.scan_dir)
+                })
+        return errors
+
+    def check(self, result):
+        """
+        Add any errors from the checks to a RowResult. Rows which raised an exception are left alone.
+        :param result: RowResult
+        :return: the RowResult, marked invalid if the checks found errors
+        """
+        if result.exception is not None or result.fixed is None:
+            return result
+        errors = self.get_errors(result.row_number, result.fixed)
+        if not errors:
+            return result
+        return result._replace(valid=False, errors=result.errors + errors)
+
+    def get_state(self):
+        """
+        The counts and the rows seen so far, as a dict which can be saved as JSON, e.g. in a checkpoint.
+        With a seen_filename the rows seen since the last call are written out to it and the state gives its
+        length, otherwise the state holds all of them. The scan directory isn't included, it is listed again
+        when carrying on.
+        :return:
+        """
+        state = {"duplicate_count": self.duplicate_count, "missing_count": self.missing_count}
+        if not self.seen_filename:
+            state["seen"] = self._seen
+            return state
+        if self._seen_fp is None:
+            self._seen_fp = open(self.seen_filename, 'wb')
+        for key, row_number in self._unsaved:
+            self._seen_fp.write(json.dumps([key, row_number]).encode('utf-8') + b'\n')
+        self._unsaved = []
+        self._seen_fp.flush()
+        os.fsync(self._seen_fp.fileno())
+        state["seen_length"] = self._seen_fp.tell()
+        return state
+
+    def set_state(self, state):
+        """
+        Carry on from a state given by get_state(). Anything written to the seen_filename after the state was
+        saved is cut off.
+        :param state:
+        :return:
+        """
+        self.duplicate_count = state["duplicate_count"]
+        self.missing_count = state["missing_count"]
+        if "seen" in state:
+            self._seen = state["seen"]
+            return
+        self._seen = {}
+        self._unsaved = []
+        with open(self.seen_filename, 'r+b') as seen_fp:
+            seen_fp.truncate(state["seen_length"])
+            for line in seen_fp:
+                key, row_number = json.loads(line.decode('utf-8'))
+                self._seen[key] = row_number
+        self._seen_fp = open(self.seen_filename, 'ab')
+
+    @staticmethod
+    def can_resume(seen_filename, state):
+        """
+        Check that the seen_filename for a state from get_state() is still there and long enough.
+        """
+        return "seen" in state or (os.path.exists(seen_filename) and
+                                   os.path.getsize(seen_filename) >= state["seen_length"])
+
+    def close(self):
+        """
+        Close and remove the seen_filename, e.g. once its checkpoint has gone.
+        :return:
+        """
+        if self._seen_fp is not None:
+            self._seen_fp.close()
+            self._seen_fp = None
+        if self.seen_filename and os.path.exists(self.seen_filename):
+            os.remove(self.seen_filename)
+
+    def log_counts(self):
+        if self.check_duplicates:
+            log.info("{} rows were duplicates of earlier rows".format(self.duplicate_count))
+        if self._scan_files is not None:
+            log.info("{} rows named a file which is not in {}".format(self.missing_count, self.scan_dir))
@@ -0,0 +1 @@
+from .CrossRowChecker import CrossRowChecker
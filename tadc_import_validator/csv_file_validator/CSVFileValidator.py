@@ -1,8 +1,24 @@
 import os
-import unicodecsv as csv
+import sys
+import math
+import time
+import itertools
+import collections
+from timeit import default_timer as timer
 from logbook import Logger
-from ..tadc_import_row import TADCImportRow
-from collections import OrderedDict
+from ..tadc_import_row import TADCImportRow, validate_rows, validate_batches, DateNormaliser, KEVEncoder
+from ..parallel_validator import ParallelValidator
+from ..error_summary import ErrorSummary
+from ..report_writer import ReportWriter
+from ..result_cache import ResultCache
+from ..csv_io import CSVIO
+from ..output_writer import OutputWriter
+from ..row_sampler import RowSampler
+from ..cross_row_checker import CrossRowChecker
+from ..checkpoint import Checkpoint
+from ..progress_meter import ProgressMeter
+from ..metrics_writer import MetricsWriter
+from ..kev_writer import KEVWriter
 
 __author__ = 'timhodson'
 
@@ -12,102 +28,713 @@ log = Logger('CSVFileValidator')
 class CSVFileValidator:
     """
     Validates a CSV File presented as a TADC Import data file.
+    A csv_file of '-' reads from stdin and writes valid rows, with any fixes, to stdout as they are validated,
+    so the validator can sit in a pipeline.
+    Compressed files (.gz, .bz2, .xz or a .zip with one member) are decompressed as they are read.
+    With checkpoint_every a checkpoint is saved as the file is validated, and with resume a run carries on from
+    the last one, giving the same output files and summary as a run which wasn't stopped.
     """
 
-    def __init__(self, csv_file, output_dir, old_date_format, header_rows=2, fix_missing=False):
+    # csv_file name which means read stdin and write stdout
+    STREAM = '-'
+    # rows between checkpoints when resuming without checkpoint_every
+    CHECKPOINT_EVERY = 100000
+    # bytes read at a time when saving checkpoints, a checkpoint can only be saved at the end of a block
+    CHECKPOINT_BLOCK_SIZE = 1024 * 1024
+    # how often, in rows, the clock is looked at for progress_interval
+    PROGRESS_CHECK_EVERY = 1000
+
+    def __init__(self, csv_file, output_dir, old_date_format, header_rows=2, fix_missing=False, workers=1,
+                 max_examples=20, sample_examples=False, log_rows=False, progress_every=100000,
+                 report_file=None, report_format='jsonl', use_cache=False, engine='batch', profiler=None,
+                 csv_io=None, max_errors=None, max_error_rate=None, error_rate_window=1000, sample_size=None,
+                 sample_random=False, compress_output=None, check_duplicates=False, scan_dir=None, schema=None,
+                 checkpoint_every=None, resume=False, progress_interval=None, metrics_file=None,
+                 metrics_format='json', kev_file=None, kev_format='kev'):
         self.csv_file_name = csv_file
-        log.info("Processing File: {}".format(self.csv_file_name))
+        self.streaming = csv_file == self.STREAM
+        if self.streaming:
+            log.info("Processing stdin")
+        else:
+            log.info("Processing File: {}".format(self.csv_file_name))
         self.header_rows = int(header_rows)
         log.info("Expecting {} header rows".format(self.header_rows))
         self.old_date_format = old_date_format
+        # how CSV files are read and written, the csv module on Python 3 and unicodecsv on Python 2
+        self.csv_io = csv_io or CSVIO()
+        self.date_normaliser = DateNormaliser(old_date_format)
         self.fix_missing = fix_missing
+        self.workers = int(workers)
+        # 'batch' validates blocks of rows a column at a time, 'row' validates one TADCImportRow at a time
+        if engine not in ['batch', 'row']:
+            raise ValueError("engine should be 'batch' or 'row'")
+        self.engine = engine
+        # a RuleSchema to validate with instead of the built in rules
+        self.schema = schema
+        if self.schema is not None:
+            if self.engine == 'row':
+                raise ValueError("Validating with a schema needs the batch engine")
+            log.info("Validating with the {} rules".format(self.schema.describe()))
+        # made before any output files are opened, as the kev metadata is checked here
+        kev_encoder = None
+        if kev_file:
+            kev_encoder = KEVEncoder(self.schema.columns if self.schema is not None else None)
+        # validate a sample of the rows rather than all of them, for a quick look at a big file
+        self.sample_size = sample_size
+        self.sample_random = sample_random
+        if self.streaming:
+            # stdin can only be read once, from start to end
+            if self.sample_size:
+                log.warning("Sampling needs a file, all rows from stdin will be validated")
+                self.sample_size = None
+            if self.workers > 1:
+                log.warning("Worker processes are not used when reading stdin")
+                self.workers = 1
+        self.compression = None if self.streaming else self.csv_io.get_compression(self.csv_file_name)
+        if self.compression:
+            self.csv_io.check_compression(self.compression)
+            # workers and sampling seek to places in the file, which a compressed file can't do
+            log.info("Decompressing {} file".format(self.compression))
+            if self.sample_size:
+                log.warning("Sampling needs an uncompressed file, all rows will be validated")
+                self.sample_size = None
+            if self.workers > 1:
+                log.warning("Worker processes are not used for compressed files")
+                self.workers = 1
+        # compress the fixed and invalid files with 'gz', 'bz2' or 'xz'
+        if compress_output:
+            self.csv_io.check_compression(compress_output, 'w')
+        self.compress_output = compress_output
+        if self.sample_size:
+            log.info("Validating a sample of {} rows".format(self.sample_size))
+            if self.workers > 1:
+                log.warning("Worker processes are not used when validating a sample")
+                self.workers = 1
+        if self.workers > 1:
+            log.info("Using {} worker processes".format(self.workers))
+        # stop early once there are too many invalid rows
+        self.max_errors = max_errors
+        self.max_error_rate = max_error_rate
+        self.error_rate_window = error_rate_window
+        self._window = collections.deque(maxlen=error_rate_window)
+        self._window_invalid = 0
+        self.stopped_early = None
         self.fixed_output_dir = output_dir
+        # save how far the run has got every checkpoint_every rows, so that a run which is killed can carry on
+        self.checkpoint = None
+        self.checkpoint_every = checkpoint_every or (self.CHECKPOINT_EVERY if resume else None)
+        # (rows read, byte offset) of the place in the file a checkpoint can be taken after the current row
+        self._resume_point = (0, 0)
+        self._checkpoint_row_count = 0
+        self._parallel_validator = None
+        resume_state = None
+        if self.checkpoint_every:
+            if self.streaming:
+                log.warning("Checkpoints are not saved when reading stdin")
+            elif self.sample_size:
+                log.warning("Checkpoints are not saved when validating a sample")
+            elif self.compression or compress_output:
+                log.warning("Checkpoints are not saved for compressed files")
+            elif report_file and os.path.exists(report_file) and not os.path.isfile(report_file):
+                log.warning("Checkpoints are not saved when the report isn't written to a file")
+            else:
+                self.checkpoint = Checkpoint(self.get_output_filename('checkpoint', '.json'), {
+                    "csv_file": os.path.realpath(self.csv_file_name),
+                    "size": os.path.getsize(self.csv_file_name),
+                    "mtime": os.path.getmtime(self.csv_file_name),
+                    "rules_version": TADCImportRow.RULES_VERSION,
+                    "schema": self.schema.hash if self.schema is not None else None,
+                    "engine": self.engine,
+                    "encoding": self.csv_io.encoding,
+                    "header_rows": self.header_rows,
+                    "old_date_format": self.old_date_format,
+                    "fix_missing": bool(self.fix_missing),
+                    "max_examples": max_examples,
+                    "sample_examples": bool(sample_examples),
+                    "report_file": os.path.realpath(report_file) if report_file else None,
+                    "report_format": report_format,
+                    "check_duplicates": bool(check_duplicates),
+                    "scan_dir": os.path.realpath(scan_dir) if scan_dir else None,
+                    "error_rate_window": error_rate_window,
+                    "kev_file": os.path.realpath(kev_file) if kev_file else None,
+                    "kev_format": kev_format,
+                })
+                log.info("Saving a checkpoint every {} rows to {}".format(self.checkpoint_every,
+                                                                          self.checkpoint.checkpoint_filename))
+                if resume:
+                    resume_state = self.load_checkpoint(report_file, kev_file)
+            if self.checkpoint is None:
+                self.checkpoint_every = None
         self.fixed_filename = None
-        self.fixed_csv_writer = None
-        self.fixed_fp = None
-        if self.fix_missing:
+        self.invalid_filename = None
+        self.output_writer = None
+        if self.streaming:
+            if self.fix_missing:
+                log.info("Will fix missing values")
+            self.init_output_stream()
+        elif self.fix_missing and self.sample_size:
+            log.warning("Fixed and invalid files are not written when validating a sample")
+        elif self.fix_missing:
             log.info("Will fix missing values".format(self.header_rows))
-            self.init_fixed_file()
-        self.error_summary = OrderedDict()
+            self.init_fixed_file(resume=resume_state["output"] if resume_state else None)
+        # KEV (OpenURL) payloads for the valid rows, written in the same pass as the validation
+        self.kev_writer = None
+        if kev_file:
+            if self.sample_size:
+                log.warning("KEV payloads are not written when validating a sample")
+            else:
+                self.kev_writer = KEVWriter(kev_file, kev_format=kev_format, encoder=kev_encoder,
+                                            resume=resume_state["kev"] if resume_state else None)
+        self.error_summary = ErrorSummary(max_examples=max_examples, sample_examples=sample_examples)
+        # logging a message for every row is slow on big files so by default we only log progress
+        self.log_rows = log_rows
+        self.progress_every = progress_every
+        # also log progress when this many seconds have passed since the last message
+        self.progress_interval = progress_interval
+        self._next_progress = None
+        self.progress_meter = None
+        # size of the input and the file descriptor it is read through, to measure progress by bytes read
+        self.input_size = None
+        if not self.streaming and not self.sample_size:
+            self.input_size = os.path.getsize(self.csv_file_name)
+        self._input_fd = None
+        # counters written with each progress message and at the end
+        self.metrics_writer = None
+        if metrics_file:
+            self.metrics_writer = MetricsWriter(metrics_file, metrics_format=metrics_format)
+        self.report_writer = None
+        if report_file:
+            self.report_writer = ReportWriter(report_file, report_format=report_format, csv_io=self.csv_io,
+                                              resume_length=resume_state["report"] if resume_state else None)
+        self.result_cache = None
+        if use_cache:
+            if self.streaming:
+                log.warning("The result cache is not used when reading stdin")
+            elif self.sample_size:
+                log.warning("The result cache is not used when validating a sample")
+            elif self.workers > 1:
+                log.warning("The result cache is not used when validating with worker processes")
+            elif self.checkpoint:
+                log.warning("The result cache is not used with checkpoints")
+            else:
+                self.result_cache = ResultCache(self.get_output_filename('validation-cache', '.json'),
+                                                old_date_format=self.old_date_format,
+                                                fix_missing=self.fix_missing,
+                                                schema=self.schema)
+        # checks across rows, e.g. for duplicate requests, which are made on the results in file order
+        self.cross_row_checker = None
+        if check_duplicates or scan_dir:
+            self.cross_row_checker = CrossRowChecker(
+                check_duplicates=check_duplicates, scan_dir=scan_dir,
+                seen_filename=self.get_seen_filename() if self.checkpoint and check_duplicates else None)
+        self.row_count = 0
+        self.valid_count = 0
+        self.invalid_count = 0
+        if resume_state:
+            self.restore_checkpoint(resume_state)
+        self.profiler = profiler
+        if self.profiler is not None:
+            self.enable_profiling()
+
+    def load_checkpoint(self, report_file=None, kev_file=None):
+        """
+        Load the last checkpoint and check the output files it was saved with are still there.
+        :param report_file:
+        :param kev_file:
+        :return: the checkpoint state, or None to start from the first row
+        """
+        state = self.checkpoint.load()
+        if state is None:
+            return None
+        if self.fix_missing and not OutputWriter.can_resume(state["output"]):
+            log.warning("The output files for checkpoint {} are missing, starting from the first row".format(
+                self.checkpoint.checkpoint_filename))
+            return None
+        if report_file and (not os.path.exists(report_file) or os.path.getsize(report_file) < state["report"]):
+            log.warning("The report for checkpoint {} is missing, starting from the first row".format(
+                self.checkpoint.checkpoint_filename))
+            return None
+        if kev_file and not KEVWriter.can_resume(state["kev"]):
+            log.warning("The KEV payloads for checkpoint {} are missing, starting from the first row".format(
+                self.checkpoint.checkpoint_filename))
+            return None
+        if "cross_rows" in state and not CrossRowChecker.can_resume(self.get_seen_filename(), state["cross_rows"]):
+            log.warning("The rows seen for checkpoint {} are missing, starting from the first row".format(
+                self.checkpoint.checkpoint_filename))
+            return None
+        return state
+
+    def get_seen_filename(self):
+        """
+        Where the rows seen by the cross row checks are kept for checkpoints.
+        """
+        return self.get_output_filename('checkpoint-seen', '.jsonl')
+
+    def restore_checkpoint(self, state):
+        """
+        Carry on from a checkpoint state, the output files have already been cut back to it.
+        :param state: from load_checkpoint()
+        :return:
+        """
+        self._resume_point = (state["rows_read"], state["offset"])
+        self._checkpoint_row_count = state["row_count"]
+        self.row_count = state["row_count"]
+        self.valid_count = state["valid_count"]
+        self.invalid_count = state["invalid_count"]
+        self.date_normaliser.add_counts(state["dates"])
+        self.error_summary.set_state(state["error_summary"])
+        self._window.extend(state["window"])
+        self._window_invalid = state["window_invalid"]
+        if self.cross_row_checker:
+            self.cross_row_checker.set_state(state["cross_rows"])
+        log.info("Resuming after {} rows from checkpoint {}".format(self.row_count,
+                                                                  self.checkpoint.checkpoint_filename))
+
+    def save_checkpoint(self):
+        """
+        Save how far the run has got, at a place in the file where the results so far are all recorded.
+        :return:
+        """
+        rows_read, offset = self._resume_point
+        state = {
+            "rows_read": rows_read,
+            "offset": offset,
+            "row_count": self.row_count,
+            "valid_count": self.valid_count,
+            "invalid_count": self.invalid_count,
+            "dates": self.get_date_counts(),
+            "error_summary": self.error_summary.get_state(),
+            "window": list(self._window),
+            "window_invalid": self._window_invalid,
+        }
+        if self.output_writer:
+            state["output"] = self.output_writer.get_state()
+        if self.report_writer:
+            state["report"] = self.report_writer.get_length()
+        if self.kev_writer:
+            state["kev"] = self.kev_writer.get_state()
+        if self.cross_row_checker:
+            state["cross_rows"] = self.cross_row_checker.get_state()
+        self.checkpoint.save(state)
+        self._checkpoint_row_count = self.row_count
+        log.debug("Saved a checkpoint after {} rows".format(self.row_count))
+
+    def get_date_counts(self):
+        """
+        The date normaliser counts so far, including those from worker processes.
+        :return:
+        """
+        dates = self.date_normaliser.get_counts()
+        if self._parallel_validator is not None:
+            for name, count in self._parallel_validator.date_counts.items():
+                dates[name] = dates.get(name, 0) + count
+        return dates
+
+    def enable_profiling(self):
+        """
+        Time the stages of validate_file() that happen after validation.
+        The methods are replaced on this instance so that a run without a profiler isn't slowed down.
+        :return:
+        """
+        self.record_valid_row = self.profiler.wrap('record valid rows', self.record_valid_row)
+        self.record_invalid_row = self.profiler.wrap('record invalid rows', self.record_invalid_row)
+        self.record_exception_row = self.profiler.wrap('record exception rows', self.record_exception_row)
+        self.print_error_summary = self.profiler.wrap('print summary', self.print_error_summary)
+        if self.report_writer:
+            self.report_writer.write_result = self.profiler.wrap('write report', self.report_writer.write_result)
+        if self.result_cache:
+            self.result_cache.save = self.profiler.wrap('save cache', self.result_cache.save)
+        if self.cross_row_checker:
+            self.cross_row_checker.check = self.profiler.wrap('cross row checks', self.cross_row_checker.check)
+        if self.checkpoint:
+            self.save_checkpoint = self.profiler.wrap('save checkpoints', self.save_checkpoint)
+        if self.kev_writer:
+            self.kev_writer.write = self.profiler.wrap('write kev payloads', self.kev_writer.write)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.fixed_fp:
-            self.fixed_fp.close()
-        return self
+        # validate_file() moves the output files into place when the run finishes, so any still open are from a
+        # run which didn't finish, or never started, and the files from the last full run are left alone
+        for writer in [self.output_writer, self.kev_writer]:
+            if not writer:
+                continue
+            if self.checkpoint and self._checkpoint_row_count:
+                # a checkpoint has been saved or resumed from, keep its temporary files for the next run
+                writer.suspend()
+            else:
+                writer.discard()
+        if self.report_writer:
+            self.report_writer.close()
+        # let errors, e.g. a file which can't be opened, reach the caller
+        return False
+
+    def iter_results(self):
+        """
+        Generator which lazily reads the CSV file and yields a RowResult for each row after the header rows.
+        Nothing is logged or written here so callers can send the results wherever they like.
+        :return:
+        """
+        if self.sample_size:
+            sampler = RowSampler(self.csv_file_name, self.sample_size, header_rows=self.header_rows,
+                                 csv_io=self.csv_io, random_sample=self.sample_random)
+            # sampled rows are numbered in the order they were read, their position in the file isn't known
+            for result in self.validate_rows(row for offset, row in sampler.iter_rows()):
+                yield result
+            return
+
+        if self.workers > 1:
+            rows_read, offset = self._resume_point
+            parallel_validator = ParallelValidator(self.csv_file_name, self.workers,
+                                                   old_date_format=self.old_date_format,
+                                                   fix_missing=self.fix_missing,
+                                                   engine=self.engine,
+                                                   profiler=self.profiler,
+                                                   csv_io=self.csv_io,
+                                                   schema=self.schema,
+                                                   start=offset,
+                                                   first_row_number=rows_read)
+            self._parallel_validator = parallel_validator
+            for result in parallel_validator.iter_results():
+                if result.row_number >= self.header_rows:
+                    self._resume_point = parallel_validator.resume_point
+                    yield result
+            self._parallel_validator = None
+            self.date_normaliser.add_counts(parallel_validator.date_counts)
+            return
+
+        if self.checkpoint:
+            for result in self.iter_block_results():
+                yield result
+            return
+
+        with self.open_input() as csvfile:
+            self._input_fd = self.get_fileno(csvfile)
+            csvreader = self.csv_io.reader(csvfile)
+            if self.profiler is not None:
+                csvreader = self.profiler.time_iterator('read csv', csvreader)
+            try:
+                for result in self.validate_rows(itertools.islice(csvreader, self.header_rows, None),
+                                                 first_row_number=self.header_rows, cache=self.result_cache):
+                    yield result
+            finally:
+                # the descriptor could be reused once the file is closed
+                self._input_fd = None
+
+    @staticmethod
+    def get_fileno(fp):
+        """
+        The file descriptor a file is read through, None if it hasn't got one, e.g. a member of a zip file.
+        """
+        try:
+            return fp.fileno()
+        except (AttributeError, ValueError, IOError, OSError):
+            return None
+
+    def get_input_position(self):
+        """
+        Byte offset reached in the input, for progress messages. Read in one go, this is where the file descriptor
+        is, so it includes anything read ahead and is the offset in the compressed file for compressed files.
+        With workers or checkpoints it is the end of the chunk or block being recorded.
+        :return: the offset, or None if it isn't known, e.g. reading stdin from a pipe
+        """
+        if self._input_fd is not None:
+            try:
+                return os.lseek(self._input_fd, 0, os.SEEK_CUR)
+            except OSError:
+                return None
+        if self.workers > 1 or self.checkpoint:
+            return self._resume_point[1]
+        return None
+
+    def iter_block_results(self):
+        """
+        Generator like iter_results() for a single process, which reads the file in blocks of whole records
+        from the place the run is resuming from. The rows in each block are validated before the next block is
+        read, so once the last result for a block has been recorded a checkpoint can be saved at its end.
+        :return:
+        """
+        rows_read, offset = self._resume_point
+        with open(self.csv_file_name, 'rb') as fp:
+            fp.seek(offset)
+            for data, end in self.csv_io.read_record_blocks(fp, self.CHECKPOINT_BLOCK_SIZE):
+                csvreader = self.csv_io.reader_for_bytes(data)
+                if self.profiler is not None:
+                    csvreader = self.profiler.time_iterator('read csv', csvreader)
+                rows = list(csvreader)
+                skip = max(0, self.header_rows - rows_read)
+                first_row_number = rows_read + skip
+                rows_read += len(rows)
+                self._resume_point = (rows_read, end)
+                for result in self.validate_rows(rows[skip:], first_row_number=first_row_number):
+                    yield result
+
+    def validate_rows(self, rows, first_row_number=0, cache=None):
+        """
+        Generator which validates rows with the chosen engine and rules, yielding a RowResult for each.
+        :param rows: iterable of lists of values
+        :param first_row_number: row number given to the first row
+        :param cache: optional ResultCache
+        :return:
+        """
+        if self.engine == 'row':
+            return validate_rows(rows, old_date_format=self.old_date_format, fix_missing=self.fix_missing,
+                                 first_row_number=first_row_number, cache=cache,
+                                 date_normaliser=self.date_normaliser, profiler=self.profiler)
+        return validate_batches(rows, old_date_format=self.old_date_format, fix_missing=self.fix_missing,
+                                first_row_number=first_row_number, cache=cache,
+                                date_normaliser=self.date_normaliser, profiler=self.profiler, schema=self.schema)
+
+    def open_input(self):
+        if self.streaming:
+            return self.csv_io.open_stream(sys.stdin)
+        return self.csv_io.open_file(self.csv_file_name)
 
     def validate_file(self):
         """
         Read all rows of a CSV file and output a message about whether is is valid or not.
         :return:
         """
+        if self.profiler is not None:
+            self.profiler.start()
+        self.progress_meter = ProgressMeter(self.input_size, rows=self.row_count, position=self._resume_point[1])
+        if self.progress_interval:
+            self._next_progress = timer() + self.progress_interval
+        results = self.iter_results()
+        for result in results:
+            if self.cross_row_checker:
+                result = self.cross_row_checker.check(result)
+            self.row_count += 1
+            if result.exception is not None:
+                self.invalid_count += 1
+                self.record_exception_row(result.row_number, result.fixed, result.exception)
+            elif result.valid:
+                self.valid_count += 1
+                self.record_valid_row(result.row_number, result.fixed)
+                # kept out of record_valid_row so the profile times the two stages separately
+                if self.kev_writer:
+                    self.kev_writer.write(result.row_number, result.fixed)
+            else:
+                self.invalid_count += 1
+                self.record_invalid_row(result.row_number, result.errors, result.fixed)
+            if self.report_writer:
+                self.report_writer.write_result(result)
+            if self.progress_every and self.row_count % self.progress_every == 0:
+                self.log_progress()
+            elif self._next_progress is not None and self.row_count % self.PROGRESS_CHECK_EVERY == 0 and \
+                    timer() >= self._next_progress:
+                self.log_progress()
+            self.stopped_early = self.check_stop(result)
+            if self.stopped_early:
+                log.warning("Stopping after {} rows: {}".format(self.row_count, self.stopped_early))
+                # stops any worker processes straight away
+                results.close()
+                break
+            if self.checkpoint and result.row_number + 1 == self._resume_point[0] and \
+                    self.row_count - self._checkpoint_row_count >= self.checkpoint_every:
+                self.save_checkpoint()
+        log.info("Validated {} rows: {} valid, {} invalid".format(self.row_count, self.valid_count,
+                                                                  self.invalid_count))
+        # the input has been closed, but a run which finished has read all of it
+        progress = self.progress_meter.measure(self.row_count, None if self.stopped_early else self.input_size)
+        log.info("Throughput: {}".format(ProgressMeter.describe(progress)))
+        if self.fix_missing:
+            log.info("Dates: {} converted to YYYY/MM/DD, {} could not be converted".format(
+                self.date_normaliser.normalised, self.date_normaliser.failed))
+        if self.stopped_early:
+            # the output files and cache would only cover part of the file, so keep the ones from the last full run
+            # rows already written to stdout can't be taken back, the exit status tells the pipeline
+            if self.output_writer:
+                self.output_writer.discard()
+            if self.kev_writer:
+                self.kev_writer.discard()
+        else:
+            if self.output_writer:
+                self.output_writer.close()
+            if self.kev_writer:
+                self.kev_writer.close()
+            if self.result_cache:
+                self.result_cache.save()
+        if self.checkpoint:
+            # a run which stopped early starts again from the first row, like one which finished
+            self.checkpoint.remove()
+            if self.cross_row_checker:
+                self.cross_row_checker.close()
+        if self.cross_row_checker:
+            self.cross_row_checker.log_counts()
+        self.print_error_summary()
+        if self.sample_size:
+            self.log_sample_estimates()
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.metrics_writer:
+            self.metrics_writer.write(self.get_metrics(progress, finished=True))
+            log.info("Metrics written to {}".format(self.metrics_writer.metrics_filename))
 
-        with open(self.csv_file_name) as csvfile:
-            csvreader = csv.reader(csvfile, delimiter=',', dialect='excel', quotechar='"')
-            row_counter = 0
-            for row in csvreader:
-                if row_counter >= self.header_rows:
-                    try:
-                        tadc_row = TADCImportRow(old_date_format=self.old_date_format, fix_missing=self.fix_missing)
-                        tadc_row.load(row)
-                        if tadc_row.is_valid():
-                            log.info("row {} is valid".format(row_counter))
-                            if self.fix_missing:
-                                log.debug("Write output for row {} to fix file".format(row_counter))
-                                # output the row to a fixed file.
-                                self.write_fixed_file(tadc_row)
-                        else:
-                            log.error(u"row {} is not valid".format(row_counter))
-                            for error in tadc_row.get_errors():
-                                self.add_error_summary(row_counter, error)
-                                log.error(u"column {}: {}".format(error['column'], error['message']))
-                    except Exception as e:
-                        log.error("{}".format(e.message))
-                row_counter += 1
-            self.print_error_summary()
+    def check_stop(self, result):
+        """
+        Check whether validation should stop because of too many invalid rows.
+        The error rate is checked over the last error_rate_window rows once that many have been validated.
+        :param result: the RowResult just recorded
+        :return: the reason for stopping, or None to carry on
+        """
+        if self.max_errors is not None and self.invalid_count >= self.max_errors:
+            return "reached {} invalid rows".format(self.max_errors)
+        if self.max_error_rate is None:
+            return None
+        if len(self._window) == self._window.maxlen and self._window[0]:
+            self._window_invalid -= 1
+        invalid = not result.valid
+        self._window.append(invalid)
+        self._window_invalid += invalid
+        if len(self._window) == self._window.maxlen:
+            rate = float(self._window_invalid) / len(self._window)
+            if rate > self.max_error_rate:
+                return "{:.1%} of the last {} rows were invalid".format(rate, len(self._window))
+        return None
+
+    def log_sample_estimates(self):
+        """
+        Log the error rates estimated from a sample, with a 95% margin of error.
+        :return:
+        """
+        if not self.row_count:
+            log.info("No rows were sampled")
+            return
+
+        def estimate(count):
+            rate = float(count) / self.row_count
+            margin = 1.96 * math.sqrt(rate * (1 - rate) / self.row_count)
+            return "{:.1%} +/- {:.1%}".format(rate, margin)
+
+        log.info("Estimated from a sample of {} rows (row numbers above are positions in the sample):".format(
+            self.row_count))
+        log.info(" - Invalid rows: {}".format(estimate(self.invalid_count)))
+        if self.error_summary.exception_count:
+            log.info(" - Rows which could not be validated: {}".format(estimate(self.error_summary.exception_count)))
+        for column in sorted(self.error_summary.column_counts):
+            log.info(" - Column {} ({}): {}".format(column, TADCImportRow.validationRules[column]['name'],
+                                                     estimate(self.error_summary.column_counts[column])))
+
+    def log_progress(self):
+        """
+        Log how far the run has got and how fast it is going, and write the metrics file.
+        :return:
+        """
+        progress = self.progress_meter.measure(self.row_count, self.get_input_position())
+        log.info("Processed {} rows: {} valid, {} invalid, {}".format(self.row_count, self.valid_count,
+                                                                      self.invalid_count,
+                                                                      ProgressMeter.describe(progress)))
+        if self.progress_interval:
+            self._next_progress = timer() + self.progress_interval
+        if self.metrics_writer:
+            self.metrics_writer.write(self.get_metrics(progress))
+
+    def get_metrics(self, progress, finished=False):
+        """
+        The counters for the run so far, as written by the MetricsWriter.
+        :param progress: dict from ProgressMeter.measure()
+        :param finished: whether the run has finished
+        :return:
+        """
+        dates = self.get_date_counts()
+        metrics = {
+            "file": self.csv_file_name,
+            "finished": finished,
+            "stopped_early": self.stopped_early,
+            "timestamp": time.time(),
+            "rows": self.row_count,
+            "valid": self.valid_count,
+            "invalid": self.invalid_count,
+            "exceptions": self.error_summary.exception_count,
+            "errors": self.error_summary.error_count,
+            "fixed_rows": self.output_writer.valid_count if self.output_writer else 0,
+            "dates_fixed": dates["normalised"],
+            "dates_not_fixed": dates["failed"],
+            "column_errors": dict(self.error_summary.column_counts),
+            "rule_errors": dict(self.error_summary.rule_counts),
+            "progress": progress,
+        }
+        if self.profiler is not None:
+            metrics["stages"] = dict((name, {"seconds": seconds, "calls": calls})
+                                     for name, (seconds, calls) in self.profiler.timings.items())
+        return metrics
+
+    def record_valid_row(self, row_counter, output):
+        if self.log_rows:
+            log.info("row {} is valid".format(row_counter))
+        if self.output_writer:
+            # output the row to a fixed file.
+            self.output_writer.write_valid(output)
+
+    def record_invalid_row(self, row_counter, errors, output=None):
+        if self.log_rows:
+            log.error(u"row {} is not valid".format(row_counter))
+            for error in errors:
+                log.error(u"column {}: {}".format(error['column'], error['message']))
+        self.error_summary.add_row_errors(row_counter, errors)
+        if self.output_writer:
+            # output the row and the reasons it is invalid to the invalid file.
+            self.output_writer.write_invalid(output, errors)
+
+    def record_exception_row(self, row_counter, output, exception):
+        if self.log_rows:
+            log.error(exception)
+        self.error_summary.add_exception(row_counter, exception)
+        if self.output_writer:
+            self.output_writer.write_invalid(output, [], exception=exception)
 
     def add_error_summary(self, row, error):
-        error_column = error['column']
-        error_message = error['message']
-        if not self.error_summary.get(row):
-            self.error_summary[row] = {}
-        if not self.error_summary[row].get(error_column):
-            self.error_summary[row][error_column] = error_message
+        self.error_summary.add_error(row, error)
 
     def print_error_summary(self):
-        error_rows = len(self.error_summary)
-        error_count = 0
-        column_error_summary = {}
-        if error_rows > 0:
-            log.info("Errors were found for the following columns")
-            for row, columns in self.error_summary.iteritems():
-                for column in columns:
-                    error_count += 1
-                    if column_error_summary.get(column):
-                        column_error_summary[column] += 1
-                    else:
-                        column_error_summary[column] = 1
-                    # rows are zero counted so fix with a +1 for humans to read.
-                    log.info("Row {} column {} : {}".format(row + 1, column, columns[column]))
-
-            log.info("Summary: There were {} errors found in {} rows".format(error_count, error_rows))
-            for column in column_error_summary:
-                log.info(" - Column {} had {} errors".format(column, column_error_summary[column]))
-        else:
-            log.info("No errors found. Woohoo!")
+        self.error_summary.print_summary()
+
+    def get_output_filename(self, label, extension=None):
+        """
+        Name of an output file derived from the input file, e.g. file.csv -> file.fixed.csv
+        Any compression extension is left off, so file.csv.gz -> file.fixed.csv too.
+        :param label:
+        :param extension: defaults to the extension of the input file
+        :return:
+        """
+        split_orig_filename = os.path.splitext(self.csv_io.strip_compression(self.csv_file_name))
+        if extension is None:
+            # e.g. file.zip -> file.fixed.csv
+            extension = split_orig_filename[1] or ('.csv' if self.compression else '')
+        new_name = os.path.join(self.fixed_output_dir, "{}.{}{}".format(split_orig_filename[0], label, extension))
+        return os.path.realpath(new_name)
+
+    def init_fixed_file(self, resume=None):
+        """
+        Set up the output files. Valid rows, with any fixes, go to file.fixed.csv and invalid rows, with the reasons
+        they are invalid, go to file.invalid.csv. Both replace the files from any earlier run when the run finishes.
+        With compress_output they are compressed, e.g. file.fixed.csv.gz.
+        :param resume: OutputWriter state from a checkpoint, to carry on writing its temporary files
+        :return:
+        """
+        self.fixed_filename = self.get_output_filename('fixed')
+        self.invalid_filename = self.get_output_filename('invalid')
+        if self.compress_output:
+            self.fixed_filename += '.' + self.compress_output
+            self.invalid_filename += '.' + self.compress_output
+        self.output_writer = OutputWriter(self.fixed_filename, self.invalid_filename, csv_io=self.csv_io,
+                                          resume=resume)
 
-    def init_fixed_file(self):
-        split_orig_filename = os.path.splitext(self.csv_file_name)
-        new_name = os.path.join(self.fixed_output_dir,
-                                "{}.fixed{}".format(split_orig_filename[0], split_orig_filename[1]))
-        self.fixed_filename = os.path.realpath(new_name)
-        self.fixed_fp = open(self.fixed_filename, 'a')
-        self.fixed_csv_writer = csv.writer(self.fixed_fp, delimiter=',', dialect='excel', quotechar='"')
+    def init_output_stream(self):
+        """
+        Set up writing valid rows, with any fixes, to stdout. Invalid rows are only logged and reported,
+        so use a report file to keep the reasons, e.g. --report-file /dev/fd/3.
+        :return:
+        """
+        self.output_writer = OutputWriter(self.csv_io.open_stream(sys.stdout, 'w'), None, csv_io=self.csv_io)
 
     def write_fixed_file(self, row):
-        self.fixed_csv_writer.writerow(row.output_for_csv())
+        self.output_writer.write_valid(row.output_for_csv())
 
     def get_fixed_filename(self):
         return self.fixed_filename
+
+    def get_invalid_filename(self):
+        return self.invalid_filename
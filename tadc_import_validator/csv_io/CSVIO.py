@@ -0,0 +1,187 @@
+import io
+import os
+import sys
+import csv
+import bz2
+import gzip
+import zipfile
+import unicodecsv
+from .RecordScanner import RecordScanner
+try:
+    import lzma
+except ImportError:
+    # only in the standard library from Python 3.3
+    lzma = None
+
+__author__ = 'timhodson'
+
+PY2 = sys.version_info[0] == 2
+
+
+class CSVIO:
+    """
+    Opens CSV files and makes readers and writers for them with the settings used for TADC import files.
+    On Python 3 the C csv module reads and writes text streams opened with the encoding, so each cell is
+    decoded once as the file is read. Python 2's csv module only works with bytes, so there every cell goes
+    through unicodecsv instead. The unicodecsv path can also be used on Python 3 with native=False.
+    Both paths give the same rows and write the same bytes.
+    Files ending .gz, .bz2, .xz or .zip (with a single member) are decompressed as they are read, and files
+    ending .gz, .bz2 or .xz are compressed as they are written.
+    """
+
+    # file extension -> compression
+    COMPRESSIONS = {'.gz': 'gz', '.bz2': 'bz2', '.xz': 'xz', '.zip': 'zip'}
+
+    def __init__(self, encoding='utf-8', native=None):
+        """
+        :param encoding: encoding of the CSV files read and written
+        :param native: use the csv module on text streams, defaults to True on Python 3
+        """
+        if native is None:
+            native = not PY2
+        if native and PY2:
+            raise ValueError("Reading CSV files without unicodecsv needs Python 3")
+        self.encoding = encoding
+        self.native = native
+
+    @classmethod
+    def get_compression(cls, filename):
+        """
+        The compression of a file, from its extension.
+        :param filename:
+        :return: 'gz', 'bz2', 'xz', 'zip' or None if it isn't compressed
+        """
+        return cls.COMPRESSIONS.get(os.path.splitext(filename)[1].lower())
+
+    @classmethod
+    def strip_compression(cls, filename):
+        """
+        The file name without any compression extension, e.g. file.csv.gz -> file.csv
+        """
+        if cls.get_compression(filename):
+            return os.path.splitext(filename)[0]
+        return filename
+
+    def open_file(self, filename, mode='r', buffering=-1, compression=None):
+        """
+        Open a CSV file ready for reader() or writer().
+        :param filename:
+        :param mode: 'r', 'w' or 'a'
+        :param buffering:
+        :param compression: defaults to the compression given by the file extension
+        :return:
+        """
+        if compression is None:
+            compression = self.get_compression(filename)
+        if compression is not None:
+            fp = self.open_compressed(filename, mode, compression)
+            if self.native:
+                return io.TextIOWrapper(fp, encoding=self.encoding, newline='')
+            return fp
+        if self.native:
+            return io.open(filename, mode, buffering, encoding=self.encoding, newline='')
+        # the builtin file object iterates over lines faster than io's on Python 2
+        return open(filename, mode + 'b', buffering)
+
+    @staticmethod
+    def check_compression(compression, mode='r'):
+        """
+        Raise ValueError if files with this compression can't be opened in this mode.
+        """
+        if compression not in ['gz', 'bz2', 'xz', 'zip']:
+            raise ValueError("Unknown compression {}".format(compression))
+        if compression == 'xz' and lzma is None:
+            raise ValueError("xz files need the lzma module from Python 3")
+        if compression == 'zip' and mode != 'r':
+            raise ValueError("zip files can only be read")
+
+    @classmethod
+    def open_compressed(cls, filename, mode, compression):
+        """
+        Open a compressed file as a binary stream which (de)compresses as it goes.
+        :param filename:
+        :param mode: 'r', 'w' or 'a'
+        :param compression: 'gz', 'bz2', 'xz' or 'zip'
+        :return:
+        """
+        cls.check_compression(compression, mode)
+        if compression == 'gz':
+            # the default level 9 is a lot slower to write for very little gain
+            return gzip.open(filename, mode + 'b', 6)
+        if compression == 'bz2':
+            return bz2.BZ2File(filename, mode)
+        if compression == 'xz':
+            return lzma.open(filename, mode + 'b')
+        with zipfile.ZipFile(filename) as archive:
+            members = [member for member in archive.infolist() if not member.filename.endswith('/')]
+            if len(members) != 1:
+                raise ValueError("{} should contain one file, it has {}".format(filename, len(members)))
+            # the member keeps its own handle on the file once the archive is closed
+            return archive.open(members[0])
+
+    def open_stream(self, stream, mode='r', buffering=-1):
+        """
+        Open a standard stream, e.g. sys.stdin or sys.stdout, ready for reader() or writer().
+        The file descriptor is opened again so that closing the result leaves the stream itself open.
+        :param stream: an open file with a file descriptor
+        :param mode: 'r' or 'w'
+        :param buffering:
+        :return:
+        """
+        if self.native:
+            return io.open(stream.fileno(), mode, buffering, encoding=self.encoding, newline='', closefd=False)
+        return io.open(stream.fileno(), mode + 'b', buffering, closefd=False)
+
+    def reader(self, fp):
+        if self.native:
+            return csv.reader(fp, delimiter=',', dialect='excel', quotechar='"')
+        return unicodecsv.reader(fp, encoding=self.encoding, delimiter=',', dialect='excel', quotechar='"')
+
+    def writer(self, fp):
+        if self.native:
+            return csv.writer(fp, delimiter=',', dialect='excel', quotechar='"')
+        return unicodecsv.writer(fp, encoding=self.encoding, delimiter=',', dialect='excel', quotechar='"')
+
+    def reader_for_bytes(self, data):
+        """
+        A reader for part of a file which has already been read, e.g. a chunk handed to a worker process.
+        :param data: bytes which start and end on record boundaries
+        :return:
+        """
+        if self.native:
+            return self.reader(io.StringIO(data.decode(self.encoding), newline=''))
+        return self.reader(io.BytesIO(data))
+
+    @staticmethod
+    def read_record_blocks(fp, block_size=1024 * 1024):
+        """
+        Read a file in blocks which each end on a record boundary, so the byte offset of every block is known,
+        e.g. to carry on from part way through the file. As for worker chunks, the record boundaries are found
+        with a RecordScanner, which carries on from where it got to, so only the newly read bytes are scanned
+        and only the unfinished record at the end of a block is kept for the next one.
+        :param fp: binary file positioned at the start of a record
+        :param block_size: how much is read at a time, a block holds at least one whole record
+        :return: generator of (bytes, offset of the end of the block)
+        """
+        position = fp.tell()
+        scanner = RecordScanner()
+        # the unfinished record read so far
+        parts = []
+        while True:
+            more = fp.read(block_size)
+            if not more:
+                break
+            end = scanner.find_last_end(more)
+            if end is None:
+                # a record longer than the block, read more of it
+                parts.append(more)
+                continue
+            parts.append(more[:end])
+            data = b''.join(parts)
+            position += len(data)
+            yield data, position
+            parts = [more[end:]]
+        data = b''.join(parts)
+        if data:
+            position += len(data)
+            yield data, position
@@ -0,0 +1,94 @@
+import re
+
+__author__ = 'timhodson'
+
+
+class RecordScanner:
+    """
+    Finds where the records of a CSV file end without parsing their values, e.g. to split a file into chunks.
+    It follows the csv module's excel dialect: a quote only opens a quoted field at the start of a field, so a
+    quote part way through an unquoted field (ab"c) is just part of the value, and inside a quoted field ""
+    is an escaped quote and any other quote closes the field. A newline outside a quoted field ends the record.
+    The file can be given a part at a time. Where the scan has got to in the current record is kept between
+    calls, so each byte is only looked at once however the file is split up.
+    """
+
+    # where the scan is in the current record
+    FIELD_START = 0
+    UNQUOTED = 1
+    QUOTED = 2
+    # a quote in a quoted field, which closes it unless the next byte is a quote too
+    QUOTE_IN_QUOTED = 3
+
+    # the next newline ending the record, or quote opening a field, in an unquoted field
+    UNQUOTED_END = re.compile(b'\n|,"')
+    # the rest of a quoted field up to the quote which may close it
+    QUOTED_PART = re.compile(b'[^"]*(?:""[^"]*)*')
+    # any number of whole records, matched in one go
+    FIELD = b'(?:"[^"]*(?:""[^"]*)*"(?!")[^,\n]*|[^",\n][^,\n]*|)'
+    RECORDS = re.compile(b'(?:' + FIELD + b'(?:,' + FIELD + b')*\n)*')
+
+    def __init__(self, state=FIELD_START):
+        """
+        :param state: where the scan starts, FIELD_START for the start of a record
+        """
+        self.state = state
+
+    def find_end(self, data, position=0, end=None):
+        """
+        Carry on scanning from position to the end of the current record.
+        :param data: bytes
+        :param position:
+        :param end: where to stop scanning, the end of data by default
+        :return: offset just after the newline ending the record, or None if it doesn't end before end
+        """
+        if end is None:
+            end = len(data)
+        state = self.state
+        while position < end:
+            if state == self.FIELD_START:
+                if data[position:position + 1] == b'"':
+                    state = self.QUOTED
+                    position += 1
+                else:
+                    state = self.UNQUOTED
+            elif state == self.UNQUOTED:
+                match = self.UNQUOTED_END.search(data, position, end)
+                if match is None:
+                    # a field may start with a quote at the beginning of the next data
+                    state = self.FIELD_START if data[end - 1:end] == b',' else self.UNQUOTED
+                    position = end
+                elif match.group() == b'\n':
+                    self.state = self.FIELD_START
+                    return match.end()
+                else:
+                    state = self.QUOTED
+                    position = match.end()
+            elif state == self.QUOTED:
+                position = self.QUOTED_PART.match(data, position, end).end()
+                if position < end:
+                    state = self.QUOTE_IN_QUOTED
+                    position += 1
+            elif data[position:position + 1] == b'"':
+                state = self.QUOTED
+                position += 1
+            else:
+                state = self.UNQUOTED
+        self.state = state
+        return None
+
+    def find_last_end(self, data, position=0, end=None):
+        """
+        Scan from position to end, leaving the scan in the record which is unfinished there.
+        :param data: bytes
+        :param position:
+        :param end: the end of data by default
+        :return: offset just after the last record which ends before end, or None if none do
+        """
+        last = None
+        while True:
+            record_end = self.find_end(data, position, end)
+            if record_end is None:
+                return last
+            # the records after the first one which ends are matched by the regex
+            last = position = self.RECORDS.match(data, record_end, len(data) if end is None else end).end()
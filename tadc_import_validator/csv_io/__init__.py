@@ -0,0 +1,2 @@
+from .CSVIO import CSVIO, PY2
+from .RecordScanner import RecordScanner
@@ -0,0 +1,197 @@
+import random
+from logbook import Logger
+from ..tadc_import_row import TADCImportRow
+
+__author__ = 'timhodson'
+
+log = Logger('ErrorSummary')
+
+
+class ErrorSummary:
+    """
+    Aggregates validation errors for a file using a bounded amount of memory.
+    Counts per column and per rule are exact, but only a limited number of example errors are
+    kept for each column. Examples are either the first ones seen or a random sample of all of them.
+    """
+
+    def __init__(self, max_examples=20, sample_examples=False, seed=None):
+        """
+        :param max_examples: how many example errors to keep for each column, None keeps them all
+        :param sample_examples: keep a random sample of the errors rather than the first ones
+        :param seed: seed for the random sample so that runs can be repeated
+        """
+        self.max_examples = max_examples
+        self.sample_examples = sample_examples
+        self._random = random.Random(seed)
+        self.error_count = 0
+        self.error_rows = 0
+        self.column_counts = {}
+        self.rule_counts = {}
+        self.examples = {}
+        self.exception_count = 0
+        self.exception_examples = []
+        self._last_row = None
+
+    def add_error(self, row, error):
+        """
+        Record a single error. Errors are expected to arrive in row order.
+        :param row: zero based row number
+        :param error: dict with 'column' and 'message' keys, and a 'rule' key for errors which don't come from
+            the column's rule
+        :return:
+        """
+        column = error['column']
+        if row != self._last_row:
+            self._last_row = row
+            self.error_rows += 1
+        self.error_count += 1
+        column_count = self.column_counts.get(column, 0) + 1
+        self.column_counts[column] = column_count
+        rule = error.get('rule') or TADCImportRow.validationRules.get(column, {}).get('rule', 'unknown')
+        self.rule_counts[rule] = self.rule_counts.get(rule, 0) + 1
+
+        examples = self.examples.setdefault(column, [])
+        if self.max_examples is None or column_count <= self.max_examples:
+            examples.append((row, error['message']))
+        elif self.sample_examples:
+            # reservoir sampling gives every error the same chance of being kept
+            replace = self._random.randint(0, column_count - 1)
+            if replace < self.max_examples:
+                examples[replace] = (row, error['message'])
+
+    def add_row_errors(self, row, errors):
+        """
+        Record all of the errors for a row.
+        :param row:
+        :param errors:
+        :return:
+        """
+        for error in errors:
+            self.add_error(row, error)
+
+    def add_exception(self, row, message):
+        """
+        Record a row which could not be validated because an exception was raised.
+        :param row:
+        :param message:
+        :return:
+        """
+        self.exception_count += 1
+        if self.max_examples is None or len(self.exception_examples) < self.max_examples:
+            self.exception_examples.append((row, message))
+
+    def merge(self, other):
+        """
+        Add the counts and examples from another summary into this one.
+        Examples are trimmed back to max_examples keeping the earliest rows.
+        :param other: ErrorSummary
+        :return:
+        """
+        self.error_count += other.error_count
+        self.error_rows += other.error_rows
+        self.exception_count += other.exception_count
+        self.exception_examples = sorted(self.exception_examples + other.exception_examples)
+        if self.max_examples is not None:
+            self.exception_examples = self.exception_examples[:self.max_examples]
+        for column, count in other.column_counts.items():
+            self.column_counts[column] = self.column_counts.get(column, 0) + count
+        for rule, count in other.rule_counts.items():
+            self.rule_counts[rule] = self.rule_counts.get(rule, 0) + count
+        for column, examples in other.examples.items():
+            merged = sorted(self.examples.get(column, []) + examples)
+            if self.max_examples is not None:
+                merged = merged[:self.max_examples]
+            self.examples[column] = merged
+
+    def get_state(self):
+        """
+        The counts and examples as a dict which can be saved as JSON, e.g. in a checkpoint.
+        :return:
+        """
+        state = {
+            "error_count": self.error_count,
+            "error_rows": self.error_rows,
+            "column_counts": self.column_counts,
+            "rule_counts": self.rule_counts,
+            "examples": self.examples,
+            "exception_count": self.exception_count,
+            "exception_examples": self.exception_examples,
+            "last_row": self._last_row,
+        }
+        if self.sample_examples:
+            # so that the rest of the sample is the same as if the run hadn't stopped
+            version, internal, gauss_next = self._random.getstate()
+            state["random"] = [version, list(internal), gauss_next]
+        return state
+
+    def set_state(self, state):
+        """
+        Carry on from a state given by get_state().
+        :param state:
+        :return:
+        """
+        self.error_count = state["error_count"]
+        self.error_rows = state["error_rows"]
+        self.column_counts = state["column_counts"]
+        self.rule_counts = state["rule_counts"]
+        self.examples = dict((column, [tuple(example) for example in examples])
+                             for column, examples in state["examples"].items())
+        self.exception_count = state["exception_count"]
+        self.exception_examples = [tuple(example) for example in state["exception_examples"]]
+        self._last_row = state["last_row"]
+        if "random" in state:
+            version, internal, gauss_next = state["random"]
+            self._random.setstate((version, tuple(internal), gauss_next))
+
+    def get_examples(self):
+        """
+        All of the kept examples as (row, column, message) tuples in row order.
+        :return:
+        """
+        examples = []
+        for column, column_examples in self.examples.items():
+            for row, message in column_examples:
+                examples.append((row, column, message))
+        examples.sort()
+        return examples
+
+    def has_errors(self):
+        return self.error_count > 0 or self.exception_count > 0
+
+    def print_summary(self):
+        """
+        Log the examples and the counts.
+        :return:
+        """
+        if not self.has_errors():
+            log.info("No errors found. Woohoo!")
+            return
+
+        for row, message in self.exception_examples:
+            log.error(u"Row {} could not be validated: {}".format(row + 1, message))
+        if self.exception_count > len(self.exception_examples):
+            log.error("{} more rows could not be validated".format(self.exception_count - len(self.exception_examples)))
+
+        log.info("Errors were found for the following columns")
+        for row, column, message in self.get_examples():
+            # rows are zero counted so fix with a +1 for humans to read.
+            log.info(u"Row {} column {} : {}".format(row + 1, column, message))
+        for column in sorted(self.column_counts):
+            not_shown = self.column_counts[column] - len(self.examples.get(column, []))
+            if not_shown > 0:
+                log.info("Column {} had {} more errors which are not shown".format(column, not_shown))
+
+        self.print_counts()
+
+    def print_counts(self):
+        """
+        Log the counts without the examples.
+        :return:
+        """
+        log.info("Summary: There were {} errors found in {} rows".format(self.error_count, self.error_rows))
+        if self.exception_count:
+            log.info(" - {} rows could not be validated".format(self.exception_count))
+        for column in sorted(self.column_counts):
+            log.info(" - Column {} had {} errors".format(column, self.column_counts[column]))
+        for rule in sorted(self.rule_counts):
+            log.info(" - Rule {} failed {} times".format(rule, self.rule_counts[rule]))
@@ -0,0 +1 @@
+from .ErrorSummary import ErrorSummary
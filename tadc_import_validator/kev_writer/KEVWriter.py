@@ -0,0 +1,124 @@
+import os
+import json
+from logbook import Logger
+from ..tadc_import_row import KEVEncoder
+
+__author__ = 'timhodson'
+
+log = Logger('KEVWriter')
+
+
+class KEVWriter:
+    """
+    Writes the KEV (OpenURL) payload for each valid row, after any fixes, as the file is validated, so the
+    import payloads come from the same pass over the file as the validation.
+    Payloads are either one OpenURL query string per line ('kev') or JSON Lines ('jsonl') giving the row number
+    and the KEV pairs. As with the fixed file, they are written through a large buffer to a temporary file, named
+    with the process id, which replaces the output in one step once the run has finished.
+    """
+
+    FORMATS = ['kev', 'jsonl']
+
+    def __init__(self, kev_filename, kev_format='kev', encoder=None, buffer_size=1024 * 1024, resume=None):
+        """
+        :param kev_filename:
+        :param kev_format: 'kev' or 'jsonl'
+        :param encoder: KEVEncoder, defaults to one for the built in rules
+        :param buffer_size:
+        :param resume: state from get_state() to carry on from, the temporary file must still be there
+        """
+        if kev_format not in self.FORMATS:
+            raise ValueError("KEV format should be one of {}".format(", ".join(self.FORMATS)))
+        self.kev_filename = kev_filename
+        self.kev_format = kev_format
+        self.encoder = encoder or KEVEncoder()
+        self.temp_filename = "{}.{}.tmp".format(kev_filename, os.getpid())
+        self.count = 0
+        mode = 'wb'
+        if resume is not None:
+            self.temp_filename = resume["temp_filename"]
+            # throw away anything written after the checkpoint
+            with open(self.temp_filename, 'r+b') as temp_fp:
+                temp_fp.truncate(resume["length"])
+            self.count = resume["count"]
+            mode = 'ab'
+        self.kev_fp = open(self.temp_filename, mode, buffer_size)
+        self._closed = False
+        log.info("Writing {} payloads to {}".format(self.kev_format, self.kev_filename))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+    def write(self, row_number, values):
+        """
+        Add the payload for a valid row.
+        :param row_number: zero based row number
+        :param values: the row values after any fixes, e.g. RowResult.fixed
+        :return:
+        """
+        if self.kev_format == 'kev':
+            line = self.encoder.query_string(values).encode('utf-8')
+        else:
+            line = json.dumps({"row": row_number + 1, "kev": self.encoder.encode(values)}).encode('utf-8')
+        self.kev_fp.write(line + b'\n')
+        self.count += 1
+
+    def get_state(self):
+        """
+        Write out everything so far and get the count, name and length of the temporary file, e.g. for a
+        checkpoint.
+        :return: dict which can be saved as JSON
+        """
+        self.kev_fp.flush()
+        os.fsync(self.kev_fp.fileno())
+        return {"count": self.count, "length": os.fstat(self.kev_fp.fileno()).st_size,
+                "temp_filename": self.temp_filename}
+
+    @staticmethod
+    def can_resume(state):
+        """
+        Check that the temporary file for a state from get_state() is still there and long enough.
+        """
+        temp_filename = state["temp_filename"]
+        return os.path.exists(temp_filename) and os.path.getsize(temp_filename) >= state["length"]
+
+    def close(self):
+        """
+        Move the finished file into place.
+        :return:
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self.kev_fp.close()
+        os.rename(self.temp_filename, self.kev_filename)
+        log.info("Wrote {} payloads to {}".format(self.count, self.kev_filename))
+
+    def discard(self):
+        """
+        Throw away the temporary file, leaving any existing output file as it was.
+        :return:
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self.kev_fp.close()
+        os.remove(self.temp_filename)
+
+    def suspend(self):
+        """
+        Close the temporary file and leave it in place, so that a run stopped part way through can carry on
+        from its last checkpoint.
+        :return:
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self.kev_fp.close()
@@ -0,0 +1 @@
+from .KEVWriter import KEVWriter
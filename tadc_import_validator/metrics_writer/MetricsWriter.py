@@ -0,0 +1,111 @@
+import io
+import os
+import json
+from logbook import Logger
+
+__author__ = 'timhodson'
+
+log = Logger('MetricsWriter')
+
+
+class MetricsWriter:
+    """
+    Writes the counters for a validation run to a JSON file, or a Prometheus text file for the node exporter's
+    textfile collector, so that throughput can be tracked across import jobs. The file is written during the
+    run and at the end, and each time replaces the last in one step so nothing ever reads half of it.
+    """
+
+    FORMATS = ['json', 'prometheus']
+    PREFIX = 'tadc_validator_'
+    # (key in the metrics dict, metric name, type, help)
+    COUNTERS = [
+        ('rows', 'rows_total', 'counter', 'Rows validated'),
+        ('valid', 'valid_rows_total', 'counter', 'Valid rows'),
+        ('invalid', 'invalid_rows_total', 'counter', 'Invalid rows, including rows which could not be validated'),
+        ('exceptions', 'exception_rows_total', 'counter', 'Rows which could not be validated'),
+        ('errors', 'errors_total', 'counter', 'Errors found'),
+        ('fixed_rows', 'fixed_rows_total', 'counter', 'Rows written to the fixed file'),
+        ('dates_fixed', 'dates_fixed_total', 'counter', 'Dates converted to YYYY/MM/DD'),
+        ('dates_not_fixed', 'dates_not_fixed_total', 'counter', 'Dates which could not be converted'),
+        ('finished', 'finished', 'gauge', '1 once the run has finished, 0 while it is running'),
+        ('timestamp', 'last_update_timestamp_seconds', 'gauge', 'When the metrics were written'),
+    ]
+    PROGRESS = [
+        ('elapsed', 'elapsed_seconds', 'gauge', 'Seconds since the run started'),
+        ('rows_per_second', 'rows_per_second', 'gauge', 'Rows validated per second'),
+        ('bytes', 'input_read_bytes', 'gauge', 'Bytes of the input read'),
+        ('total_bytes', 'input_bytes', 'gauge', 'Size of the input'),
+        ('mb_per_second', 'input_read_megabytes_per_second', 'gauge', 'Megabytes of the input read per second'),
+        ('percent', 'progress_percent', 'gauge', 'Percentage of the input read'),
+        ('eta', 'eta_seconds', 'gauge', 'Estimated seconds until the run finishes'),
+    ]
+
+    def __init__(self, metrics_filename, metrics_format='json'):
+        if metrics_format not in self.FORMATS:
+            raise ValueError("Metrics format should be one of {}".format(", ".join(self.FORMATS)))
+        self.metrics_filename = metrics_filename
+        self.metrics_format = metrics_format
+
+    def write(self, metrics):
+        """
+        Replace the metrics file.
+        :param metrics: dict from CSVFileValidator.get_metrics()
+        :return:
+        """
+        temp_filename = "{}.{}.tmp".format(self.metrics_filename, os.getpid())
+        if self.metrics_format == 'json':
+            with open(temp_filename, 'w') as metrics_fp:
+                json.dump(metrics, metrics_fp, indent=2, sort_keys=True, separators=(",", ": "))
+        else:
+            with io.open(temp_filename, 'w', encoding='utf-8') as metrics_fp:
+                metrics_fp.write(self.to_prometheus(metrics))
+        os.rename(temp_filename, self.metrics_filename)
+
+    @staticmethod
+    def escape(value):
+        return u"{}".format(value).replace(u'\\', u'\\\\').replace(u'"', u'\\"').replace(u'\n', u'\\n')
+
+    def format_labels(self, labels):
+        return u",".join(u'{}="{}"'.format(name, self.escape(value)) for name, value in labels)
+
+    def add_metric(self, lines, name, metric_type, help_text, samples):
+        """
+        Add a metric in the Prometheus text format.
+        :param lines: list the lines are added to
+        :param name: without the prefix
+        :param metric_type: 'counter' or 'gauge'
+        :param help_text:
+        :param samples: list of (labels, value), labels a list of (name, value)
+        :return:
+        """
+        name = self.PREFIX + name
+        lines.append(u"# HELP {} {}".format(name, help_text))
+        lines.append(u"# TYPE {} {}".format(name, metric_type))
+        for labels, value in samples:
+            lines.append(u"{}{{{}}} {}".format(name, self.format_labels(labels), repr(float(value))))
+
+    def to_prometheus(self, metrics):
+        """
+        The metrics in the Prometheus text format, labelled with the file name.
+        :param metrics:
+        :return: text
+        """
+        file_label = [('file', metrics["file"])]
+        lines = []
+        for key, name, metric_type, help_text in self.COUNTERS:
+            self.add_metric(lines, name, metric_type, help_text, [(file_label, metrics[key])])
+        progress = metrics["progress"]
+        for key, name, metric_type, help_text in self.PROGRESS:
+            if progress.get(key) is not None:
+                self.add_metric(lines, name, metric_type, help_text, [(file_label, progress[key])])
+        self.add_metric(lines, 'column_errors_total', 'counter', 'Errors found in each column', [
+            (file_label + [('column', column)], count) for column, count in sorted(metrics["column_errors"].items())])
+        self.add_metric(lines, 'rule_errors_total', 'counter', 'Times each rule failed', [
+            (file_label + [('rule', rule)], count) for rule, count in sorted(metrics["rule_errors"].items())])
+        if metrics.get("stages"):
+            stages = sorted(metrics["stages"].items())
+            self.add_metric(lines, 'stage_seconds_total', 'counter', 'Seconds spent in each stage, with --profile', [
+                (file_label + [('stage', stage)], timing["seconds"]) for stage, timing in stages])
+            self.add_metric(lines, 'stage_calls_total', 'counter', 'Calls to each stage, with --profile', [
+                (file_label + [('stage', stage)], timing["calls"]) for stage, timing in stages])
+        return u"\n".join(lines) + u"\n"
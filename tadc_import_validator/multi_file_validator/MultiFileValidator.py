@@ -0,0 +1,254 @@
+import os
+import glob
+import multiprocessing
+from logbook import Logger, Handler, LogRecord
+from ..csv_file_validator import CSVFileValidator
+from ..error_summary import ErrorSummary
+from ..profiler import Profiler
+from ..csv_io import CSVIO
+
+__author__ = 'timhodson'
+
+log = Logger('MultiFileValidator')
+
+# Labels of the files this tool writes next to its input, which are skipped when looking through a directory.
+OUTPUT_LABELS = ['fixed', 'invalid']
+
+
+def find_csv_files(paths):
+    """
+    Expand a list of files, directories and glob patterns into the CSV files to validate.
+    Directories give the .csv files directly inside them, compressed or not, apart from output files written by
+    an earlier run.
+    :param paths:
+    :return: list of file names in the order given, each only once
+    """
+    csv_files = []
+    real_paths = set()
+    for path in paths:
+        if os.path.isdir(path):
+            names = [(name, CSVIO.strip_compression(name)) for name in sorted(os.listdir(path))]
+            found = [os.path.join(path, name) for name, csv_name in names
+                     if csv_name.lower().endswith('.csv')
+                     and os.path.splitext(os.path.splitext(csv_name)[0])[1][1:] not in OUTPUT_LABELS]
+        elif glob.has_magic(path):
+            found = sorted(glob.glob(path))
+        else:
+            found = [path]
+        if not found:
+            log.warning("No CSV files found for {}".format(path))
+        for csv_file in found:
+            # the same file may be reached by different paths, e.g. dir/ and 'dir/*.csv'
+            real_path = os.path.realpath(csv_file)
+            if real_path not in real_paths:
+                real_paths.add(real_path)
+                csv_files.append(csv_file)
+    return csv_files
+
+
+class RecordCollector(Handler):
+    """
+    Keeps the log records from a worker process so that they can be sent back and logged by the main process.
+    """
+
+    def __init__(self):
+        Handler.__init__(self, bubble=False)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record.to_dict(json_safe=True))
+
+
+def validate_file_task(task):
+    """
+    Validate one file. This runs in a worker process.
+    :param task: tuple of (csv_file, options for CSVFileValidator, profile, collect_logs)
+    :return: dict describing the outcome, with the log records if they were collected
+    """
+    csv_file, options, profile, collect_logs = task
+    collector = RecordCollector() if collect_logs else None
+    if collector is not None:
+        collector.push_application()
+    outcome = {"csv_file": csv_file, "exception": None, "records": []}
+    try:
+        profiler = Profiler() if profile else None
+        with CSVFileValidator(csv_file=csv_file, profiler=profiler, **options) as validator:
+            validator.validate_file()
+        outcome.update({
+            "rows": validator.row_count,
+            "valid": validator.valid_count,
+            "invalid": validator.invalid_count,
+            "stopped_early": validator.stopped_early,
+            "error_summary": validator.error_summary,
+            "fixed_filename": validator.get_fixed_filename(),
+            "invalid_filename": validator.get_invalid_filename(),
+            "profile": profiler.timings if profiler is not None else None,
+        })
+    except Exception as e:
+        log.error("Could not validate {}: {}".format(csv_file, e))
+        outcome["exception"] = "{}".format(e)
+    finally:
+        if collector is not None:
+            collector.pop_application()
+            outcome["records"] = collector.records
+    return outcome
+
+
+class MultiFileValidator:
+    """
+    Validates several CSV files in one run, sharing a pool of worker processes between them.
+    Each file is validated by a CSVFileValidator in one of the workers, and writes its own fixed and invalid
+    files as usual. Log messages from each worker are held until its file is done, so the messages for each
+    file appear together in the log. A summary for each file and the error counts for all of them are logged
+    at the end.
+    """
+
+    def __init__(self, csv_files, workers=1, profiler=None, **options):
+        """
+        :param csv_files: list of CSV file names, see find_csv_files()
+        :param workers: number of files validated at once
+        :param profiler: optional Profiler, which collects the timings from every file
+        :param options: passed on to each CSVFileValidator
+        """
+        self.csv_files = csv_files
+        self.workers = int(workers)
+        self.profiler = profiler
+        self.options = options
+        self.report_file = options.pop('report_file', None)
+        self.metrics_file = options.pop('metrics_file', None)
+        self.kev_file = options.pop('kev_file', None)
+        self.outcomes = []
+        self.failed_count = 0
+        self.error_summary = ErrorSummary(max_examples=0)
+        self.file_labels = self.get_file_labels(csv_files)
+
+    @staticmethod
+    def get_file_labels(csv_files):
+        """
+        Name each file for its report, metrics and KEV files. The file name is used, e.g. a/file.csv -> file,
+        unless two files have the same name, when as many of the directories above those files are added as it
+        takes to tell them apart, e.g. a/file.csv -> a.file and b/file.csv -> b.file.
+        :param csv_files:
+        :return: dict of CSV file name -> label
+        """
+        parts = {}
+        depths = {}
+        for csv_file in csv_files:
+            path = os.path.splitext(CSVIO.strip_compression(os.path.abspath(csv_file)))[0]
+            parts[csv_file] = [part for part in path.split(os.sep) if part]
+            depths[csv_file] = 1
+        while True:
+            labels = dict((csv_file, '.'.join(parts[csv_file][-depths[csv_file]:])) for csv_file in csv_files)
+            files_by_label = {}
+            for csv_file in csv_files:
+                files_by_label.setdefault(labels[csv_file], []).append(csv_file)
+            clashes = [same_label for same_label in files_by_label.values() if len(same_label) > 1]
+            if not clashes:
+                return labels
+            for same_label in clashes:
+                for csv_file in same_label:
+                    if depths[csv_file] >= len(parts[csv_file]):
+                        raise ValueError("The output files for {} would have the same names".format(
+                            ', '.join(same_label)))
+                    depths[csv_file] += 1
+
+    def get_per_file_name(self, filename, csv_file):
+        """
+        Each file gets its own report, metrics and KEV file, named after the one given and the CSV file,
+        e.g. report.jsonl and file.csv -> report.file.jsonl
+        """
+        if not filename:
+            return None
+        base, extension = os.path.splitext(filename)
+        return "{}.{}{}".format(base, self.file_labels[csv_file], extension)
+
+    def get_report_filename(self, csv_file):
+        return self.get_per_file_name(self.report_file, csv_file)
+
+    def get_metrics_filename(self, csv_file):
+        return self.get_per_file_name(self.metrics_file, csv_file)
+
+    def get_kev_filename(self, csv_file):
+        return self.get_per_file_name(self.kev_file, csv_file)
+
+    def uses_pool(self):
+        return self.workers > 1 and len(self.csv_files) > 1
+
+    def get_tasks(self):
+        collect_logs = self.uses_pool()
+        tasks = []
+        for csv_file in self.csv_files:
+            options = dict(self.options, report_file=self.get_report_filename(csv_file),
+                           metrics_file=self.get_metrics_filename(csv_file),
+                           kev_file=self.get_kev_filename(csv_file))
+            tasks.append((csv_file, options, self.profiler is not None, collect_logs))
+        return tasks
+
+    def iter_outcomes(self):
+        """
+        Generator which validates the files and yields the outcome for each, in the order the files were given.
+        :return:
+        """
+        tasks = self.get_tasks()
+        if not self.uses_pool():
+            for task in tasks:
+                yield validate_file_task(task)
+            return
+        pool = multiprocessing.Pool(processes=min(self.workers, len(tasks)))
+        try:
+            for outcome in pool.imap(validate_file_task, tasks):
+                yield outcome
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def validate_files(self):
+        """
+        Validate every file and log a summary of all of them. A file which can't be validated doesn't stop the
+        others, it is counted in failed_count.
+        :return:
+        """
+        log.info("Validating {} files with {} workers".format(len(self.csv_files), self.workers))
+        if self.profiler is not None:
+            self.profiler.start()
+        for outcome in self.iter_outcomes():
+            for record in outcome["records"]:
+                record = LogRecord.from_dict(record)
+                Logger(record.channel).handle(record)
+            outcome["records"] = []
+            self.outcomes.append(outcome)
+            if outcome["exception"] is not None:
+                self.failed_count += 1
+            else:
+                self.error_summary.merge(outcome["error_summary"])
+                if outcome["profile"]:
+                    self.profiler.merge(outcome["profile"])
+        if self.profiler is not None:
+            self.profiler.stop()
+        self.print_summary()
+
+    def print_summary(self):
+        """
+        Log the counts for each file and the error counts for all of the files together.
+        :return:
+        """
+        log.info("Summary of {} files".format(len(self.outcomes)))
+        rows = valid = invalid = 0
+        for outcome in self.outcomes:
+            if outcome["exception"] is not None:
+                log.error(" - {}: could not be validated: {}".format(outcome["csv_file"], outcome["exception"]))
+                continue
+            rows += outcome["rows"]
+            valid += outcome["valid"]
+            invalid += outcome["invalid"]
+            stopped = ""
+            if outcome["stopped_early"]:
+                stopped = ", stopped early: {}".format(outcome["stopped_early"])
+            log.info(" - {}: {} rows, {} valid, {} invalid{}".format(outcome["csv_file"], outcome["rows"],
+                                                                     outcome["valid"], outcome["invalid"], stopped))
+        log.info("All files: {} rows, {} valid, {} invalid".format(rows, valid, invalid))
+        if self.failed_count:
+            log.error("{} of {} files could not be validated".format(self.failed_count, len(self.outcomes)))
+        if self.error_summary.has_errors():
+            self.error_summary.print_counts()
@@ -0,0 +1 @@
+from .MultiFileValidator import MultiFileValidator, find_csv_files, validate_file_task
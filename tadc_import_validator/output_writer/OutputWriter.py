@@ -0,0 +1,210 @@
+import os
+from logbook import Logger
+from ..tadc_import_row import TADCImportRow
+from ..csv_io import CSVIO
+
+__author__ = 'timhodson'
+
+log = Logger('OutputWriter')
+
+
+class OutputWriter:
+    """
+    Writes valid rows, with any fixes, to one CSV file and invalid rows, with the reasons they are invalid
+    in an extra column, to another.
+    Rows are written in batches through large buffers into temporary files, which replace the output files
+    in one step when the writer is closed. A run that fails part way leaves any earlier output alone, and
+    running again replaces the files rather than adding to them. The temporary files are named with the process
+    id, e.g. file.fixed.csv.1234.tmp, so runs at the same time don't write over each other's.
+    Either output can instead be a stream opened with CSVIO.open_stream(), e.g. stdout in a pipeline.
+    Streams are written as they are, flushed after each batch so rows keep flowing, and left open.
+    For checkpoints, get_state() gives the names and lengths of the temporary files, and a writer made with
+    that state cuts them back to those lengths and carries on writing them.
+    """
+
+    def __init__(self, valid_filename, invalid_filename, csv_io=None, buffer_size=1024 * 1024, batch_size=1000,
+                 resume=None):
+        """
+        :param valid_filename: where to write valid (fixed) rows, a filename or a stream
+        :param invalid_filename: where to write invalid rows and their reasons, a filename, a stream or None
+            to not write them
+        :param csv_io: CSVIO used to write the files
+        :param buffer_size: size of the file buffers
+        :param batch_size: number of rows held before they are handed to the CSV writer
+        :param resume: state from get_state() to carry on from, the temporary files must still be there
+        """
+        self.csv_io = csv_io or CSVIO()
+        self.batch_size = batch_size
+        self.valid_filename = valid_filename
+        self.invalid_filename = invalid_filename
+        self.valid_count = 0
+        self.invalid_count = 0
+        self._lengths = {}
+        # output filename -> temporary filename
+        self._temp_filenames = {}
+        if resume is not None:
+            self.valid_count = resume["valid_count"]
+            self.invalid_count = resume["invalid_count"]
+            self._lengths = resume["lengths"]
+            self._temp_filenames = resume["temp_filenames"]
+        self._outputs = []
+        self._valid = self._open_output(valid_filename, buffer_size)
+        self._invalid = self._open_output(invalid_filename, buffer_size)
+        self._closed = False
+
+    def _open_output(self, filename, buffer_size):
+        if filename is None:
+            return None
+        if hasattr(filename, 'write'):
+            fp = filename
+            temp_filename = None
+        else:
+            temp_filename = self._temp_filenames.get(filename) or "{}.{}.tmp".format(filename, os.getpid())
+            mode = 'w'
+            if temp_filename in self._lengths:
+                # throw away anything written after the checkpoint
+                with open(temp_filename, 'r+b') as temp_fp:
+                    temp_fp.truncate(self._lengths[temp_filename])
+                mode = 'a'
+            fp = self.csv_io.open_file(temp_filename, mode, buffer_size,
+                                       compression=self.csv_io.get_compression(filename))
+        output = {"filename": filename, "temp_filename": temp_filename, "fp": fp,
+                  "writer": self.csv_io.writer(fp), "rows": []}
+        self._outputs.append(output)
+        return output
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+    def _add(self, output, row):
+        rows = output["rows"]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            output["writer"].writerows(rows)
+            del rows[:]
+            if output["temp_filename"] is None:
+                output["fp"].flush()
+
+    def write_valid(self, values):
+        """
+        Add a valid row.
+        :param values: the row values, e.g. RowResult.fixed
+        :return:
+        """
+        self.valid_count += 1
+        self._add(self._valid, values)
+
+    def write_invalid(self, values, errors, exception=None):
+        """
+        Add an invalid row, with the reasons it is invalid in an extra column.
+        :param values: the row values, None if they couldn't be read
+        :param errors: list of {"column": ..., "message": ...} dicts
+        :param exception: message of an exception raised while validating the row, used as the reason instead
+        :return:
+        """
+        self.invalid_count += 1
+        if self._invalid is None:
+            return
+        if values is None:
+            values = [u''] * len(TADCImportRow.COLUMNS)
+        reason = exception if exception is not None else TADCImportRow.format_errors(errors)
+        self._add(self._invalid, list(values) + [reason])
+
+    def get_state(self):
+        """
+        Write the rows held so far and get the counts and the name and length of each temporary file, so that
+        a later run can carry on from here. The files are synced to disk so the lengths are safe to save.
+        :return: dict which can be saved as JSON
+        """
+        lengths = {}
+        temp_filenames = {}
+        for output in self._outputs:
+            if output["temp_filename"] is None:
+                continue
+            temp_filenames[output["filename"]] = output["temp_filename"]
+            if output["rows"]:
+                output["writer"].writerows(output["rows"])
+                del output["rows"][:]
+            output["fp"].flush()
+            os.fsync(output["fp"].fileno())
+            lengths[output["temp_filename"]] = os.fstat(output["fp"].fileno()).st_size
+        return {"valid_count": self.valid_count, "invalid_count": self.invalid_count, "lengths": lengths,
+                "temp_filenames": temp_filenames}
+
+    @staticmethod
+    def can_resume(state):
+        """
+        Check that the temporary files for a state from get_state() are still there and long enough.
+        """
+        for temp_filename, length in state["lengths"].items():
+            if not os.path.exists(temp_filename) or os.path.getsize(temp_filename) < length:
+                return False
+        return True
+
+    def close(self):
+        """
+        Write any rows still held and move the finished files into place.
+        :return:
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for output in self._outputs:
+            if output["rows"]:
+                output["writer"].writerows(output["rows"])
+                del output["rows"][:]
+            if output["temp_filename"] is None:
+                output["fp"].flush()
+            else:
+                output["fp"].close()
+                os.rename(output["temp_filename"], output["filename"])
+        log.info("Wrote {} valid rows to {} and {} invalid rows to {}".format(
+            self.valid_count, self.describe(self._valid), self.invalid_count, self.describe(self._invalid)))
+
+    def discard(self):
+        """
+        Throw away the temporary files, leaving any existing output files as they were.
+        Rows already written to a stream can't be taken back, but rows still held are dropped.
+        :return:
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for output in self._outputs:
+            del output["rows"][:]
+            if output["temp_filename"] is None:
+                output["fp"].flush()
+            else:
+                output["fp"].close()
+                os.remove(output["temp_filename"])
+
+    def suspend(self):
+        """
+        Close the temporary files and leave them in place, so that a run stopped part way through can carry on
+        from its last checkpoint. Rows still held are dropped.
+        :return:
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for output in self._outputs:
+            del output["rows"][:]
+            if output["temp_filename"] is None:
+                output["fp"].flush()
+            else:
+                output["fp"].close()
+
+    @staticmethod
+    def describe(output):
+        if output is None:
+            return "nowhere"
+        if output["temp_filename"] is None:
+            return getattr(output["fp"], "name", "a stream")
+        return output["filename"]
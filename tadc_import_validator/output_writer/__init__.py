@@ -0,0 +1 @@
+from .OutputWriter import OutputWriter
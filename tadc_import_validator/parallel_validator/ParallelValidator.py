@@ -0,0 +1,181 @@
+import os
+import itertools
+import collections
+import multiprocessing
+from logbook import Logger
+from ..tadc_import_row import validate_rows, validate_batches, DateNormaliser
+from ..profiler import Profiler
+from ..csv_io import CSVIO, RecordScanner
+
+__author__ = 'timhodson'
+
+log = Logger('ParallelValidator')
+
+# Read size used when scanning a file for chunk boundaries.
+SCAN_BLOCK_SIZE = 1024 * 1024
+# Upper bound on the amount of the file a single worker task reads in one go.
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+# Chunks handed to the pool for each worker and not yet consumed, so the results waiting for a slow consumer
+# are bounded.
+PENDING_CHUNKS_PER_WORKER = 2
+
+
+def find_chunk_offsets(csv_file_name, chunk_count, block_size=SCAN_BLOCK_SIZE, start=0):
+    """
+    Split a CSV file into byte ranges which each start at the beginning of a CSV record.
+    The file is read through with a RecordScanner, which knows whether a newline is inside a quoted field,
+    and each range starts at the first record which ends after its target offset.
+    :param csv_file_name:
+    :param chunk_count: how many ranges we would like, fewer may be returned for small files
+    :param block_size:
+    :param start: byte offset of a record to split the file from, the file before it is left out
+    :return: list of (start, end) byte offsets
+    """
+    file_size = os.path.getsize(csv_file_name)
+    targets = [start + (file_size - start) * i // chunk_count for i in range(1, chunk_count)]
+    offsets = [start]
+    scanner = RecordScanner()
+    position = start
+    with open(csv_file_name, 'rb') as fp:
+        fp.seek(start)
+        while targets:
+            block = fp.read(block_size)
+            if not block:
+                break
+            scanned = 0
+            while targets:
+                # the block up to the next target only needs scanning through
+                target = min(max(targets[0] - position, scanned), len(block))
+                scanner.find_last_end(block, scanned, target)
+                scanned = target
+                end = scanner.find_end(block, scanned)
+                if end is None:
+                    break
+                scanned = end
+                boundary = position + end
+                if offsets[-1] < boundary < file_size:
+                    offsets.append(boundary)
+                while targets and targets[0] < boundary:
+                    targets.pop(0)
+            position += len(block)
+    offsets.append(file_size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def validate_chunk(task):
+    """
+    Validate every record in a byte range of a CSV file. This runs in a worker process.
+    :param task: tuple of (csv_file_name, start, end, old_date_format, fix_missing, engine, profile, csv_io, schema)
+    :return: a list of RowResults in file order, numbered from 0 at the start of the range,
+             and a dict of the date normaliser counts and profile timings for the range
+    """
+    csv_file_name, start, end, old_date_format, fix_missing, engine, profile, csv_io, schema = task
+    profiler = Profiler() if profile else None
+    with open(csv_file_name, 'rb') as fp:
+        fp.seek(start)
+        data = fp.read(end - start)
+    csvreader = csv_io.reader_for_bytes(data)
+    if profiler is not None:
+        csvreader = profiler.time_iterator('read csv', csvreader)
+    date_normaliser = DateNormaliser(old_date_format)
+    if engine == 'row':
+        results = list(validate_rows(csvreader, old_date_format=old_date_format, fix_missing=fix_missing,
+                                     date_normaliser=date_normaliser, profiler=profiler))
+    else:
+        results = list(validate_batches(csvreader, old_date_format=old_date_format, fix_missing=fix_missing,
+                                        date_normaliser=date_normaliser, profiler=profiler, schema=schema))
+    stats = {
+        "dates": date_normaliser.get_counts(),
+        "profile": profiler.timings if profiler is not None else None,
+    }
+    return results, stats
+
+
+class ParallelValidator:
+    """
+    Validates a CSV file using a pool of worker processes.
+    Each row is validated independently so the file is split into chunks at record boundaries,
+    the chunks are validated concurrently and the results handed back in the original file order.
+    While the results for a chunk are handed back, resume_point gives the row number and byte offset just after it.
+    """
+
+    def __init__(self, csv_file_name, workers, old_date_format, fix_missing=False, engine='batch', profiler=None,
+                 csv_io=None, schema=None, start=0, first_row_number=0):
+        """
+        :param start: byte offset of the record to start from, e.g. from a checkpoint
+        :param first_row_number: row number of the record at start
+        """
+        self.csv_file_name = csv_file_name
+        self.workers = int(workers)
+        self.old_date_format = old_date_format
+        self.fix_missing = fix_missing
+        self.engine = engine
+        self.date_counts = {}
+        self.profiler = profiler
+        self.csv_io = csv_io or CSVIO()
+        self.schema = schema
+        self.start = start
+        self.first_row_number = first_row_number
+        self.resume_point = (first_row_number, start)
+
+    def get_chunks(self):
+        """
+        Work out the byte ranges handed to the workers.
+        Several chunks per worker keeps them all busy, and big files get more chunks of at most about
+        MAX_CHUNK_SIZE, so that together with the limit on pending chunks in iter_chunk_results() the results
+        held in memory at any time stay bounded.
+        :return:
+        """
+        file_size = os.path.getsize(self.csv_file_name) - self.start
+        chunk_count = max(self.workers * 4, file_size // MAX_CHUNK_SIZE + 1)
+        return find_chunk_offsets(self.csv_file_name, chunk_count, start=self.start)
+
+    def iter_results(self):
+        """
+        Generator yielding a RowResult for every record in the file from start, header rows included, in file order.
+        :return:
+        """
+        chunks = self.get_chunks()
+        log.info("Validating {} chunks with {} workers".format(len(chunks), self.workers))
+        tasks = [(self.csv_file_name, start, end, self.old_date_format, self.fix_missing, self.engine,
+                  self.profiler is not None, self.csv_io, self.schema)
+                 for start, end in chunks]
+        pool = multiprocessing.Pool(processes=self.workers)
+        row_counter = self.first_row_number
+        try:
+            chunk_results = self.iter_chunk_results(pool, tasks)
+            if self.profiler is not None:
+                chunk_results = self.profiler.time_iterator('wait for workers', chunk_results)
+            for index, (results, stats) in enumerate(chunk_results):
+                self.resume_point = (row_counter + len(results), chunks[index][1])
+                for name, count in stats["dates"].items():
+                    self.date_counts[name] = self.date_counts.get(name, 0) + count
+                if stats["profile"]:
+                    self.profiler.merge(stats["profile"])
+                for result in results:
+                    yield result._replace(row_number=row_counter)
+                    row_counter += 1
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def iter_chunk_results(self, pool, tasks):
+        """
+        Generator yielding the result of validate_chunk() for each task in order. At most
+        PENDING_CHUNKS_PER_WORKER chunks per worker, counting the one being consumed, are handed to the pool at a
+        time, so when the results are used more slowly than the workers make them, the workers wait rather than
+        the finished results piling up in memory.
+        :param pool:
+        :param tasks: list of validate_chunk() tasks
+        :return:
+        """
+        tasks = iter(tasks)
+        pending = collections.deque(pool.apply_async(validate_chunk, (task,))
+                                    for task in itertools.islice(tasks, self.workers * PENDING_CHUNKS_PER_WORKER))
+        while pending:
+            yield pending.popleft().get()
+            # the next chunk is only handed out once the consumer is done with this one
+            task = next(tasks, None)
+            if task is not None:
+                pending.append(pool.apply_async(validate_chunk, (task,)))
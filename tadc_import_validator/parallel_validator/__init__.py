@@ -0,0 +1 @@
+from .ParallelValidator import ParallelValidator, find_chunk_offsets, validate_chunk
@@ -0,0 +1,113 @@
+import json
+from timeit import default_timer as timer
+from logbook import Logger
+
+__author__ = 'timhodson'
+
+log = Logger('Profiler')
+
+
+class Profiler:
+    """
+    Collects wall clock time and call counts for the stages of a validation run and for each column rule.
+    Nothing is timed unless a Profiler is handed to the validator, the timed wrappers are only put in place
+    when profiling so a normal run pays nothing for it.
+    Stages are timed separately so they don't overlap, anything not covered by a stage is reported as 'other'.
+    Timings merged from worker processes add up the time spent in every worker, so can be more than the total.
+    """
+
+    def __init__(self):
+        # stage name -> [seconds, calls]
+        self.timings = {}
+        self.total = 0.0
+        self._started = None
+
+    def add(self, name, seconds, calls=1):
+        timing = self.timings.get(name)
+        if timing is None:
+            self.timings[name] = [seconds, calls]
+        else:
+            timing[0] += seconds
+            timing[1] += calls
+
+    def wrap(self, name, function):
+        """
+        Wrap a function so that every call to it is timed.
+        :param name: stage name
+        :param function:
+        :return: the wrapped function
+        """
+        timing = self.timings.setdefault(name, [0.0, 0])
+
+        def timed(*args, **kwargs):
+            start = timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timing[0] += timer() - start
+                timing[1] += 1
+        return timed
+
+    def time_iterator(self, name, iterable):
+        """
+        Generator which times how long each item takes to be produced, e.g. reading rows from a CSV reader.
+        :param name: stage name
+        :param iterable:
+        :return:
+        """
+        timing = self.timings.setdefault(name, [0.0, 0])
+        iterator = iter(iterable)
+        while True:
+            start = timer()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                timing[0] += timer() - start
+                return
+            timing[0] += timer() - start
+            timing[1] += 1
+            yield item
+
+    def start(self):
+        self._started = timer()
+
+    def stop(self):
+        self.total += timer() - self._started
+
+    def merge(self, timings):
+        """
+        Add timings from another profiler, e.g. one used in a worker process.
+        :param timings: dict of stage name -> [seconds, calls]
+        :return:
+        """
+        for name, (seconds, calls) in timings.items():
+            self.add(name, seconds, calls)
+
+    def get_ranked(self):
+        """
+        Stages ordered by time taken, slowest first, with 'other' for time not covered by any stage.
+        :return: list of (name, seconds, calls)
+        """
+        ranked = sorted([(name, seconds, calls) for name, (seconds, calls) in self.timings.items() if calls],
+                        key=lambda timing: timing[1], reverse=True)
+        other = self.total - sum(seconds for name, seconds, calls in ranked)
+        if other > 0:
+            ranked.append(('other', other, 0))
+        return ranked
+
+    def log_report(self):
+        log.info("Profile: {:.3f}s in total".format(self.total))
+        for name, seconds, calls in self.get_ranked():
+            percent = 100.0 * seconds / self.total if self.total else 0.0
+            log.info(" - {:<45} {:>9.3f}s {:>6.1f}% {:>10} calls".format(name, seconds, percent, calls))
+
+    def to_dict(self):
+        return {
+            "total": self.total,
+            "stages": [{"name": name, "seconds": seconds, "calls": calls} for name, seconds, calls in self.get_ranked()],
+        }
+
+    def write_json(self, filename):
+        with open(filename, 'w') as profile_fp:
+            json.dump(self.to_dict(), profile_fp, indent=2, sort_keys=True, separators=(",", ": "))
+        log.info("Profile written to {}".format(filename))
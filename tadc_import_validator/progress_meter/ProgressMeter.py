@@ -0,0 +1,73 @@
+import datetime
+from timeit import default_timer as timer
+
+__author__ = 'timhodson'
+
+MEGABYTE = 1024.0 * 1024.0
+
+
+class ProgressMeter:
+    """
+    Works out how far a run has got through its input and how fast it is going, from the number of rows
+    validated and the byte offset reached in the input file. Nothing is measured until measure() is called,
+    so it costs nothing between progress messages.
+    Rates are for this run, so a run which resumed from a checkpoint is measured from where it started.
+    """
+
+    def __init__(self, total_bytes=None, rows=0, position=0):
+        """
+        :param total_bytes: size of the input, None if it isn't known, e.g. for stdin
+        :param rows: rows already validated when the run started
+        :param position: byte offset the run started from
+        """
+        self.total_bytes = total_bytes
+        self._start_rows = rows
+        self._start_position = position or 0
+        self._started = timer()
+
+    def measure(self, rows, position=None):
+        """
+        :param rows: rows validated so far
+        :param position: byte offset reached in the input, None if it isn't known
+        :return: dict of rows, elapsed, rows_per_second and, when the position is known, bytes,
+            mb_per_second and with the total size total_bytes, percent and eta (seconds, None until it is known)
+        """
+        elapsed = timer() - self._started
+        progress = {
+            "rows": rows,
+            "elapsed": elapsed,
+            "rows_per_second": (rows - self._start_rows) / elapsed if elapsed > 0 else 0.0,
+        }
+        if position is None:
+            return progress
+        bytes_per_second = (position - self._start_position) / elapsed if elapsed > 0 else 0.0
+        progress["bytes"] = position
+        progress["mb_per_second"] = bytes_per_second / MEGABYTE
+        if self.total_bytes:
+            progress["total_bytes"] = self.total_bytes
+            progress["percent"] = min(100.0, 100.0 * position / self.total_bytes)
+            remaining = max(0, self.total_bytes - position)
+            progress["eta"] = remaining / bytes_per_second if bytes_per_second > 0 else None
+        return progress
+
+    @staticmethod
+    def format_seconds(seconds):
+        return str(datetime.timedelta(seconds=int(round(seconds))))
+
+    @classmethod
+    def describe(cls, progress):
+        """
+        A progress dict from measure() as text for a log message, e.g.
+        45.2% of 1024.0 MB, 85000 rows/s, 40.1 MB/s, ETA 0:01:23
+        """
+        parts = []
+        if "percent" in progress:
+            parts.append("{:.1f}% of {:.1f} MB".format(progress["percent"], progress["total_bytes"] / MEGABYTE))
+        elif "bytes" in progress:
+            parts.append("{:.1f} MB read".format(progress["bytes"] / MEGABYTE))
+        parts.append("{:.0f} rows/s".format(progress["rows_per_second"]))
+        if "mb_per_second" in progress:
+            parts.append("{:.1f} MB/s".format(progress["mb_per_second"]))
+        if progress.get("eta"):
+            parts.append("ETA {}".format(cls.format_seconds(progress["eta"])))
+        return ", ".join(parts)
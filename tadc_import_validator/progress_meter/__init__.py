@@ -0,0 +1 @@
+from .ProgressMeter import ProgressMeter
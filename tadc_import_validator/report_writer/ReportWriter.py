@@ -0,0 +1,96 @@
+import os
+import json
+from logbook import Logger
+from ..csv_io import CSVIO
+
+__author__ = 'timhodson'
+
+log = Logger('ReportWriter')
+
+
+class ReportWriter:
+    """
+    Writes a machine readable report of invalid rows through a single buffered file handle.
+    Row numbers in the report are counted from 1 to match the error summary.
+    """
+
+    FORMATS = ['jsonl', 'csv']
+
+    def __init__(self, report_filename, report_format='jsonl', buffer_size=1024 * 1024, csv_io=None,
+                 resume_length=None):
+        """
+        :param report_filename:
+        :param report_format: 'jsonl' or 'csv'
+        :param buffer_size:
+        :param csv_io: CSVIO used to write csv reports
+        :param resume_length: length from get_length() to cut the report back to and carry on writing from
+        """
+        if report_format not in self.FORMATS:
+            raise ValueError("Report format should be one of {}".format(", ".join(self.FORMATS)))
+        self.report_filename = report_filename
+        self.report_format = report_format
+        self.report_csv_writer = None
+        mode = 'w'
+        if resume_length is not None:
+            with open(report_filename, 'r+b') as report_fp:
+                report_fp.truncate(resume_length)
+            mode = 'a'
+        if self.report_format == 'csv':
+            csv_io = csv_io or CSVIO()
+            self.report_fp = csv_io.open_file(report_filename, mode, buffer_size)
+            self.report_csv_writer = csv_io.writer(self.report_fp)
+            if resume_length is None:
+                self.report_csv_writer.writerow(['row', 'column', 'message'])
+        else:
+            self.report_fp = open(report_filename, mode + 'b', buffer_size)
+        log.info("Writing {} report to {}".format(self.report_format, self.report_filename))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        # let any exception carry on
+        return False
+
+    @staticmethod
+    def get_record(result):
+        """
+        The report record for an invalid row, as written to a JSON Lines report.
+        :param result: RowResult
+        :return:
+        """
+        record = {"row": result.row_number + 1, "errors": result.errors}
+        if result.exception is not None:
+            record["exception"] = result.exception
+        return record
+
+    def write_result(self, result):
+        """
+        Add a RowResult to the report. Valid rows are not reported.
+        :param result:
+        :return:
+        """
+        if result.valid:
+            return
+        if self.report_format == 'jsonl':
+            self.report_fp.write(json.dumps(self.get_record(result)).encode('utf-8') + b'\n')
+        else:
+            if result.exception is not None:
+                self.report_csv_writer.writerow([result.row_number + 1, '', result.exception])
+            for error in result.errors:
+                self.report_csv_writer.writerow([result.row_number + 1, error['column'], error['message']])
+
+    def get_length(self):
+        """
+        Write out everything so far and get the length of the report, e.g. for a checkpoint.
+        :return:
+        """
+        self.report_fp.flush()
+        os.fsync(self.report_fp.fileno())
+        return os.fstat(self.report_fp.fileno()).st_size
+
+    def close(self):
+        if self.report_fp:
+            self.report_fp.close()
+            self.report_fp = None
@@ -0,0 +1 @@
+from .ReportWriter import ReportWriter
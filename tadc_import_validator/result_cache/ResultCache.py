@@ -0,0 +1,122 @@
+import os
+import json
+import hashlib
+from logbook import Logger
+from ..tadc_import_row import TADCImportRow, RowResult, read_values
+
+__author__ = 'timhodson'
+
+log = Logger('ResultCache')
+
+
+class ResultCache:
+    """
+    A sidecar file which remembers the validation result of each row between runs, so that when a file
+    is fixed and validated again only new or changed rows have to be validated.
+    Rows are looked up by a hash of their content. The cache is thrown away if the rules version (or schema) or the
+    settings which change results (old date format and fix missing) are not the same as last time.
+    Only rows seen in the current run are saved, so the cache never grows larger than the file.
+    """
+
+    # Version of what is stored for each row. Bump this whenever it changes so old cache files are thrown away.
+    CACHE_VERSION = 2
+
+    def __init__(self, cache_filename, old_date_format, fix_missing=False, schema=None):
+        self.cache_filename = cache_filename
+        self.settings = {
+            "cache_version": self.CACHE_VERSION,
+            "rules_version": TADCImportRow.RULES_VERSION,
+            "old_date_format": old_date_format,
+            "fix_missing": bool(fix_missing),
+        }
+        if schema is not None:
+            # results from other rules can't be used
+            self.settings["schema"] = schema.hash
+        self._previous = {}
+        self._current = {}
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.cache_filename):
+            log.info("No result cache found at {}".format(self.cache_filename))
+            return
+        try:
+            with open(self.cache_filename) as cache_fp:
+                cache = json.load(cache_fp)
+        except ValueError:
+            log.warning("Ignoring unreadable result cache {}".format(self.cache_filename))
+            return
+        if cache.get("settings") != self.settings:
+            log.info("Result cache {} was made with different rules or settings, ignoring it".format(
+                self.cache_filename))
+            return
+        self._previous = cache.get("results", {})
+        log.info("Loaded {} cached results from {}".format(len(self._previous), self.cache_filename))
+
+    @staticmethod
+    def row_key(row):
+        """
+        Hash the content of a row. A separator that won't appear in the data keeps ['ab', ''] and ['a', 'b'] apart.
+        :param row:
+        :return:
+        """
+        return hashlib.sha1(u'\x1f'.join(row).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def unfixed_output(row, valid=True):
+        """
+        The output values of a row that didn't need fixing, so they don't need to be stored.
+        For valid rows this is what output_for_csv() gives, otherwise the values as read.
+        :param row:
+        :param valid:
+        :return:
+        """
+        output = read_values(row)
+        if not valid or output is None:
+            return output
+        return [u'' if value == u'None' else value for value in output]
+
+    def get(self, row, row_number):
+        """
+        Look up the cached result for a row.
+        :param row:
+        :param row_number:
+        :return: a RowResult or None if the row wasn't seen last time
+        """
+        key = self.row_key(row)
+        cached = self._current.get(key) or self._previous.get(key)
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._current[key] = cached
+        valid, errors, fixed, exception = cached
+        if fixed is None:
+            fixed = self.unfixed_output(row, valid)
+        return RowResult(row_number, valid, errors, fixed, exception)
+
+    def put(self, row, result):
+        """
+        Remember the result for a row.
+        :param row:
+        :param result: RowResult
+        :return:
+        """
+        fixed = result.fixed
+        if fixed is not None and fixed == self.unfixed_output(row, result.valid):
+            fixed = None
+        self._current[self.row_key(row)] = [result.valid, result.errors, fixed, result.exception]
+
+    def save(self):
+        """
+        Write the results from this run, replacing the old cache file in one step.
+        :return:
+        """
+        temp_filename = "{}.{}.tmp".format(self.cache_filename, os.getpid())
+        with open(temp_filename, 'w') as cache_fp:
+            json.dump({"settings": self.settings, "results": self._current}, cache_fp)
+        os.rename(temp_filename, self.cache_filename)
+        log.info("Result cache: {} rows reused, {} rows validated. Saved to {}".format(
+            self.hits, self.misses, self.cache_filename))
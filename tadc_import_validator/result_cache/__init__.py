@@ -0,0 +1 @@
+from .ResultCache import ResultCache
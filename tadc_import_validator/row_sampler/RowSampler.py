@@ -0,0 +1,193 @@
+import os
+import random
+from logbook import Logger
+from ..csv_io import CSVIO
+
+__author__ = 'timhodson'
+
+log = Logger('RowSampler')
+
+
+class RowSampler:
+    """
+    Reads a sample of the records in a CSV file by seeking to offsets spread through the file, so a quick
+    check of a huge file doesn't have to read all of it.
+    After a seek we don't know whether we are inside a quoted field, so the next newline is tried as the start
+    of a record and, if the quotes after it don't line up (a quote opening a field part way through it, or a
+    closing quote not followed by a comma or newline), the next newline which would end the quoted field is
+    used instead.
+    """
+
+    # how much of the file is read after each seek, more is read for records longer than this
+    READ_SIZE = 16 * 1024
+    # give up on a sample if no record is found within this much of the file
+    MAX_RECORD_SIZE = 1024 * 1024
+    # how far past a newline the quotes are checked when deciding if it starts a record
+    CHECK_SIZE = 4096
+
+    def __init__(self, csv_file_name, sample_size, header_rows=0, csv_io=None, random_sample=False, seed=None):
+        """
+        :param csv_file_name:
+        :param sample_size: number of records to read
+        :param header_rows: number of header rows, which are never sampled
+        :param csv_io: CSVIO used to parse the records
+        :param random_sample: seek to random offsets rather than evenly spread ones
+        :param seed: seed for the random offsets so that samples can be repeated
+        """
+        self.csv_file_name = csv_file_name
+        self.sample_size = int(sample_size)
+        self.header_rows = int(header_rows)
+        self.csv_io = csv_io or CSVIO()
+        self.random_sample = random_sample
+        self._random = random.Random(seed)
+
+    def read_more(self, fp, data):
+        """
+        Read the next part of the file onto the end of data.
+        :return: the longer data, or None at the end of the file or once MAX_RECORD_SIZE has been read
+        """
+        if len(data) >= self.MAX_RECORD_SIZE:
+            return None
+        more = fp.read(self.READ_SIZE)
+        if not more:
+            return None
+        return data + more
+
+    def read_record_end(self, fp, data, start, quotes=0):
+        """
+        Find the end of the record starting at start, counting quotes to skip newlines inside quoted fields and
+        reading more of the file until the end is found. The scan carries on from where it got to after each
+        read, so a long record is only looked through once.
+        :param fp: file positioned just after data
+        :param data: bytes
+        :param start:
+        :param quotes: quotes already seen in the record, 1 if start is inside a quoted field
+        :return: (data, offset just after the newline ending the record or None if there isn't one)
+        """
+        position = start
+        while True:
+            newline = data.find(b'\n', position)
+            if newline == -1:
+                more = self.read_more(fp, data)
+                if more is None:
+                    return data, None
+                data = more
+                continue
+            quotes += data.count(b'"', position, newline)
+            position = newline + 1
+            if quotes % 2 == 0:
+                return data, position
+
+    @staticmethod
+    def quotes_line_up(data, start, size):
+        """
+        Check that every quote after start opens a field, closes one or is an escaped quote, as it would
+        if start is the beginning of a record.
+        :param data: bytes
+        :param start:
+        :param size: how many bytes to check
+        :return:
+        """
+        inside = False
+        end = start + size
+        quote = data.find(b'"', start, end)
+        while quote != -1:
+            if not inside:
+                if quote > start and data[quote - 1:quote] not in (b',', b'\n'):
+                    return False
+                inside = True
+                quote = data.find(b'"', quote + 1, end)
+                continue
+            following = data[quote + 1:quote + 2]
+            if following == b'"':
+                quote = data.find(b'"', quote + 2, end)
+                continue
+            if following not in (b',', b'\r', b'\n', b''):
+                return False
+            inside = False
+            quote = data.find(b'"', quote + 1, end)
+        return True
+
+    def find_data_start(self, fp):
+        """
+        Byte offset of the first record after the header rows.
+        """
+        fp.seek(0)
+        data = fp.read(self.READ_SIZE)
+        offset = 0
+        for _ in range(self.header_rows):
+            data, offset = self.read_record_end(fp, data, offset)
+            if offset is None:
+                return None
+        return offset
+
+    def find_record(self, fp, offset, data_start):
+        """
+        Find the first record which starts at or after offset. Only as much of the file is read as it takes to
+        find where the record starts and then where it ends.
+        :return: (start, record bytes) or None if there isn't one
+        """
+        if offset <= data_start:
+            offset = data_start
+            skip = 0
+        else:
+            offset -= 1
+            skip = None
+        fp.seek(offset)
+        data = fp.read(self.READ_SIZE)
+        if skip is None:
+            newline = data.find(b'\n')
+            while newline == -1:
+                scanned = len(data)
+                data = self.read_more(fp, data)
+                if data is None:
+                    return None
+                newline = data.find(b'\n', scanned)
+            skip = newline + 1
+            while len(data) < skip + self.CHECK_SIZE:
+                more = self.read_more(fp, data)
+                if more is None:
+                    break
+                data = more
+            if not self.quotes_line_up(data, skip, self.CHECK_SIZE):
+                # we started inside a quoted field, so the record starts after the newline that ends it
+                data, skip = self.read_record_end(fp, data, skip, quotes=1)
+                if skip is None:
+                    return None
+        data, end = self.read_record_end(fp, data, skip)
+        if end is None:
+            # the last record in the file may not end with a newline
+            if skip >= len(data) or len(data) >= self.MAX_RECORD_SIZE:
+                return None
+            end = len(data)
+        return offset + skip, data[skip:end]
+
+    def get_offsets(self, data_start, file_size):
+        span = file_size - data_start
+        if self.random_sample:
+            return sorted(data_start + self._random.randrange(span) for _ in range(self.sample_size))
+        return [data_start + span * index // self.sample_size for index in range(self.sample_size)]
+
+    def iter_rows(self):
+        """
+        Generator yielding (byte offset, row) for each sampled record, in file order.
+        Records are only read once, so fewer than sample_size rows are given for small files.
+        :return:
+        """
+        file_size = os.path.getsize(self.csv_file_name)
+        with open(self.csv_file_name, 'rb') as fp:
+            data_start = self.find_data_start(fp)
+            if data_start is None or data_start >= file_size or self.sample_size < 1:
+                return
+            last_start = None
+            for offset in self.get_offsets(data_start, file_size):
+                found = self.find_record(fp, offset, data_start)
+                if found is None:
+                    continue
+                start, record = found
+                if start == last_start:
+                    continue
+                last_start = start
+                for row in self.csv_io.reader_for_bytes(record):
+                    yield start, row
+                    break
@@ -0,0 +1 @@
+from .RowSampler import RowSampler
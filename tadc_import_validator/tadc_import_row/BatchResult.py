@@ -0,0 +1,40 @@
+from .RowResult import RowResult
+
+__author__ = 'timhodson'
+
+
+class BatchResult:
+    """
+    The outcome of validating a block of rows with a BatchValidator or SchemaValidator.
+    """
+
+    def __init__(self, rows, error_mask, errors, exceptions):
+        # the row values after any fixes, one list of values per row. Rows which raised an exception
+        # have their values as read, or None if they couldn't be read
+        self.rows = rows
+        # column letter -> list of indexes of rows where that column failed validation
+        self.error_mask = error_mask
+        # row index -> list of {"column": ..., "message": ...} dicts, the same as TADCImportRow.get_errors()
+        self.errors = errors
+        # row index -> message of an exception raised while validating that row
+        self.exceptions = exceptions
+
+    def is_valid(self, index):
+        return index not in self.errors and index not in self.exceptions
+
+    def iter_results(self, first_row_number=0):
+        """
+        Generator yielding a RowResult for each row in the block.
+        :param first_row_number: row number given to the first row of the block
+        :return:
+        """
+        for index, values in enumerate(self.rows):
+            row_number = first_row_number + index
+            if index in self.exceptions:
+                yield RowResult(row_number, False, [], values, self.exceptions[index])
+            elif index in self.errors:
+                yield RowResult(row_number, False, self.errors[index], values, None)
+            else:
+                if u'None' in values:
+                    values = [u'' if value == u'None' else value for value in values]
+                yield RowResult(row_number, True, [], values, None)
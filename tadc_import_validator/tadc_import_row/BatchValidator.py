@@ -0,0 +1,259 @@
+import itertools
+from timeit import default_timer as timer
+from .TADCImportRow import TADCImportRow, text_type
+from .RowResult import read_values
+from .BatchResult import BatchResult
+from .DateNormaliser import DateNormaliser
+from .SchemaValidator import SchemaValidator
+
+__author__ = 'timhodson'
+
+
+class BatchValidator:
+    """
+    Validates a block of rows one column at a time.
+    Each rule in TADCImportRow.validationRules has a batch_ version here which checks a whole column
+    in a single pass, so the per cell cost is a comprehension step rather than a method call.
+    Results and error messages are the same as validating each row with TADCImportRow.
+    """
+
+    def __init__(self, old_date_format, fix_missing=False, date_normaliser=None, profiler=None):
+        self.old_date_format = old_date_format
+        self.fix_missing = fix_missing
+        if date_normaliser is None:
+            date_normaliser = DateNormaliser(old_date_format)
+        self.date_normaliser = date_normaliser
+        self.validationRules = TADCImportRow.validationRules
+        self._rules = [(letter, getattr(self, 'batch_' + self.validationRules[letter]['rule']))
+                       for letter in TADCImportRow.COLUMNS if 'rule' in self.validationRules[letter]]
+        # when profiling, time each rule with the same names as TADCImportRow uses
+        self.profiler = profiler
+        if profiler is not None:
+            self._rules = [(letter, profiler.wrap(TADCImportRow.rule_stage_name(letter), rule))
+                           for letter, rule in self._rules]
+        self._section_types = frozenset(TADCImportRow.SECTION_TYPES)
+        self._article_section_types = frozenset(TADCImportRow.ARTICLE_SECTION_TYPES)
+        self._extract_section_types = frozenset(TADCImportRow.EXTRACT_SECTION_TYPES)
+        self._sources = frozenset(TADCImportRow.SOURCES)
+        self._incidental_artwork_values = frozenset(TADCImportRow.INCIDENTAL_ARTWORK_VALUES)
+        self._reset([])
+
+    def _reset(self, rows):
+        self._rows = rows
+        self._columns = {}
+        self._lower_section_types = None
+        self._exceptions = {}
+
+    def validate_batch(self, rows):
+        """
+        Validate a block of rows.
+        :param rows: list of lists of values, e.g. read from a CSV reader
+        :return: BatchResult
+        """
+        if self.profiler is not None:
+            started = timer()
+        width = len(TADCImportRow.COLUMNS)
+        normalised = []
+        exceptions = {}
+        for index, row in enumerate(rows):
+            try:
+                values = [text_type(value).strip() for value in row[:width]]
+            except Exception as e:
+                exceptions[index] = "{}".format(e)
+                values = []
+            if len(values) < width:
+                values.extend([u''] * (width - len(values)))
+            normalised.append(values)
+
+        if not normalised:
+            return BatchResult([], {}, {}, exceptions)
+        self._reset(normalised)
+        self._exceptions = exceptions
+        self._columns = dict(zip(TADCImportRow.COLUMNS, [list(column) for column in zip(*normalised)]))
+        if self.profiler is not None:
+            self.profiler.add('load batch', timer() - started, len(normalised))
+
+        error_mask = {}
+        errors = {}
+        for letter, rule in self._rules:
+            failed = rule(letter, self._columns[letter])
+            if not failed:
+                continue
+            if self.profiler is not None:
+                started = timer()
+            error_mask[letter] = failed
+            name = self.validationRules[letter]['name']
+            error = self.validationRules[letter]['error']
+            values = self._columns[letter]
+            for index in failed:
+                errors.setdefault(index, []).append({
+                    "column": letter,
+                    "message": u"{} value: '{}' error: {}".format(name, values[index], error)
+                })
+            if self.profiler is not None:
+                self.profiler.add('error messages', timer() - started, len(failed))
+
+        for index in self._exceptions:
+            normalised[index] = read_values(rows[index])
+        result = BatchResult(normalised, error_mask, errors, self._exceptions)
+        self._reset([])
+        return result
+
+    def _set_value(self, letter, index, value):
+        """
+        Change a value in both the column and the row, used when fixing values.
+        """
+        self._columns[letter][index] = value
+        self._rows[index][TADCImportRow.COLUMN_INDEX[letter]] = value
+
+    def _set_exception(self, index, exception):
+        # the first exception stops a row being validated any further, so only keep that one
+        if index not in self._exceptions:
+            self._exceptions[index] = "{}".format(exception)
+
+    def _fix(self, letter, index):
+        """
+        Fix a value with the fix value from the rules.
+        """
+        try:
+            self._set_value(letter, index, self.validationRules[letter]['fix_value'])
+        except Exception as e:
+            self._set_exception(index, e)
+
+    def _section_types_lower(self):
+        if self._lower_section_types is None:
+            self._lower_section_types = [value.lower() for value in self._columns['H']]
+        return self._lower_section_types
+
+    def batch_validate_mandatory(self, letter, values):
+        return [index for index, value in enumerate(values) if not value]
+
+    def batch_validate_section_type(self, letter, values):
+        section_types = self._section_types
+        return [index for index, value in enumerate(self._section_types_lower()) if value not in section_types]
+
+    def batch_validate_journal_year(self, letter, values):
+        volumes = self._columns['N']
+        issues = self._columns['O']
+        return [index for index, value in enumerate(values) if not value and not volumes[index] and not issues[index]]
+
+    def batch_validate_journal_volume(self, letter, values):
+        years = self._columns['M']
+        issues = self._columns['O']
+        return [index for index, value in enumerate(values) if not value and not years[index] and not issues[index]]
+
+    def batch_validate_journal_issue(self, letter, values):
+        years = self._columns['M']
+        volumes = self._columns['N']
+        return [index for index, value in enumerate(values) if not value and not years[index] and not volumes[index]]
+
+    def batch_validate_extract_title(self, letter, values):
+        extract_section_types = self._extract_section_types
+        section_types = self._section_types_lower()
+        missing = [index for index, value in enumerate(values)
+                   if not value and section_types[index] in extract_section_types]
+        if not self.fix_missing:
+            return missing
+        for index in missing:
+            self._fix(letter, index)
+        return []
+
+    def batch_validate_author_of_extract(self, letter, values):
+        article_section_types = self._article_section_types
+        section_types = self._section_types_lower()
+        book_authors = self._columns['L']
+        failed = []
+        for index, value in enumerate(values):
+            if value:
+                continue
+            if section_types[index] in article_section_types:
+                if self.fix_missing:
+                    self._fix(letter, index)
+                else:
+                    failed.append(index)
+            elif not book_authors[index]:
+                failed.append(index)
+        return failed
+
+    def batch_validate_publisher_name(self, letter, values):
+        article_section_types = self._article_section_types
+        section_types = self._section_types_lower()
+        missing = [index for index, value in enumerate(values)
+                   if not value and section_types[index] not in article_section_types]
+        if not self.fix_missing:
+            return missing
+        for index in missing:
+            self._fix(letter, index)
+        return []
+
+    def batch_validate_source(self, letter, values):
+        sources = self._sources
+        return [index for index, value in enumerate(values) if value not in sources]
+
+    def batch_validate_date(self, letter, values):
+        has_new_format = self.date_normaliser.has_new_format
+        failed = []
+        for index, value in enumerate(values):
+            if not value:
+                failed.append(index)
+            elif not has_new_format(value):
+                if not self.fix_missing:
+                    failed.append(index)
+                    continue
+                try:
+                    self._set_value(letter, index, self.date_normaliser.normalise(value))
+                except Exception as e:
+                    self._set_exception(index, e)
+        return failed
+
+    def batch_validate_page_number(self, letter, values):
+        match = TADCImportRow.PAGE_NUMBER_REGEX.match
+        return [index for index, value in enumerate(values) if match(value) is None]
+
+    def batch_validate_incidental_artwork(self, letter, values):
+        incidental_artwork_values = self._incidental_artwork_values
+        return [index for index, value in enumerate(values) if value and value not in incidental_artwork_values]
+
+
+def validate_batches(rows, old_date_format, fix_missing=False, first_row_number=0, cache=None, batch_size=1000,
+                     date_normaliser=None, profiler=None, schema=None):
+    """
+    Generator which validates rows from an iterable of lists in blocks, yielding a RowResult for each row.
+    This gives the same results as validate_rows() but is faster for big files.
+    :param rows: iterable of lists, e.g. a CSV reader
+    :param old_date_format:
+    :param fix_missing:
+    :param first_row_number: row number given to the first row
+    :param cache: optional ResultCache, rows found in it are not validated again
+    :param batch_size: number of rows validated at a time
+    :param date_normaliser: optional DateNormaliser shared with the caller
+    :param profiler: optional Profiler to time loading and rules
+    :param schema: optional RuleSchema to validate with instead of the built in rules
+    :return:
+    """
+    if schema is None:
+        batch_validator = BatchValidator(old_date_format=old_date_format, fix_missing=fix_missing,
+                                         date_normaliser=date_normaliser, profiler=profiler)
+    else:
+        batch_validator = SchemaValidator(schema, old_date_format=old_date_format, fix_missing=fix_missing,
+                                          date_normaliser=date_normaliser, profiler=profiler)
+    rows = iter(rows)
+    row_number = first_row_number
+    while True:
+        block = list(itertools.islice(rows, batch_size))
+        if not block:
+            return
+        if cache is None:
+            for result in batch_validator.validate_batch(block).iter_results(row_number):
+                yield result
+        else:
+            results = [cache.get(row, row_number + index) for index, row in enumerate(block)]
+            missing = [index for index, result in enumerate(results) if result is None]
+            if missing:
+                batch_result = batch_validator.validate_batch([block[index] for index in missing])
+                for index, result in zip(missing, batch_result.iter_results()):
+                    results[index] = result._replace(row_number=row_number + index)
+                    cache.put(block[index], results[index])
+            for result in results:
+                yield result
+        row_number += len(block)
@@ -0,0 +1,145 @@
+import re
+from datetime import datetime, date
+
+__author__ = 'timhodson'
+
+
+class DateNormaliser:
+    """
+    Converts dates from an old date format to YYYY/MM/DD, remembering the results.
+    Date columns repeat a lot (every reading on a course has the same start and end dates) so each distinct
+    value is only checked and converted once. Simple formats made of %d, %m and %Y with separators,
+    e.g. %d/%m/%Y, are parsed by hand rather than with strptime. Anything the hand written parser isn't
+    sure about goes through strptime, so results and error messages are always the same as strptime gives.
+    """
+
+    # Date format expected in the import file.
+    DATE_FORMAT_REGEX = re.compile(r"\d{4}[/]\d{2}[/]\d{2}")  # e.g. 2015/01/31
+    NEW_DATE_FORMAT = '%Y/%m/%d'
+
+    # directives the hand written parser understands
+    FAST_DIRECTIVES = {'d': '([0-9]{1,2})', 'm': '([0-9]{1,2})', 'Y': '([0-9]{4})'}
+
+    def __init__(self, old_date_format, max_size=10000):
+        """
+        :param old_date_format: strptime format of the dates that will be converted
+        :param max_size: how many distinct values to remember before starting again
+        """
+        self.old_date_format = old_date_format
+        self.max_size = max_size
+        self._converted = {}
+        self._checked = {}
+        self._fast_parser = self.compile_fast_parser(old_date_format)
+        self.normalised = 0
+        self.failed = 0
+
+    @classmethod
+    def compile_fast_parser(cls, old_date_format):
+        """
+        Build a regex for formats the hand written parser can deal with.
+        :param old_date_format:
+        :return: (regex, list of directives in the order they appear) or None if strptime is needed
+        """
+        pattern = ''
+        order = []
+        previous_directive = False
+        position = 0
+        while position < len(old_date_format):
+            character = old_date_format[position]
+            if character == '%':
+                directive = old_date_format[position + 1:position + 2]
+                # two numbers next to each other are ambiguous, so leave those to strptime
+                if directive not in cls.FAST_DIRECTIVES or directive in order or previous_directive:
+                    return None
+                pattern += cls.FAST_DIRECTIVES[directive]
+                order.append(directive)
+                previous_directive = True
+                position += 2
+            else:
+                # strptime treats whitespace and letters specially, so leave those to it too
+                if character.isspace() or character.isalnum():
+                    return None
+                pattern += re.escape(character)
+                previous_directive = False
+                position += 1
+        if sorted(order) != ['Y', 'd', 'm']:
+            return None
+        return re.compile(pattern + r'\Z'), order
+
+    @classmethod
+    def convert_date(cls, original_date, old_date_format):
+        """
+        Convert a date using strptime. Raises ValueError if the date isn't in the old date format.
+        """
+        original_date_obj = datetime.strptime(original_date, old_date_format)
+        return original_date_obj.strftime(cls.NEW_DATE_FORMAT)
+
+    def _fast_convert(self, original_date):
+        """
+        Convert a date with the hand written parser.
+        :return: the converted date or None if it should go through strptime instead
+        """
+        regex, order = self._fast_parser
+        found = regex.match(original_date)
+        if found is None:
+            return None
+        parts = dict(zip(order, [int(number) for number in found.groups()]))
+        # strftime can't deal with years before 1900 on some pythons, so leave those to the slow path
+        if parts['Y'] < 1900:
+            return None
+        try:
+            date(parts['Y'], parts['m'], parts['d'])
+        except ValueError:
+            return None
+        return '%04d/%02d/%02d' % (parts['Y'], parts['m'], parts['d'])
+
+    def _remember(self, cache, key, value):
+        if len(cache) >= self.max_size:
+            cache.clear()
+        cache[key] = value
+
+    def has_new_format(self, value):
+        """
+        Check whether a value already looks like YYYY/MM/DD.
+        :param value:
+        :return:
+        """
+        checked = self._checked.get(value)
+        if checked is None:
+            checked = self.DATE_FORMAT_REGEX.match(value) is not None
+            self._remember(self._checked, value, checked)
+        return checked
+
+    def normalise(self, original_date):
+        """
+        Convert a date to YYYY/MM/DD. Raises ValueError, with the same message strptime gives, if it can't be converted.
+        :param original_date:
+        :return:
+        """
+        converted = self._converted.get(original_date)
+        if converted is None:
+            if self._fast_parser is not None:
+                converted = self._fast_convert(original_date)
+            if converted is None:
+                try:
+                    converted = self.convert_date(original_date, self.old_date_format)
+                except ValueError as e:
+                    converted = ValueError("{}".format(e))
+            self._remember(self._converted, original_date, converted)
+        if isinstance(converted, ValueError):
+            self.failed += 1
+            raise ValueError("{}".format(converted))
+        self.normalised += 1
+        return converted
+
+    def get_counts(self):
+        return {"normalised": self.normalised, "failed": self.failed}
+
+    def add_counts(self, counts):
+        """
+        Add counts from another normaliser, e.g. one used in a worker process.
+        :param counts: dict from get_counts()
+        :return:
+        """
+        self.normalised += counts.get("normalised", 0)
+        self.failed += counts.get("failed", 0)
@@ -0,0 +1,112 @@
+import re
+import collections
+from .TADCImportRow import TADCImportRow
+try:
+    from urllib import quote_plus
+except ImportError:
+    # Python 3
+    from urllib.parse import quote_plus
+
+__author__ = 'timhodson'
+
+
+class KEVEncoder:
+    """
+    Turns the values of an import row into the key / encoded value (KEV) pairs of an OpenURL, using the kev and
+    kevParser metadata of each column in TADCImportRow.validationRules (or a RuleSchema's columns).
+    Columns without a kev key are left out, as are empty values. A kevParser names the method of this class
+    which turns the column's value into the KEV value, in the same way a rule names the method which validates it.
+    Percent encoding costs more than validating a row, and values such as course codes, requesters and dates
+    repeat from row to row, so each column remembers the encoded form of the values it has seen.
+    """
+
+    # section types as they appear in the import file -> rft_genre
+    SECTION_TYPE_GENRES = {'a': 'article', 'article': 'article', 'c': 'chapter', 'chapter': 'chapter',
+                           'p': 'page range', 'page range': 'page range'}
+    # prefixes a DOI is often written with, which are not part of the DOI
+    DOI_PREFIX_REGEX = re.compile(r"^(?:doi:\s*|https?://(?:dx\.)?doi\.org/)", re.IGNORECASE)
+
+    def __init__(self, columns=None, max_size=10000):
+        """
+        :param columns: dict of column letter -> metadata with kev and optionally kevParser keys,
+            defaults to TADCImportRow.validationRules
+        :param max_size: how many values each column remembers before starting again
+        """
+        self.max_size = max_size
+        if columns is None:
+            columns = TADCImportRow.validationRules
+        # (value index, kev key, parser) for each exported column, in column order
+        self._fields = []
+        for letter in TADCImportRow.COLUMNS:
+            column = columns.get(letter, {})
+            if 'kev' not in column:
+                continue
+            parser = None
+            if 'kevParser' in column:
+                parser = getattr(self, column['kevParser'], None)
+                if parser is None:
+                    raise ValueError("Unknown kevParser {} for column {}".format(column['kevParser'], letter))
+            self._fields.append((TADCImportRow.COLUMN_INDEX[letter], column['kev'], parser))
+        # for each field, value -> its key=value part of a query string
+        self._encoded = [{} for field in self._fields]
+
+    def get_keys(self):
+        return [key for index, key, parser in self._fields]
+
+    def encode(self, values):
+        """
+        The KEV pairs for a row.
+        :param values: the row values after any fixes, e.g. RowResult.fixed
+        :return: OrderedDict of kev key -> value, in column order
+        """
+        pairs = collections.OrderedDict()
+        for index, key, parser in self._fields:
+            value = values[index] if index < len(values) else u''
+            if value and parser is not None:
+                value = parser(value)
+            if value:
+                pairs[key] = value
+        return pairs
+
+    def query_string(self, values):
+        """
+        The KEV pairs for a row as an OpenURL query string, values UTF-8 and percent encoded.
+        :param values: the row values after any fixes, e.g. RowResult.fixed
+        :return:
+        """
+        parts = []
+        for (index, key, parser), encoded in zip(self._fields, self._encoded):
+            value = values[index] if index < len(values) else u''
+            if not value:
+                continue
+            part = encoded.get(value)
+            if part is None:
+                parsed = parser(value) if parser is not None else value
+                part = u"{}={}".format(key, quote_plus(parsed.encode('utf-8'))) if parsed else u''
+                if len(encoded) >= self.max_size:
+                    encoded.clear()
+                encoded[value] = part
+            if part:
+                parts.append(part)
+        return u"&".join(parts)
+
+    def kevDate(self, value):
+        """
+        YYYY/MM/DD, as in a valid row, to the YYYY-MM-DD OpenURL uses.
+        """
+        return value.replace(u'/', u'-')
+
+    def kevSectionType(self, value):
+        return self.SECTION_TYPE_GENRES.get(value.lower(), value.lower())
+
+    def kevISBN(self, value):
+        """
+        ISBNs and ISSNs without hyphens or spaces, with any X check digit in upper case.
+        """
+        return value.replace(u'-', u'').replace(u' ', u'').upper()
+
+    def kevDOI(self, value):
+        """
+        The DOI without a doi: or doi.org prefix.
+        """
+        return self.DOI_PREFIX_REGEX.sub(u'', value)
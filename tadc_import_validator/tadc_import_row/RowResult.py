@@ -0,0 +1,70 @@
+from collections import namedtuple
+from .TADCImportRow import TADCImportRow
+
+__author__ = 'timhodson'
+
+# The outcome of validating one row.
+# row_number: zero based position of the row in the file, header rows included.
+# valid: True if the row passed validation.
+# errors: list of {"column": ..., "message": ...} dicts, empty for valid rows.
+# fixed: the values ready to write to a CSV file. For valid rows these are output_for_csv(), for invalid rows
+#        they are the values after any fixes, as in output_for_invalid_csv(), and for rows which raised an
+#        exception they are the values as read, or None if the values couldn't be read.
+# exception: message of an unexpected exception raised while validating, otherwise None.
+RowResult = namedtuple('RowResult', ['row_number', 'valid', 'errors', 'fixed', 'exception'])
+
+
+def read_values(row):
+    """
+    The values of a row as read, for rows which raised an exception while being validated.
+    :param row:
+    :return: list of values or None if the row can't be read
+    """
+    try:
+        return TADCImportRow.clean_values(row)
+    except Exception:
+        return None
+
+
+def validate_row(tadc_row, row, row_number):
+    """
+    Load and validate a single row using an existing TADCImportRow.
+    :param tadc_row:
+    :param row: list of values
+    :param row_number:
+    :return: RowResult
+    """
+    try:
+        tadc_row.load(row)
+        if tadc_row.is_valid():
+            return RowResult(row_number, True, [], tadc_row.output_for_csv(), None)
+        return RowResult(row_number, False, tadc_row.get_errors(), tadc_row.get_values(), None)
+    except Exception as e:
+        return RowResult(row_number, False, [], read_values(row), "{}".format(e))
+
+
+def validate_rows(rows, old_date_format, fix_missing=False, first_row_number=0, cache=None, date_normaliser=None,
+                  profiler=None):
+    """
+    Generator which validates each row from an iterable of lists, yielding a RowResult for each.
+    A single TADCImportRow is reused for all of the rows.
+    :param rows: iterable of lists, e.g. a CSV reader
+    :param old_date_format:
+    :param fix_missing:
+    :param first_row_number: row number given to the first row
+    :param cache: optional ResultCache, rows found in it are not validated again
+    :param date_normaliser: optional DateNormaliser shared with the caller
+    :param profiler: optional Profiler to time loading and rules
+    :return:
+    """
+    tadc_row = TADCImportRow(old_date_format=old_date_format, fix_missing=fix_missing,
+                             date_normaliser=date_normaliser, profiler=profiler)
+    for row_number, row in enumerate(rows, first_row_number):
+        if cache is None:
+            yield validate_row(tadc_row, row, row_number)
+            continue
+        result = cache.get(row, row_number)
+        if result is None:
+            result = validate_row(tadc_row, row, row_number)
+            cache.put(row, result)
+        yield result
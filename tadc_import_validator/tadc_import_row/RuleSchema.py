@@ -0,0 +1,152 @@
+import os
+import re
+import json
+import hashlib
+from .TADCImportRow import TADCImportRow
+try:
+    import yaml
+except ImportError:
+    # YAML schemas need PyYAML, JSON ones don't
+    yaml = None
+
+__author__ = 'timhodson'
+
+DEFAULT_SCHEMA_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'default_schema.json')
+
+
+class RuleSchema:
+    """
+    Validation rules for the columns of an import row, described as data so that a variation on the rules
+    is a JSON (or YAML) file rather than a change to the code. The built in rules are in default_schema.json.
+    A schema looks like:
+
+        {"format": 1, "name": "tadc", "version": 1,
+         "columns": {"A": {"name": "Course Code", "error": "Missing mandatory field", "rule": "validate_mandatory",
+                           "fix_value": "...", "checks": [{...}, ...]}, ...}}
+
+    Each check in a column's list can have:
+     - when: {"column": "H", "in": [...]} or {"column": "H", "not_in": [...]}, optionally "ignore_case": true.
+       The first check whose when matches (or which has no when) is used and the rest are skipped.
+       If none match the value is valid.
+     - required: an empty value is an error, unless one of the unless_present columns has a value.
+     - allow_empty: an empty value is valid.
+     - fix: with fix missing, an empty required value is replaced with the column's fix_value.
+     - date: the value must be a YYYY/MM/DD date, with fix missing dates in the old date format are converted.
+     - enum: the value must be one of these, compared in lower case with "ignore_case": true.
+     - regex: the value must match this regular expression from its start.
+    Columns without checks are not validated. A column has at most one error, with the column's error message.
+    """
+
+    # version of the schema layout understood here
+    FORMAT = 1
+    CHECK_KEYS = frozenset(['when', 'required', 'unless_present', 'allow_empty', 'fix', 'date', 'enum',
+                            'ignore_case', 'regex'])
+    WHEN_KEYS = frozenset(['column', 'in', 'not_in', 'ignore_case'])
+
+    def __init__(self, schema, filename=None):
+        """
+        :param schema: dict in the layout above
+        :param filename: where the schema was loaded from, used in messages
+        """
+        self.schema = schema
+        self.filename = filename or '<schema>'
+        self.check_schema()
+        self.name = schema.get('name', self.filename)
+        self.version = schema['version']
+        self.columns = schema['columns']
+        # identifies the rules, e.g. for cached results and compiled validators
+        self.hash = hashlib.sha1(json.dumps(schema, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a schema from a .json, .yaml or .yml file.
+        :param filename:
+        :return: RuleSchema
+        """
+        with open(filename, 'rb') as schema_fp:
+            data = schema_fp.read().decode('utf-8')
+        if os.path.splitext(filename)[1].lower() in ['.yaml', '.yml']:
+            if yaml is None:
+                raise ValueError("YAML schemas need PyYAML, install it or use a JSON schema")
+            schema = yaml.safe_load(data)
+        else:
+            schema = json.loads(data)
+        return cls(schema, filename=filename)
+
+    @classmethod
+    def default(cls):
+        """
+        The built in rules, which give the same results as TADCImportRow.
+        """
+        return cls.load(DEFAULT_SCHEMA_FILENAME)
+
+    def describe(self):
+        return "{} version {}".format(self.name, self.version)
+
+    def get_rule_name(self, letter):
+        return self.columns[letter].get('rule', 'schema_{}'.format(letter))
+
+    def error(self, message):
+        raise ValueError("Invalid schema {}: {}".format(self.filename, message))
+
+    def check_schema(self):
+        """
+        Check the layout of the schema, so that mistakes are found when it is loaded rather than part way
+        through a file. Raises ValueError.
+        :return:
+        """
+        schema = self.schema
+        if not isinstance(schema, dict):
+            self.error("should be an object")
+        if schema.get('format') != self.FORMAT:
+            self.error("format should be {}".format(self.FORMAT))
+        if 'version' not in schema:
+            self.error("version is missing")
+        columns = schema.get('columns')
+        if not isinstance(columns, dict):
+            self.error("columns should be an object")
+        for letter, column in columns.items():
+            if letter not in TADCImportRow.COLUMN_INDEX:
+                self.error("unknown column {}".format(letter))
+            if not isinstance(column, dict):
+                self.error("column {} should be an object".format(letter))
+            if 'name' not in column:
+                self.error("column {} has no name".format(letter))
+            checks = column.get('checks', [])
+            if not isinstance(checks, list):
+                self.error("column {} should have a list of checks".format(letter))
+            if checks and 'error' not in column:
+                self.error("column {} has checks but no error".format(letter))
+            for position, check in enumerate(checks):
+                self.check_check(letter, position, check, position == len(checks) - 1)
+
+    def check_check(self, letter, position, check, last):
+        where = "column {} check {}".format(letter, position + 1)
+        if not isinstance(check, dict):
+            self.error("{} should be an object".format(where))
+        unknown = set(check) - self.CHECK_KEYS
+        if unknown:
+            self.error("{} has unknown keys {}".format(where, ", ".join(sorted(unknown))))
+        if 'when' in check:
+            when = check['when']
+            if not isinstance(when, dict) or set(when) - self.WHEN_KEYS:
+                self.error("{} has an unknown when".format(where))
+            if when.get('column') not in TADCImportRow.COLUMN_INDEX:
+                self.error("{} has a when with an unknown column".format(where))
+            if ('in' in when) == ('not_in' in when):
+                self.error("{} should have a when with one of in or not_in".format(where))
+        elif not last:
+            self.error("{} has no when, so the checks after it would never be used".format(where))
+        if not isinstance(check.get('unless_present', []), list):
+            self.error("{} should have a list for unless_present".format(where))
+        for other in check.get('unless_present', []):
+            if other not in TADCImportRow.COLUMN_INDEX:
+                self.error("{} has an unknown column {} in unless_present".format(where, other))
+        if 'enum' in check and not isinstance(check['enum'], list):
+            self.error("{} should have a list for enum".format(where))
+        if 'regex' in check:
+            try:
+                re.compile(check['regex'])
+            except re.error as e:
+                self.error("{} has a bad regex: {}".format(where, e))
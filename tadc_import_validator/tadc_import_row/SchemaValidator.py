@@ -0,0 +1,200 @@
+import re
+from timeit import default_timer as timer
+from .TADCImportRow import TADCImportRow, text_type
+from .RowResult import read_values
+from .BatchResult import BatchResult
+from .DateNormaliser import DateNormaliser
+
+__author__ = 'timhodson'
+
+
+class SchemaValidator:
+    """
+    Validates blocks of rows with the rules from a RuleSchema.
+    The schema is turned into the source of a single function which validates a whole block, with every column's
+    checks written out in place, so there are no lookups or method calls per cell. Generating and compiling it
+    takes a couple of milliseconds, once per validator. Results and error messages are the same as BatchValidator
+    gives for the same rules, and it can be used wherever a BatchValidator is.
+    """
+
+    def __init__(self, schema, old_date_format, fix_missing=False, date_normaliser=None, profiler=None):
+        """
+        :param schema: RuleSchema
+        :param old_date_format:
+        :param fix_missing:
+        :param date_normaliser: optional DateNormaliser shared with the caller
+        :param profiler: optional Profiler
+        """
+        self.schema = schema
+        self.old_date_format = old_date_format
+        self.fix_missing = fix_missing
+        if date_normaliser is None:
+            date_normaliser = DateNormaliser(old_date_format)
+        self.date_normaliser = date_normaliser
+        self.profiler = profiler
+        self._constants = {}
+        source = self.generate_source()
+        namespace = dict(self._constants, text_type=text_type, read_values=read_values,
+                         WIDTH=len(TADCImportRow.COLUMNS))
+        exec(compile(source, "<schema {}>".format(self.schema.describe()), 'exec'), namespace)
+        self._validate_block = namespace['validate_block']
+
+    def add_constant(self, name, value):
+        """
+        Values from the schema reach the generated code as named constants, never as source text.
+        """
+        self._constants[name] = value
+        return name
+
+    def generate_source(self):
+        """
+        Python source of validate_block(rows, fix_missing, has_new_format, normalise), which returns the values
+        of each row after any fixes, a dict of row index -> errors and a dict of row index -> exception message.
+        Each column's value is held in a local variable, v_A to v_Z, and fixes update both it and the row.
+        :return:
+        """
+        columns = ", ".join("v_" + letter for letter in TADCImportRow.COLUMNS)
+        lines = [
+            "def validate_block(rows, fix_missing, has_new_format, normalise):",
+            "    block = []",
+            "    errors = {}",
+            "    exceptions = {}",
+            "    for index, row in enumerate(rows):",
+            "        try:",
+            "            values = [text_type(value).strip() for value in row[:WIDTH]]",
+            "            if len(values) < WIDTH:",
+            "                values.extend([u''] * (WIDTH - len(values)))",
+            "            {} = values".format(columns),
+            "            row_errors = []",
+        ]
+        for letter in TADCImportRow.COLUMNS:
+            lines.extend(self.indent(self.generate_column(letter), 3))
+        lines.extend([
+            "            if row_errors:",
+            "                errors[index] = row_errors",
+            "        except Exception as e:",
+            "            exceptions[index] = \"{}\".format(e)",
+            "            values = read_values(row)",
+            "        block.append(values)",
+            "    return block, errors, exceptions",
+        ])
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def indent(lines, levels=1):
+        return ["    " * levels + line for line in lines]
+
+    def generate_column(self, letter):
+        """
+        Source which checks one column, the first check whose when matches is used.
+        """
+        column = self.schema.columns.get(letter, {})
+        checks = column.get('checks', [])
+        if not checks:
+            return []
+        lines = ["# column {}".format(letter)]
+        for position, check in enumerate(checks):
+            body = self.indent(self.generate_check(letter, position, check))
+            if 'when' in check:
+                condition = self.generate_when(letter, position, check['when'])
+                lines.append("{} {}:".format('if' if position == 0 else 'elif', condition))
+                lines.extend(body)
+            elif position == 0:
+                lines.extend(self.generate_check(letter, position, check))
+            else:
+                lines.append("else:")
+                lines.extend(body)
+        return lines
+
+    def generate_when(self, letter, position, when):
+        ignore_case = when.get('ignore_case', False)
+        value = "v_{}".format(when['column'])
+        if ignore_case:
+            value += ".lower()"
+        allowed = when['in'] if 'in' in when else when['not_in']
+        allowed = frozenset(item.lower() if ignore_case else item for item in allowed)
+        name = self.add_constant("WHEN_{}_{}".format(letter, position), allowed)
+        return "{} {} {}".format(value, 'in' if 'in' in when else 'not in', name)
+
+    def generate_error(self, letter):
+        column = self.schema.columns[letter]
+        message = self.add_constant("MESSAGE_" + letter, (
+            u"{} value: '".format(column['name']), u"' error: {}".format(column['error'])))
+        rule = self.schema.get_rule_name(letter)
+        # only errors from rules TADCImportRow doesn't have say which rule they come from
+        if rule == TADCImportRow.validationRules[letter].get('rule'):
+            return "row_errors.append({{'column': '{0}', 'message': {1}[0] + v_{0} + {1}[1]}})".format(letter, message)
+        rule = self.add_constant("RULE_" + letter, rule)
+        return "row_errors.append({{'column': '{0}', 'message': {1}[0] + v_{0} + {1}[1], 'rule': {2}}})".format(
+            letter, message, rule)
+
+    def generate_fix(self, letter):
+        column = self.schema.columns[letter]
+        if 'fix_value' not in column:
+            # the same as TADCImportRow, where the row can't be validated
+            return "raise KeyError('fix_value')"
+        fix_value = self.add_constant("FIX_" + letter, column['fix_value'])
+        return "v_{0} = values[{1}] = {2}".format(letter, TADCImportRow.COLUMN_INDEX[letter], fix_value)
+
+    def generate_check(self, letter, position, check):
+        """
+        Source for one check as an if / elif chain, where each branch either passes the value, fixes it or
+        adds the column's error.
+        """
+        value = "v_" + letter
+        error = self.generate_error(letter)
+        branches = []
+        if check.get('allow_empty'):
+            branches.append(("not {}".format(value), ["pass"]))
+        required = check.get('required') or check.get('date')
+        if required and check.get('unless_present'):
+            others = " or ".join("v_" + other for other in check['unless_present'])
+            branches.append(("not {} and ({})".format(value, others), ["pass"]))
+        if required:
+            if check.get('fix'):
+                missing = ["if fix_missing:", "    " + self.generate_fix(letter), "else:", "    " + error]
+            else:
+                missing = [error]
+            branches.append(("not {}".format(value), missing))
+        if check.get('date'):
+            branches.append(("not has_new_format({})".format(value), [
+                "if fix_missing:",
+                "    {0} = values[{1}] = normalise({0})".format(value, TADCImportRow.COLUMN_INDEX[letter]),
+                "else:",
+                "    " + error]))
+        failures = []
+        if 'enum' in check:
+            ignore_case = check.get('ignore_case', False)
+            allowed = frozenset(item.lower() if ignore_case else item for item in check['enum'])
+            name = self.add_constant("ENUM_{}_{}".format(letter, position), allowed)
+            failures.append("{}{} not in {}".format(value, ".lower()" if ignore_case else "", name))
+        if 'regex' in check:
+            name = self.add_constant("MATCH_{}_{}".format(letter, position), re.compile(check['regex']).match)
+            failures.append("{}({}) is None".format(name, value))
+        if failures:
+            branches.append((" or ".join(failures), [error]))
+        if not branches:
+            return ["pass"]
+        lines = []
+        for number, (condition, body) in enumerate(branches):
+            lines.append("{} {}:".format('if' if number == 0 else 'elif', condition))
+            lines.extend(self.indent(body))
+        return lines
+
+    def validate_batch(self, rows):
+        """
+        Validate a block of rows.
+        :param rows: list of lists of values, e.g. read from a CSV reader
+        :return: BatchResult
+        """
+        if self.profiler is not None:
+            started = timer()
+        block, errors, exceptions = self._validate_block(rows, self.fix_missing, self.date_normaliser.has_new_format,
+                                                         self.date_normaliser.normalise)
+        error_mask = {}
+        for index in sorted(errors):
+            for error in errors[index]:
+                error_mask.setdefault(error['column'], []).append(index)
+        if self.profiler is not None:
+            self.profiler.add('schema rules', timer() - started, len(rows))
+        return BatchResult(block, error_mask, errors, exceptions)
@@ -1,10 +1,16 @@
 import string
 import re
-from datetime import datetime
 from logbook import Logger
+from .DateNormaliser import DateNormaliser
 
 log = Logger("TADCImportRow")
 
+try:
+    text_type = unicode
+except NameError:
+    # Python 3
+    text_type = str
+
 
 class TADCImportRow:
     """
@@ -13,111 +19,181 @@ class TADCImportRow:
     """
 
     # Date format expected by this class.
-    DATE_FORMAT_REGEX = re.compile(u"\d{4}[/]\d{2}[/]\d{2}")  # e.g. 2015/01/31
-    YEAR_FORMAT_REGEX = re.compile(u"\d{4}")  # 4 digits
-    PAGE_NUMBER_REGEX = re.compile(u"^\d+$|[xXvViIcClLmM]+")  # one or more digits/roman numerals for the WHOLE string.
-
-    def __init__(self, old_date_format, fix_missing=False):
+    DATE_FORMAT_REGEX = DateNormaliser.DATE_FORMAT_REGEX  # e.g. 2015/01/31
+    YEAR_FORMAT_REGEX = re.compile(r"\d{4}")  # 4 digits
+    PAGE_NUMBER_REGEX = re.compile(r"^\d+$|[xXvViIcClLmM]+")  # one or more digits/roman numerals for the WHOLE string.
+    NEW_DATE_FORMAT = DateNormaliser.NEW_DATE_FORMAT
+
+    # Allowed values used by the rules.
+    SECTION_TYPES = ['a', 'c', 'p', 'article', 'chapter', 'page range']
+    ARTICLE_SECTION_TYPES = ['a', 'article']
+    EXTRACT_SECTION_TYPES = ['a', 'article', 'c', 'chapter']
+    SOURCES = ['A', 'B', 'C', 'D']
+    INCIDENTAL_ARTWORK_VALUES = ['y', 'Y', 'n', 'N']
+
+    # Version of the rules below. Bump this whenever a change to the rules could change a result,
+    # so that cached results are thrown away.
+    RULES_VERSION = 1
+
+    # Column letters in the order they appear in an import row, and the position of each letter.
+    COLUMNS = tuple(string.ascii_uppercase)
+    COLUMN_INDEX = dict((letter, index) for index, letter in enumerate(COLUMNS))
+
+    # validation rules, shared by every row. Each rule names the method which validates the column.
+    validationRules = {
+        "A": {"name": "Course Code", "kev": "rfe_code",
+              "rule": "validate_mandatory",
+              "error": "Missing mandatory field"},
+        "B": {"name": "Course Description", "kev": "rfe_name",
+              "rule": "validate_mandatory",
+              "error": "Missing mandatory field"},
+        "C": {"name": "Student numbers", "kev": "rfe_size",
+              "rule": "validate_mandatory",
+              "error": "Missing mandatory field"},
+        "D": {"name": "Request start date", "kev": "rfe_sdate", "kevParser": "kevDate",
+              "rule": "validate_date",
+              "error": "Missing mandatory date field, or field is incorrectly formatted. Should be YYYY/MM/DD"},
+        "E": {"name": "Request end date", "kev": "rfe_edate", "kevParser": "kevDate",
+              "rule": "validate_date",
+              "error": "Missing mandatory date field, or field is incorrectly formatted. Should be YYYY/MM/DD"},
+        "F": {"name": "Requester Name", "kev": "req_name",
+              "rule": "validate_mandatory",
+              "error": "Missing mandatory field"},
+        "G": {"name": "Requester email", "kev": "req_email",
+              "rule": "validate_mandatory",
+              "error": "Missing mandatory field"},
+        "H": {"name": "Section Type (chapter, article, page range)", "kev": "rft_genre",
+              "kevParser": "kevSectionType",
+              "rule": "validate_section_type",
+              "error": "Field should be 'C', 'Chapter', 'P', 'Page Range', 'Article' or 'A'"},
+        "I": {"name": "ISBN / ISSN", "kev": "rft_isbn", "kevParser": "kevISBN"},
+        "J": {"name": "DOI", "kev": "rft_doi", "kevParser": "kevDOI"},
+        "K": {"name": "Title of Book/Journal",
+              "rule": "validate_mandatory",
+              "error": "Missing mandatory field", "fix_value": "Unknown title"},
+        "L": {"name": "Author of Book"},
+        "M": {"name": "Journal Year",
+              "rule": "validate_journal_year",
+              "error": "Missing field for articles"},
+        "N": {"name": "Volume Number",
+              "rule": "validate_journal_volume",
+              "error": "Missing field for articles"},
+        "O": {"name": "Issue"},
+        "P": {"name": "Extract title", "kev": "rft_atitle",
+              "rule": "validate_extract_title",
+              "error": "Missing mandatory field"},
+        "Q": {"name": "Author of Extract",
+              "rule": "validate_author_of_extract",
+              "error": "Missing mandatory field", "fix_value": "Unknown author"},
+        "R": {"name": "Publisher",
+              "rule": "validate_publisher_name",
+              "error": "Missing mandatory field", "fix_value": "Unknown publisher"},
+        "S": {"name": "Place of publication"},
+        "T": {"name": "Page No. From", "kev": "rft_spage",
+              "rule": "validate_page_number",
+              "error": "Starting page number either missing mandatory field or contains a page range"},
+        "U": {"name": "Page No. To", "kev": "rft_epage",
+              "rule": "validate_page_number",
+              "error": "Ending page number either missing mandatory field or contains a page range"},
+        "V": {"name": "Source",
+              "rule": "validate_source",
+              "error": "Field should be 'A', 'C' or 'D'"},
+        "W": {"name": "FILENAME",
+              "rule": "validate_mandatory",
+              "error": "Missing mandatory field"},
+        "X": {"name": "LIST ITEM URL"},
+        "Y": {"name": "Local URL/Location"},
+        "Z": {"name": "Contains incidental artwork",
+              "rule": "validate_incidental_artwork",
+              "error": "Must be a value of either 'y' or 'n' (case insensitive)"}
+    }
+
+    def __init__(self, old_date_format, fix_missing=False, date_normaliser=None, profiler=None):
         self.old_date_format = old_date_format
         self.fix_missing = fix_missing
-        # the row dictionary while we work on it internally
-        self._row = {}
+        # remembers dates we have already checked or converted, it can be shared with other rows
+        if date_normaliser is None:
+            date_normaliser = DateNormaliser(old_date_format)
+        self.date_normaliser = date_normaliser
+        # the row values while we work on them internally, one per column in COLUMNS order
+        self._values = []
         # a list of errors when validating
         self._errors = []
-        # current column we are working on
+        # current column we are working on, and its position in _values
         self._current_column = ''
+        self._current_index = None
         # make sure that our internal model is set up
         self.initialise()
+        # bind the rules once so that the same row object can be reused for many rows
+        self._rules = [(letter, self.COLUMN_INDEX[letter], getattr(self, self.validationRules[letter]['rule']))
+                       for letter in self.COLUMNS if 'rule' in self.validationRules[letter]]
+        # when profiling, time loading and each rule
+        if profiler is not None:
+            self.load = profiler.wrap('load row', self.load)
+            self._rules = [(letter, index, profiler.wrap(self.rule_stage_name(letter), rule))
+                           for letter, index, rule in self._rules]
 
-        # validation rules
-        self.validationRules = {
-            "A": {"name": "Course Code", "kev": "rfe_code",
-                  "rule": self.validate_mandatory,
-                  "error": "Missing mandatory field"},
-            "B": {"name": "Course Description", "kev": "rfe_name",
-                  "rule": self.validate_mandatory,
-                  "error": "Missing mandatory field"},
-            "C": {"name": "Student numbers", "kev": "rfe_size",
-                  "rule": self.validate_mandatory,
-                  "error": "Missing mandatory field"},
-            "D": {"name": "Request start date", "kev": "rfe_sdate", "kevParser": "kevDate",
-                  "rule": self.validate_date,
-                  "error": "Missing mandatory date field, or field is incorrectly formatted. Should be YYYY/MM/DD"},
-            "E": {"name": "Request end date", "kev": "rfe_edate", "kevParser": "kevDate",
-                  "rule": self.validate_date,
-                  "error": "Missing mandatory date field, or field is incorrectly formatted. Should be YYYY/MM/DD"},
-            "F": {"name": "Requester Name", "kev": "req_name",
-                  "rule": self.validate_mandatory,
-                  "error": "Missing mandatory field"},
-            "G": {"name": "Requester email", "kev": "req_email",
-                  "rule": self.validate_mandatory,
-                  "error": "Missing mandatory field"},
-            "H": {"name": "Section Type (chapter, article, page range)", "kev": "rft_genre",
-                  "kevParser": "kevSectionType",
-                  "rule": self.validate_section_type,
-                  "error": "Field should be 'C', 'Chapter', 'P', 'Page Range', 'Article' or 'A'"},
-            "I": {"name": "ISBN / ISSN", "kev": "rft_isbn", "kevParser": "kevISBN"},
-            "J": {"name": "DOI", "kev": "rft_doi", "kevParser": "kevDOI"},
-            "K": {"name": "Title of Book/Journal",
-                  "rule": self.validate_mandatory,
-                  "error": "Missing mandatory field", "fix_value": "Unknown title"},
-            "L": {"name": "Author of Book"},
-            "M": {"name": "Journal Year",
-                  "rule": self.validate_journal_year,
-                  "error": "Missing field for articles"},
-            "N": {"name": "Volume Number",
-                  "rule": self.validate_journal_volume,
-                  "error": "Missing field for articles"},
-            "O": {"name": "Issue"},
-            "P": {"name": "Extract title", "kev": "rft_atitle",
-                  "rule": self.validate_extract_title,
-                  "error": "Missing mandatory field"},
-            "Q": {"name": "Author of Extract",
-                  "rule": self.validate_author_of_extract,
-                  "error": "Missing mandatory field", "fix_value": "Unknown author"},
-            "R": {"name": "Publisher",
-                  "rule": self.validate_publisher_name,
-                  "error": "Missing mandatory field", "fix_value": "Unknown publisher"},
-            "S": {"name": "Place of publication"},
-            "T": {"name": "Page No. From", "kev": "rft_spage",
-                  "rule": self.validate_page_number,
-                  "error": "Starting page number either missing mandatory field or contains a page range"},
-            "U": {"name": "Page No. To", "kev": "rft_epage",
-                  "rule": self.validate_page_number,
-                  "error": "Ending page number either missing mandatory field or contains a page range"},
-            "V": {"name": "Source",
-                  "rule": self.validate_source,
-                  "error": "Field should be 'A', 'C' or 'D'"},
-            "W": {"name": "FILENAME",
-                  "rule": self.validate_mandatory,
-                  "error": "Missing mandatory field"},
-            "X": {"name": "LIST ITEM URL"},
-            "Y": {"name": "Local URL/Location"},
-            "Z": {"name": "Contains incidental artwork",
-                  "rule": self.validate_incidental_artwork,
-                  "error": "Must be a value of either 'y' or 'n' (case insensitive)"}
-        }
+    @classmethod
+    def rule_stage_name(cls, letter):
+        """
+        Name used when profiling the rule for a column.
+        """
+        return "column {} {}".format(letter, cls.validationRules[letter]['rule'])
 
     def initialise(self):
         """
-        Setup our basic dict ready to hold some data.
+        Setup our list of values ready to hold some data.
+        If the row has already been used the existing list is reset in place.
+        :return:
+        """
+        self._values[:] = [""] * len(self.COLUMNS)
+        self._errors = []
+        self._current_column = ''
+        self._current_index = None
+
+    @classmethod
+    def clean_values(cls, row):
+        """
+        The values of a row as they are loaded: text, stripped, and one per column.
+        :param row: list of values
         :return:
         """
-        for letter in list(string.ascii_uppercase):
-            self._row[letter] = {"value": ""}
+        width = len(cls.COLUMNS)
+        values = [text_type(value).strip() for value in row[:width]]
+        if len(values) < width:
+            values.extend([u''] * (width - len(values)))
+        return values
+
+    @staticmethod
+    def format_errors(errors):
+        """
+        Join a list of errors into the reasons column of the invalid CSV output.
+        :param errors: list of {"column": ..., "message": ...} dicts
+        :return:
+        """
+        return u", ".join([u"column {}: {}".format(error['column'], error['message']) for error in errors])
+
+    def get_values(self):
+        """
+        A copy of the current values of every column, including any fixes.
+        :return:
+        """
+        return list(self._values)
+
+    def get_value(self, column):
+        """
+        The current value of a column.
+        :param column: column letter
+        :return:
+        """
+        return self._values[self.COLUMN_INDEX[column]]
 
     def output_for_csv(self):
         """
         Build a list object ready to be written to a CSV file.
         :return:
         """
-        output = []
-        for letter in string.ascii_uppercase:
-            if self._row[letter]['value'] in [None, "None"]:
-                output.append("")
-            else:
-                output.append(self._row[letter]['value'])
-        return output
+        return ["" if value in [None, "None"] else value for value in self._values]
 
     def output_for_invalid_csv(self):
         """
@@ -125,15 +201,8 @@ class TADCImportRow:
         This will include reasons why the row is invalid
         :return:
         """
-        output = []
-        for letter in string.ascii_uppercase:
-            output.append(self._row[letter]['value'])
-
-        error_column = []
-        for error in self.get_errors():
-            error_column.append(u"column {}: {}".format(error['column'], error['message']))
-        output.append(u", ".join(error_column))
-
+        output = self.get_values()
+        output.append(self.format_errors(self.get_errors()))
         return output
 
     def add_data_to_column(self, column, data):
@@ -144,20 +213,19 @@ class TADCImportRow:
         :return:
         """
         # make sure this is a string
-        data = unicode(data)
-        self._row[column]['value'] = data.strip()
+        data = text_type(data)
+        self._values[self.COLUMN_INDEX[column]] = data.strip()
 
     def load(self, row):
         """
         Load a list representing a TADC import row into our internal structures.
+        Any data or errors from a previously loaded row are replaced, so a single
+        instance can be reused for every row in a file.
         :param row:
         :return:
         """
-        for idx, letter in enumerate(string.ascii_uppercase):
-            if idx < len(row):
-                self.add_data_to_column(letter, row[idx])
-            else:
-                self.add_data_to_column(letter, '')
+        self._errors = []
+        self._values[:] = self.clean_values(row)
 
     def validate(self):
         """
@@ -166,11 +234,12 @@ class TADCImportRow:
         """
         # reset any errors
         self._errors = []
-        # check each column against it's appropriate validation rule
-        for column in self._row.keys():
+        # check each column against it's appropriate validation rule, columns without a rule are trusted
+        values = self._values
+        for column, index, rule in self._rules:
             self._current_column = column
-            rule = self.validationRules[column].get('rule', self.trust_this_value)
-            rule(self._row[column]['value'])
+            self._current_index = index
+            rule(values[index])
 
     def validate_mandatory(self, val):
         """
@@ -185,7 +254,7 @@ class TADCImportRow:
         """
         Validate the section types are correct values
         """
-        if val.lower() in ['a', 'c', 'p', 'article', 'chapter', 'page range']:
+        if val.lower() in self.SECTION_TYPES:
             return True
         self.set_rule_error()
         return False
@@ -194,7 +263,7 @@ class TADCImportRow:
         """
         year, issue or volume should be present
         """
-        if all([val.strip() == '', self._row['M']['value'].strip() == '', self._row['O']['value'].strip() == '']):
+        if all([val.strip() == '', self.get_value('M').strip() == '', self.get_value('O').strip() == '']):
             self.set_rule_error()
             return False
         return True
@@ -203,7 +272,7 @@ class TADCImportRow:
         """
         year, issue or volume should be present
         """
-        if all([val.strip() == '', self._row['N']['value'].strip() == '', self._row['O']['value'].strip() == '']):
+        if all([val.strip() == '', self.get_value('N').strip() == '', self.get_value('O').strip() == '']):
             self.set_rule_error()
             return False
         # if not re.match(self.YEAR_FORMAT_REGEX, val.strip()):
@@ -215,7 +284,7 @@ class TADCImportRow:
         """
         year, issue or volume should be present
         """
-        if all([val.strip() == '', self._row['M']['value'].strip() == '', self._row['N']['value'].strip() == '']):
+        if all([val.strip() == '', self.get_value('M').strip() == '', self.get_value('N').strip() == '']):
             self.set_rule_error()
             return False
         return True
@@ -226,7 +295,7 @@ class TADCImportRow:
         :param val:
         :return:
         """
-        if self._row['H']['value'].lower() in ['a', 'article', 'c', 'chapter']:
+        if self.get_value('H').lower() in self.EXTRACT_SECTION_TYPES:
             if val.strip() == '':
                 if self.fix_missing:
                     self.fix()
@@ -241,7 +310,7 @@ class TADCImportRow:
         Author of extract should be present if this is an article
         If a book or chapter, only mandatory if the book author is not set.
         """
-        if self._row['H']['value'].lower() in ['a', 'article']:
+        if self.get_value('H').lower() in self.ARTICLE_SECTION_TYPES:
             if val.strip() == '':
                 if self.fix_missing:
                     self.fix()
@@ -249,7 +318,7 @@ class TADCImportRow:
                 self.set_rule_error()
                 return False
             return True
-        elif val.strip() == '' and self._row['L']['value'].strip() == '':
+        elif val.strip() == '' and self.get_value('L').strip() == '':
             self.set_rule_error()
             return False
         return True
@@ -259,7 +328,7 @@ class TADCImportRow:
         Publisher name should be present for everything except articles
         :return:
         """
-        if self._row['H']['value'].lower() in ['a', 'article']:
+        if self.get_value('H').lower() in self.ARTICLE_SECTION_TYPES:
             return True
 
         if val.strip() == '':
@@ -274,7 +343,7 @@ class TADCImportRow:
         Source values should be one of these A, B, C, D
         :return:
         """
-        if val.strip() not in ['A', 'B', 'C', 'D']:
+        if val.strip() not in self.SOURCES:
             self.set_rule_error()
             return False
         return True
@@ -292,7 +361,7 @@ class TADCImportRow:
         if val.strip() == '':
             self.set_rule_error()
             return False
-        if re.match(self.DATE_FORMAT_REGEX, val.strip()):
+        if self.date_normaliser.has_new_format(val.strip()):
             return True
         if self.fix_missing:
             self.fix_date()
@@ -312,7 +381,7 @@ class TADCImportRow:
         """
         if val.strip() == '':
             return True
-        elif val not in ['y', 'Y', 'n', 'N']:
+        elif val not in self.INCIDENTAL_ARTWORK_VALUES:
             self.set_rule_error()
             return False
 
@@ -324,7 +393,7 @@ class TADCImportRow:
                 "column": self._current_column,
                 "message": u"{} value: '{}' error: {}".format(
                     self.validationRules[self._current_column]['name'],
-                    self._row[self._current_column]['value'],
+                    self._values[self._current_index],
                     self.validationRules[self._current_column]['error']
                 )
             }
@@ -338,16 +407,14 @@ class TADCImportRow:
         """
         Fix the current row value with the fix value from the rules.
         """
-        self._row[self._current_column]['value'] = self.validationRules[self._current_column]['fix_value']
+        self._values[self._current_index] = self.validationRules[self._current_column]['fix_value']
 
     def fix_date(self):
         """
         Fix the date so that it is our desired date format
         """
-        original_date = self._row[self._current_column]['value']
-        original_date_obj = datetime.strptime(original_date, self.old_date_format)
-        new_date = original_date_obj.strftime('%Y/%m/%d')
-        self._row[self._current_column]['value'] = new_date
+        original_date = self._values[self._current_index]
+        self._values[self._current_index] = self.date_normaliser.normalise(original_date)
 
     def is_valid(self):
         """
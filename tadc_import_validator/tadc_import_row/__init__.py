@@ -1 +1,8 @@
 from .TADCImportRow import TADCImportRow
+from .RowResult import RowResult, read_values, validate_row, validate_rows
+from .BatchResult import BatchResult
+from .BatchValidator import BatchValidator, validate_batches
+from .RuleSchema import RuleSchema
+from .SchemaValidator import SchemaValidator
+from .KEVEncoder import KEVEncoder
+from .DateNormaliser import DateNormaliser
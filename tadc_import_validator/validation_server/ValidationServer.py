@@ -0,0 +1,358 @@
+import os
+import csv
+import json
+import stat
+import socket
+import itertools
+import multiprocessing
+from timeit import default_timer as timer
+from logbook import Logger
+from ..tadc_import_row import validate_rows, validate_batches
+from ..error_summary import ErrorSummary
+from ..report_writer import ReportWriter
+from ..csv_io import CSVIO
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    # Python 3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+__author__ = 'timhodson'
+
+log = Logger('ValidationServer')
+
+
+def validate_request(task):
+    """
+    Validate a CSV file or the body of a request and describe the result. This may run in a worker process.
+    Nothing is written to disk, the fixed values are not returned.
+    :param task: tuple of (source, data, options) where source is 'path' with data the name of a file,
+                 or 'body' with data the bytes of a CSV file, and options is a dict of header_rows,
+                 old_date_format, fix_missing, engine, encoding and max_rows
+    :return: dict ready to be sent as JSON
+    """
+    source, data, options = task
+    csv_io = CSVIO(encoding=options['encoding'])
+    try:
+        if source == 'path':
+            with csv_io.open_file(data) as csv_fp:
+                return describe_results(csv_io.reader(csv_fp), options)
+        return describe_results(csv_io.reader_for_bytes(data), options)
+    except (UnicodeDecodeError, csv.Error) as e:
+        # the file isn't CSV in the expected encoding, which is a problem with the request
+        raise RequestError("Could not read the CSV file: {}".format(e))
+
+
+def describe_results(csvreader, options):
+    header_rows = options['header_rows']
+    validate = validate_rows if options['engine'] == 'row' else validate_batches
+    error_summary = ErrorSummary(max_examples=0)
+    rows = valid = 0
+    invalid_rows = []
+    for result in validate(itertools.islice(csvreader, header_rows, None),
+                           old_date_format=options['old_date_format'],
+                           fix_missing=options['fix_missing'],
+                           first_row_number=header_rows):
+        rows += 1
+        if result.valid:
+            valid += 1
+            continue
+        if result.exception is not None:
+            error_summary.add_exception(result.row_number, result.exception)
+        else:
+            error_summary.add_row_errors(result.row_number, result.errors)
+        if len(invalid_rows) < options['max_rows']:
+            invalid_rows.append(ReportWriter.get_record(result))
+    invalid = rows - valid
+    return {
+        "valid": invalid == 0,
+        "rows": rows,
+        "valid_rows": valid,
+        "invalid_rows": invalid,
+        "errors": invalid_rows,
+        "errors_truncated": invalid > len(invalid_rows),
+        "exceptions": error_summary.exception_count,
+        "column_counts": error_summary.column_counts,
+        "rule_counts": error_summary.rule_counts,
+    }
+
+
+class RequestError(Exception):
+    """
+    A problem with a request, sent back as a 400 response or the given status.
+    """
+
+    def __init__(self, message, status=400):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class ValidationRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /health checks the server is up.
+    POST /validate validates the CSV file in the request body, or the file named by the path parameter.
+    Options are given as query parameters: header_rows, fix_missing, old_date_format, engine and max_rows.
+    """
+
+    # keep connections open so a client can send several files without reconnecting
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # unix socket clients don't have an address
+        if not self.client_address:
+            return 'unix socket'
+        return self.client_address[0]
+
+    def log_message(self, format, *args):
+        log.debug("{} {}".format(self.address_string(), format % args))
+
+    def send_json(self, status, body, close=False):
+        """
+        :param close: close the connection after the response, e.g. when the request body hasn't been read
+        """
+        data = json.dumps(body, sort_keys=True).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if close:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        """
+        Read the request body, which can be sent with a Content-Length or chunked. Bodies larger than the
+        server's max_body_size are refused before they are read into memory. A RequestError is raised for these
+        and for a Content-Length or chunk size which isn't a number.
+        :return: bytes
+        """
+        max_body_size = self.server.validation_server.max_body_size
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            length = 0
+            while True:
+                size_line = self.rfile.readline().split(b';')[0].strip()
+                try:
+                    size = int(size_line, 16)
+                except ValueError:
+                    size = -1
+                if size < 0:
+                    raise RequestError("Invalid chunk size {!r}".format(size_line))
+                if size == 0:
+                    # skip any trailers
+                    while self.rfile.readline().strip():
+                        pass
+                    return b''.join(chunks)
+                length += size
+                if length > max_body_size:
+                    raise self.too_large(max_body_size)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise RequestError("Invalid Content-Length")
+        if length > max_body_size:
+            raise self.too_large(max_body_size)
+        return self.rfile.read(length)
+
+    @staticmethod
+    def too_large(max_body_size):
+        return RequestError("The request body is larger than {} bytes, send the path of the file "
+                            "instead".format(max_body_size), 413)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        start = timer()
+        try:
+            body = self.read_body()
+        except RequestError as e:
+            # the rest of the body is still waiting to be read, or can't be found, so the connection can't be used
+            # again
+            self.send_json(e.status, {"error": "{}".format(e)}, close=True)
+            return
+        if url.path != '/validate':
+            self.send_json(404, {"error": "Not found"})
+            return
+        try:
+            parameters = dict((name, values[-1]) for name, values in parse_qs(url.query).items())
+            source, data, options = self.server.validation_server.get_task(parameters, body)
+            response = self.server.validation_server.run_task((source, data, options))
+        except RequestError as e:
+            self.send_json(e.status, {"error": "{}".format(e)})
+            return
+        except Exception as e:
+            log.error("Could not validate request {}: {}".format(self.path, e))
+            self.send_json(500, {"error": "{}".format(e)})
+            return
+        response["elapsed_ms"] = round((timer() - start) * 1000, 3)
+        log.info("Validated {} rows from {} in {}ms".format(response["rows"], data if source == 'path' else 'request',
+                                                          response["elapsed_ms"]))
+        self.send_json(200, response)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    address_family = getattr(socket, 'AF_UNIX', None)
+
+    def server_bind(self):
+        # a socket left behind by a server which was killed is replaced, anything else is left alone
+        try:
+            mode = os.lstat(self.server_address).st_mode
+        except OSError:
+            mode = None
+        if mode is not None:
+            if not stat.S_ISSOCK(mode):
+                raise ValueError("{} already exists and is not a socket".format(self.server_address))
+            os.remove(self.server_address)
+        self.socket.bind(self.server_address)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+class ValidationServer:
+    """
+    A long running validator that answers requests over localhost HTTP or a unix socket, so that callers
+    don't pay for starting Python and importing everything on every file.
+    Requests are handled on threads and validated by a pool of worker processes which is started once,
+    or on the request thread when there is only one worker.
+    A request body is held in memory while it is validated, so bodies are limited to max_body_size and larger
+    files should be sent by path. Invalid values are described in the responses, so only files under root_dir
+    can be sent by path, and none can if there is no root_dir.
+    """
+
+    MAX_BODY_SIZE = 100 * 1024 * 1024
+
+    def __init__(self, old_date_format, header_rows=1, fix_missing=False, engine='batch', encoding='utf-8',
+                 max_rows=1000, workers=1, host='127.0.0.1', port=8765, socket_path=None,
+                 max_body_size=None, root_dir=None):
+        """
+        :param old_date_format: default for requests which don't give one
+        :param header_rows: default for requests which don't give one
+        :param fix_missing: default for requests which don't give one
+        :param engine: default for requests which don't give one
+        :param encoding: encoding of the CSV files
+        :param max_rows: most invalid rows described in a response, by default
+        :param workers: number of worker processes
+        :param host: address to listen on
+        :param port: port to listen on
+        :param socket_path: listen on this unix socket rather than a port
+        :param max_body_size: largest request body in bytes, larger ones get a 413 response
+        :param root_dir: directory of the files which can be validated by path, None to only validate bodies
+        """
+        self.defaults = {
+            "header_rows": int(header_rows),
+            "old_date_format": old_date_format,
+            "fix_missing": bool(fix_missing),
+            "engine": engine,
+            "encoding": encoding,
+            "max_rows": int(max_rows),
+        }
+        self.workers = int(workers)
+        self.socket_path = socket_path
+        self.max_body_size = int(max_body_size or self.MAX_BODY_SIZE)
+        self.root_dir = os.path.realpath(root_dir) if root_dir else None
+        self.pool = None
+        if socket_path:
+            self.http_server = UnixHTTPServer(socket_path, ValidationRequestHandler)
+        else:
+            self.http_server = ThreadingHTTPServer((host, int(port)), ValidationRequestHandler)
+        self.http_server.validation_server = self
+
+    def get_address(self):
+        if self.socket_path:
+            return self.socket_path
+        return "http://{}:{}".format(*self.http_server.server_address[:2])
+
+    def get_task(self, parameters, body):
+        """
+        Work out what a request is asking for.
+        :param parameters: dict of query parameters
+        :param body: request body
+        :return: task for validate_request()
+        """
+        options = dict(self.defaults)
+        for name in ['header_rows', 'max_rows']:
+            if name in parameters:
+                try:
+                    options[name] = int(parameters[name])
+                except ValueError:
+                    raise RequestError("{} should be a number".format(name))
+        if 'fix_missing' in parameters:
+            options['fix_missing'] = parameters['fix_missing'].lower() in ['1', 'true', 'yes', 'y']
+        if 'old_date_format' in parameters:
+            options['old_date_format'] = parameters['old_date_format']
+        if 'engine' in parameters:
+            if parameters['engine'] not in ['batch', 'row']:
+                raise RequestError("engine should be 'batch' or 'row'")
+            options['engine'] = parameters['engine']
+        if 'path' in parameters:
+            return 'path', self.get_path(parameters['path']), options
+        return 'body', body, options
+
+    def get_path(self, path):
+        """
+        The file a request names with the path parameter, relative to root_dir or absolute.
+        :param path:
+        :return: the real path of the file
+        """
+        if self.root_dir is None:
+            raise RequestError("Files can't be validated by path, the server has no root directory", 403)
+        try:
+            real_path = os.path.realpath(os.path.join(self.root_dir, path))
+        except (TypeError, ValueError):
+            # e.g. a null byte in the path
+            raise RequestError("Invalid path {!r}".format(path))
+        # links are followed first, so they can't lead out of the root directory either
+        if not real_path.startswith(os.path.join(self.root_dir, '')):
+            raise RequestError("{} is outside the server's root directory".format(path), 403)
+        if not os.path.isfile(real_path):
+            raise RequestError("No such file: {}".format(path))
+        return real_path
+
+    def run_task(self, task):
+        if self.pool is None:
+            return validate_request(task)
+        return self.pool.apply(validate_request, (task,))
+
+    def serve_forever(self):
+        """
+        Handle requests until interrupted.
+        :return:
+        """
+        if self.workers > 1:
+            self.pool = multiprocessing.Pool(processes=self.workers)
+        log.info("Listening on {} with {} workers".format(self.get_address(), self.workers))
+        if self.root_dir:
+            log.info("Files under {} can be validated by path".format(self.root_dir))
+        try:
+            self.http_server.serve_forever()
+        except KeyboardInterrupt:
+            log.info("Stopping")
+        finally:
+            self.close()
+
+    def close(self):
+        self.http_server.server_close()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
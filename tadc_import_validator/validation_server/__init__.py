@@ -0,0 +1 @@
+from .ValidationServer import ValidationServer, validate_request
@@ -0,0 +1,88 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from benchmarks.csv_generator import TADCCSVGenerator
+from tadc_import_validator.csv_io import CSVIO
+
+__author__ = 'timhodson'
+
+OLD_DATE_FORMAT = '%d/%m/%Y'
+# an unquoted value with a quote part way through it, which the csv module reads as part of the value
+STRAY_QUOTE_VALUE = u'The 12" single'
+
+
+def generate_rows(count, seed=1):
+    """
+    Rows of a generated import file, header first, with errors, old dates to fix and some values which need
+    quoting: newlines, escaped quotes and commas, so that records don't always end at the end of a line.
+    :param count: number of rows after the header
+    :param seed:
+    :return: list of lists of values
+    """
+    generator = TADCCSVGenerator(error_rate=0.05, old_date_rate=0.1, old_date_format=OLD_DATE_FORMAT,
+                                 readings_per_course=5, seed=seed)
+    rows = [generator.header()]
+    for index, row in enumerate(generator.rows(count)):
+        if index % 7 == 3:
+            row[15] = u'{}\nwith a "second" line, and a comma'.format(row[15])
+        if index % 11 == 5:
+            row[16] = u'{}\r\n"quoted"'.format(row[16])
+        rows.append(row)
+    return rows
+
+
+def write_rows(filename, rows):
+    csv_io = CSVIO()
+    with csv_io.open_file(filename, 'w') as csv_fp:
+        writer = csv_io.writer(csv_fp)
+        for row in rows:
+            writer.writerow(row)
+
+
+def write_stray_quotes(filename, rows, row_numbers, column=10):
+    """
+    Write rows with STRAY_QUOTE_VALUE left unquoted in some of them, as a hand edited file might have it.
+    The csv writer would quote it, so a placeholder is written and then swapped for it.
+    :param filename:
+    :param rows:
+    :param row_numbers: rows given the value
+    :param column:
+    :return: the rows written
+    """
+    placeholder = u'STRAY_QUOTE_PLACEHOLDER'
+    rows = [list(row) for row in rows]
+    for row_number in row_numbers:
+        rows[row_number][column] = placeholder
+    write_rows(filename, rows)
+    with io.open(filename, 'rb') as csv_fp:
+        data = csv_fp.read()
+    with io.open(filename, 'wb') as csv_fp:
+        csv_fp.write(data.replace(placeholder.encode('utf-8'), STRAY_QUOTE_VALUE.encode('utf-8')))
+    for row_number in row_numbers:
+        rows[row_number][column] = STRAY_QUOTE_VALUE
+    return rows
+
+
+def read_rows(filename):
+    csv_io = CSVIO()
+    with csv_io.open_file(filename) as csv_fp:
+        return list(csv_io.reader(csv_fp))
+
+
+class GeneratedFileTestCase(unittest.TestCase):
+    """
+    Writes a generated import file to a temporary directory for each test.
+    """
+
+    ROWS = 1500
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='tadc_tests_')
+        self.csv_file_name = os.path.join(self.work_dir, 'requests.csv')
+        self.rows = generate_rows(self.ROWS)
+        write_rows(self.csv_file_name, self.rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
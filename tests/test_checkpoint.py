@@ -0,0 +1,133 @@
+import io
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from tadc_import_validator.checkpoint import Checkpoint
+from tadc_import_validator.csv_file_validator import CSVFileValidator
+from .generated_files import GeneratedFileTestCase, OLD_DATE_FORMAT, write_rows, write_stray_quotes
+
+__author__ = 'timhodson'
+
+
+class Interrupted(Exception):
+    pass
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='tadc_tests_')
+        self.checkpoint_filename = os.path.join(self.work_dir, 'file.checkpoint.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_save_and_load(self):
+        checkpoint = Checkpoint(self.checkpoint_filename, {"csv_file": "file.csv", "fix_missing": True})
+        self.assertIsNone(checkpoint.load())
+        checkpoint.save({"row_count": 100})
+        checkpoint.save({"row_count": 200})
+        self.assertEqual(checkpoint.load(), {"row_count": 200})
+        self.assertEqual(os.listdir(self.work_dir), ['file.checkpoint.json'])
+        checkpoint.remove()
+        self.assertFalse(os.path.exists(self.checkpoint_filename))
+
+    def test_other_settings(self):
+        Checkpoint(self.checkpoint_filename, {"fix_missing": True}).save({"row_count": 100})
+        self.assertIsNone(Checkpoint(self.checkpoint_filename, {"fix_missing": False}).load())
+
+    def test_unreadable(self):
+        with open(self.checkpoint_filename, 'w') as checkpoint_fp:
+            checkpoint_fp.write('{"settings": ')
+        self.assertIsNone(Checkpoint(self.checkpoint_filename, {}).load())
+
+
+class ResumeTest(GeneratedFileTestCase):
+    """
+    A run interrupted part way through and then resumed gives the same output files and counts as one which
+    wasn't interrupted.
+    """
+
+    ROWS = 3000
+
+    def setUp(self):
+        GeneratedFileTestCase.setUp(self)
+        # repeat some of the requests so that the duplicate checks carry on from the checkpoint too
+        self.rows = self.rows + self.rows[1:301]
+        write_rows(self.csv_file_name, self.rows)
+
+    def run_validator(self, output_dir, stop_after=None, **options):
+        """
+        Validate a copy of the file in output_dir, so the output files and checkpoint go there too, raising
+        Interrupted when the row stop_after is recorded.
+        """
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        csv_file_name = os.path.join(output_dir, os.path.basename(self.csv_file_name))
+        if not os.path.exists(csv_file_name):
+            shutil.copy(self.csv_file_name, csv_file_name)
+        validator = CSVFileValidator(csv_file_name, output_dir, OLD_DATE_FORMAT, header_rows=1,
+                                     fix_missing=True, progress_every=0, check_duplicates=True,
+                                     report_file=os.path.join(output_dir, 'report.jsonl'),
+                                     kev_file=os.path.join(output_dir, 'requests.kev'), **options)
+        # small blocks, so a single process saves several checkpoints before it is interrupted
+        validator.CHECKPOINT_BLOCK_SIZE = 16 * 1024
+        if stop_after is not None:
+            record_invalid_row = validator.record_invalid_row
+
+            def interrupt(row_counter, *args):
+                if row_counter >= stop_after:
+                    raise Interrupted()
+                return record_invalid_row(row_counter, *args)
+            validator.record_invalid_row = interrupt
+        with validator:
+            validator.validate_file()
+        return validator
+
+    def get_outputs(self, output_dir):
+        outputs = {}
+        for name in sorted(os.listdir(output_dir)):
+            with io.open(os.path.join(output_dir, name), 'rb') as output_fp:
+                outputs[name] = output_fp.read()
+        return outputs
+
+    @staticmethod
+    def get_counts(validator):
+        return (validator.row_count, validator.valid_count, validator.invalid_count,
+                validator.cross_row_checker.duplicate_count, validator.error_summary.get_state())
+
+    def assert_resumes(self, first_workers, resume_workers):
+        expected_dir = os.path.join(self.work_dir, 'expected')
+        expected = self.run_validator(expected_dir)
+        self.assertGreater(expected.cross_row_checker.duplicate_count, 0)
+
+        output_dir = os.path.join(self.work_dir, 'resumed')
+        self.assertRaises(Interrupted, self.run_validator, output_dir, stop_after=2500, checkpoint_every=200,
+                          workers=first_workers)
+        checkpoint_filename = os.path.join(output_dir, 'requests.checkpoint.json')
+        with open(checkpoint_filename) as checkpoint_fp:
+            self.assertGreater(json.load(checkpoint_fp)["state"]["row_count"], 0)
+        self.assertFalse(os.path.exists(os.path.join(output_dir, 'requests.fixed.csv')))
+
+        resumed = self.run_validator(output_dir, checkpoint_every=200, resume=True, workers=resume_workers)
+        self.assertEqual(self.get_counts(resumed), self.get_counts(expected))
+        self.assertEqual(self.get_outputs(output_dir), self.get_outputs(expected_dir))
+
+    def test_resume(self):
+        self.assert_resumes(1, 1)
+
+    def test_resume_with_stray_quotes(self):
+        # the blocks read between checkpoints must still end on records
+        write_stray_quotes(self.csv_file_name, self.rows, [5, 1500])
+        self.assert_resumes(1, 1)
+
+    def test_resume_with_workers(self):
+        self.assert_resumes(2, 1)
+        shutil.rmtree(os.path.join(self.work_dir, 'resumed'))
+        self.assert_resumes(1, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from tadc_import_validator.cross_row_checker import CrossRowChecker
+from tadc_import_validator.tadc_import_row import TADCImportRow
+from .generated_files import generate_rows
+
+__author__ = 'timhodson'
+
+
+def request(course_code, isbn, start_page=u'1', end_page=u'10', filename=u''):
+    values = list(generate_rows(1)[1])
+    for letter, value in [('A', course_code), ('I', isbn), ('T', start_page), ('U', end_page),
+                          ('W', filename)]:
+        values[TADCImportRow.COLUMN_INDEX[letter]] = value
+    return values
+
+
+class CrossRowCheckerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='tadc_tests_')
+        self.seen_filename = os.path.join(self.work_dir, 'requests.seen.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    @staticmethod
+    def get_rules(checker, row_number, values):
+        return [error["rule"] for error in checker.get_errors(row_number, values)]
+
+    def test_duplicates(self):
+        checker = CrossRowChecker(check_duplicates=True)
+        self.assertEqual(self.get_rules(checker, 0, request(u'AB100', u'978-0-14-044913-6')), [])
+        self.assertEqual(self.get_rules(checker, 1, request(u'AB100', u'978-0-14-044913-6', end_page=u'11')), [])
+        self.assertEqual(self.get_rules(checker, 2, request(u'AB101', u'978-0-14-044913-6')), [])
+        errors = checker.get_errors(3, request(u'ab100', u'978 0 14 044913 6'))
+        self.assertEqual([error["rule"] for error in errors], ["check_duplicate"])
+        self.assertIn(u'Duplicate of row 1 ', errors[0]["message"])
+        # rows with nothing to compare are never duplicates
+        self.assertEqual(self.get_rules(checker, 4, request(u'', u'9780140449136')), [])
+        self.assertEqual(self.get_rules(checker, 5, request(u'', u'9780140449136')), [])
+        self.assertEqual(checker.duplicate_count, 1)
+
+    def test_scan_dir(self):
+        scan_dir = os.path.join(self.work_dir, 'scans')
+        os.makedirs(os.path.join(scan_dir, 'AB100'))
+        open(os.path.join(scan_dir, 'AB100', 'chapter1.pdf'), 'w').close()
+        checker = CrossRowChecker(scan_dir=scan_dir)
+        self.assertEqual(self.get_rules(checker, 0, request(u'AB100', u'1', filename=u'AB100/chapter1.pdf')), [])
+        self.assertEqual(self.get_rules(checker, 1, request(u'AB100', u'1', filename=u'\\AB100\\chapter1.pdf')), [])
+        self.assertEqual(self.get_rules(checker, 2, request(u'AB100', u'1', filename=u'AB100/chapter2.pdf')),
+                         ["check_scan_exists"])
+        self.assertEqual(checker.missing_count, 1)
+        self.assertRaises(ValueError, CrossRowChecker, scan_dir=os.path.join(self.work_dir, 'missing'))
+
+    def assert_carries_on(self, seen_filename):
+        checker = CrossRowChecker(check_duplicates=True, seen_filename=seen_filename)
+        for row_number in range(4):
+            checker.get_errors(row_number, request(u'AB100', u'{}'.format(row_number)))
+        # as saved in a checkpoint
+        state = json.loads(json.dumps(checker.get_state()))
+        # rows after the state was taken are forgotten when carrying on from it
+        checker.get_errors(4, request(u'AB100', u'4'))
+        checker.get_state()
+
+        resumed = CrossRowChecker(check_duplicates=True, seen_filename=seen_filename)
+        self.assertTrue(CrossRowChecker.can_resume(seen_filename, state))
+        resumed.set_state(state)
+        self.assertEqual(self.get_rules(resumed, 5, request(u'AB100', u'2')), ["check_duplicate"])
+        self.assertEqual(self.get_rules(resumed, 6, request(u'AB100', u'4')), [])
+        self.assertEqual(self.get_rules(resumed, 7, request(u'AB100', u'4')), ["check_duplicate"])
+        self.assertEqual(resumed.duplicate_count, 2)
+        return resumed
+
+    def test_state(self):
+        self.assert_carries_on(None)
+
+    def test_seen_file(self):
+        resumed = self.assert_carries_on(self.seen_filename)
+        state = resumed.get_state()
+        self.assertNotIn("seen", state)
+        self.assertEqual(os.path.getsize(self.seen_filename), state["seen_length"])
+        resumed.close()
+        self.assertFalse(os.path.exists(self.seen_filename))
+        self.assertFalse(CrossRowChecker.can_resume(self.seen_filename, state))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import io
+import os
+from tadc_import_validator.csv_file_validator import CSVFileValidator
+from .generated_files import GeneratedFileTestCase, OLD_DATE_FORMAT, read_rows
+
+__author__ = 'timhodson'
+
+
+class OutputFilesTest(GeneratedFileTestCase):
+    """
+    The fixed and invalid files only replace those from an earlier run once a run has finished.
+    """
+
+    ROWS = 200
+
+    def setUp(self):
+        GeneratedFileTestCase.setUp(self)
+        self.output_names = ['requests.fixed.csv', 'requests.invalid.csv']
+        for name in self.output_names:
+            self.write_file(name, b'from an earlier run\n')
+
+    def write_file(self, name, data):
+        with io.open(os.path.join(self.work_dir, name), 'wb') as output_fp:
+            output_fp.write(data)
+
+    def read_file(self, name):
+        with io.open(os.path.join(self.work_dir, name), 'rb') as output_fp:
+            return output_fp.read()
+
+    def make_validator(self):
+        return CSVFileValidator(self.csv_file_name, self.work_dir, OLD_DATE_FORMAT, header_rows=1, fix_missing=True,
+                                progress_every=0)
+
+    def test_finished(self):
+        # what another run writing the same outputs at the same time has so far
+        self.write_file('requests.fixed.csv.tmp', b'another run\n')
+        with self.make_validator() as validator:
+            temp_filenames = [output["temp_filename"] for output in validator.output_writer._outputs]
+            self.assertEqual(temp_filenames, [os.path.join(self.work_dir, "{}.{}.tmp".format(name, os.getpid()))
+                                              for name in self.output_names])
+            validator.validate_file()
+        self.assertEqual(validator.valid_count + validator.invalid_count, self.ROWS)
+        self.assertEqual(len(read_rows(os.path.join(self.work_dir, 'requests.fixed.csv'))),
+                         validator.output_writer.valid_count)
+        self.assertEqual(self.read_file('requests.fixed.csv.tmp'), b'another run\n')
+        self.assertEqual(sorted(os.listdir(self.work_dir)),
+                         ['requests.csv', 'requests.fixed.csv', 'requests.fixed.csv.tmp', 'requests.invalid.csv'])
+
+    def test_not_run(self):
+        with self.make_validator():
+            pass
+        for name in self.output_names:
+            self.assertEqual(self.read_file(name), b'from an earlier run\n')
+        self.assertEqual(sorted(os.listdir(self.work_dir)), ['requests.csv'] + self.output_names)
+
+    def test_failed(self):
+        def fail(*args):
+            raise IOError("disk full")
+        try:
+            with self.make_validator() as validator:
+                validator.record_valid_row = fail
+                validator.validate_file()
+        except IOError:
+            pass
+        for name in self.output_names:
+            self.assertEqual(self.read_file(name), b'from an earlier run\n')
+        self.assertEqual(sorted(os.listdir(self.work_dir)), ['requests.csv'] + self.output_names)
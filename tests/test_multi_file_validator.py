@@ -0,0 +1,43 @@
+import os
+from tadc_import_validator.multi_file_validator import MultiFileValidator, find_csv_files
+from .generated_files import GeneratedFileTestCase, OLD_DATE_FORMAT, write_rows
+
+__author__ = 'timhodson'
+
+
+class MultiFileValidatorTest(GeneratedFileTestCase):
+
+    ROWS = 200
+
+    def write_file(self, name, rows=None):
+        csv_file_name = os.path.join(self.work_dir, name)
+        if not os.path.isdir(os.path.dirname(csv_file_name)):
+            os.makedirs(os.path.dirname(csv_file_name))
+        write_rows(csv_file_name, rows or self.rows)
+        return csv_file_name
+
+    def test_find_csv_files(self):
+        batch = [self.write_file(os.path.join('batch', name))
+                 for name in ['a.csv', 'b.csv.gz', 'a.fixed.csv', 'notes.txt']]
+        self.assertEqual(find_csv_files([os.path.join(self.work_dir, 'batch')]), batch[:2])
+        # a file reached twice is only validated once
+        self.assertEqual(find_csv_files([batch[0], os.path.join(self.work_dir, 'batch', '*.csv')]),
+                         [batch[0], batch[2]])
+        self.assertEqual(find_csv_files([os.path.join(self.work_dir, 'missing', '*.csv')]), [])
+
+    def test_file_labels(self):
+        csv_files = [self.write_file(name) for name in ['a/file.csv', 'b/file.csv.gz', 'other.csv']]
+        validator = MultiFileValidator(csv_files, report_file='report.jsonl')
+        self.assertEqual([validator.get_report_filename(csv_file) for csv_file in csv_files],
+                         ['report.a.file.jsonl', 'report.b.file.jsonl', 'report.other.jsonl'])
+        self.assertEqual(MultiFileValidator.get_file_labels(csv_files[1:]), {csv_files[1]: 'file',
+                                                                           csv_files[2]: 'other'})
+
+    def test_failed_files(self):
+        csv_files = [self.csv_file_name, os.path.join(self.work_dir, 'missing.csv')]
+        validator = MultiFileValidator(csv_files, output_dir=self.work_dir, old_date_format=OLD_DATE_FORMAT,
+                                       header_rows=1, progress_every=0)
+        validator.validate_files()
+        self.assertEqual(validator.failed_count, 1)
+        self.assertEqual([outcome["exception"] is None for outcome in validator.outcomes], [True, False])
+        self.assertEqual(validator.outcomes[0]["rows"], self.ROWS)
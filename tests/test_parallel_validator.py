@@ -0,0 +1,136 @@
+import os
+import unittest
+from tadc_import_validator.csv_io import CSVIO
+from tadc_import_validator.parallel_validator import ParallelValidator, find_chunk_offsets
+from tadc_import_validator.parallel_validator.ParallelValidator import PENDING_CHUNKS_PER_WORKER
+from tadc_import_validator.tadc_import_row import validate_rows
+from .generated_files import GeneratedFileTestCase, OLD_DATE_FORMAT, read_rows, write_stray_quotes
+
+__author__ = 'timhodson'
+
+
+class FindChunkOffsetsTest(GeneratedFileTestCase):
+
+    def read_chunk(self, start, end):
+        with open(self.csv_file_name, 'rb') as fp:
+            fp.seek(start)
+            return list(CSVIO().reader_for_bytes(fp.read(end - start)))
+
+    def test_chunks_cover_the_file(self):
+        chunks = find_chunk_offsets(self.csv_file_name, 17, block_size=256)
+        self.assertEqual(len(chunks), 17)
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], os.path.getsize(self.csv_file_name))
+        for (start, end), (next_start, next_end) in zip(chunks, chunks[1:]):
+            self.assertEqual(end, next_start)
+
+    def test_chunks_start_at_records(self):
+        # small blocks so that quoted fields are split across the blocks scanned
+        for block_size in [64, 256, 1024 * 1024]:
+            rows = []
+            for start, end in find_chunk_offsets(self.csv_file_name, 23, block_size=block_size):
+                rows.extend(self.read_chunk(start, end))
+            self.assertEqual(rows, self.rows)
+
+    def test_stray_quotes(self):
+        # a quote in an unquoted value doesn't start a quoted field, so newlines after it still end records
+        self.rows = write_stray_quotes(self.csv_file_name, self.rows, [5, 700, 701, 1200])
+        self.assertEqual(read_rows(self.csv_file_name), self.rows)
+        self.test_chunks_start_at_records()
+
+    def test_start(self):
+        chunks = find_chunk_offsets(self.csv_file_name, 5)
+        start = chunks[2][0]
+        tail = self.read_chunk(start, os.path.getsize(self.csv_file_name))
+        rows = []
+        for chunk_start, end in find_chunk_offsets(self.csv_file_name, 7, start=start):
+            self.assertGreaterEqual(chunk_start, start)
+            rows.extend(self.read_chunk(chunk_start, end))
+        self.assertEqual(rows, tail)
+
+    def test_more_chunks_than_records(self):
+        chunks = find_chunk_offsets(self.csv_file_name, 100000)
+        self.assertEqual(sum(len(self.read_chunk(start, end)) for start, end in chunks), len(self.rows))
+
+
+class FinishedTask:
+
+    def __init__(self, result):
+        self.result = result
+
+    def get(self):
+        return self.result
+
+
+class RecordingPool:
+    """
+    Stands in for a multiprocessing.Pool, handing each task back as its result and counting them.
+    """
+
+    def __init__(self):
+        self.submitted = 0
+
+    def apply_async(self, function, args):
+        self.submitted += 1
+        return FinishedTask(args[0])
+
+
+class ParallelValidatorTest(GeneratedFileTestCase):
+
+    def get_row_engine_results(self, fix_missing):
+        return list(validate_rows(read_rows(self.csv_file_name), old_date_format=OLD_DATE_FORMAT,
+                                  fix_missing=fix_missing))
+
+    def test_same_results_as_row_engine(self):
+        for fix_missing in [False, True]:
+            expected = self.get_row_engine_results(fix_missing)
+            self.assertTrue(any(not result.valid for result in expected))
+            for engine in ['batch', 'row']:
+                validator = ParallelValidator(self.csv_file_name, 3, OLD_DATE_FORMAT, fix_missing=fix_missing,
+                                              engine=engine)
+                self.assertEqual(list(validator.iter_results()), expected)
+
+    def test_stray_quotes(self):
+        write_stray_quotes(self.csv_file_name, self.rows, [5])
+        validator = ParallelValidator(self.csv_file_name, 3, OLD_DATE_FORMAT)
+        self.assertEqual(list(validator.iter_results()), self.get_row_engine_results(False))
+
+    def test_pending_chunks(self):
+        validator = ParallelValidator(self.csv_file_name, 3, OLD_DATE_FORMAT)
+        pool = RecordingPool()
+        tasks = list(range(50))
+        results = []
+        for result in validator.iter_chunk_results(pool, tasks):
+            results.append(result)
+            # the chunks handed to the pool and not yet consumed, including this one
+            self.assertLessEqual(pool.submitted - len(results) + 1, 3 * PENDING_CHUNKS_PER_WORKER)
+        self.assertEqual(results, tasks)
+        self.assertEqual(pool.submitted, len(tasks))
+
+    def test_resume_point(self):
+        validator = ParallelValidator(self.csv_file_name, 2, OLD_DATE_FORMAT, engine='batch')
+        chunks = validator.get_chunks()
+        ends = set(end for start, end in chunks)
+        results = []
+        for result in validator.iter_results():
+            rows_read, offset = validator.resume_point
+            # the resume point is just after the chunk the result came from
+            self.assertIn(offset, ends)
+            self.assertGreater(rows_read, result.row_number)
+            results.append(result)
+        self.assertEqual(validator.resume_point, (len(self.rows), os.path.getsize(self.csv_file_name)))
+
+        # carrying on from the end of the first chunk gives the rest of the results
+        start = chunks[0][1]
+        first_row_number = len(self.read_rows_before(start))
+        validator = ParallelValidator(self.csv_file_name, 2, OLD_DATE_FORMAT, engine='batch', start=start,
+                                      first_row_number=first_row_number)
+        self.assertEqual(list(validator.iter_results()), results[first_row_number:])
+
+    def read_rows_before(self, offset):
+        with open(self.csv_file_name, 'rb') as fp:
+            return list(CSVIO().reader_for_bytes(fp.read(offset)))
+
+
+if __name__ == '__main__':
+    unittest.main()
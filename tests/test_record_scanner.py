@@ -0,0 +1,76 @@
+import io
+import unittest
+from tadc_import_validator.csv_io import CSVIO, RecordScanner
+from .generated_files import GeneratedFileTestCase, read_rows, write_stray_quotes
+
+__author__ = 'timhodson'
+
+# record ends as the csv module reads them
+RECORDS = [
+    (b'a,b\r\nc,d\r\n', [5, 10]),
+    (b'"a\nb",c\nd\n', [8, 10]),
+    (b'"a"",\n""b",c\nd\n', [13, 15]),
+    (b'12" single,b\nc\n', [13, 15]),
+    (b'a,b"\nc"\nd\n', [5, 8, 10]),
+    (b'"a"b"\nc\n', [6, 8]),
+    (b'a,"b\nc"\n\n"",""\n', [8, 9, 15]),
+    (b'a,"b\nc', []),
+]
+
+
+class RecordScannerTest(unittest.TestCase):
+
+    def get_ends(self, data):
+        scanner = RecordScanner()
+        ends = []
+        end = scanner.find_end(data)
+        while end is not None:
+            ends.append(end)
+            end = scanner.find_end(data, end)
+        return ends
+
+    def test_record_ends(self):
+        for data, expected in RECORDS:
+            self.assertEqual(self.get_ends(data), expected, data)
+            # each record on its own gives the same rows as the whole file
+            rows = []
+            for start, end in zip([0] + expected, expected):
+                record_rows = list(CSVIO().reader_for_bytes(data[start:end]))
+                self.assertLessEqual(len(record_rows), 1, data)
+                rows.extend(record_rows)
+            self.assertEqual(rows, list(CSVIO().reader_for_bytes(data[:expected[-1]])) if expected else [])
+
+    def test_split_anywhere(self):
+        # wherever the data is split the scan carries on across the split
+        for data, expected in RECORDS:
+            for split in range(len(data) + 1):
+                scanner = RecordScanner()
+                first = scanner.find_last_end(data, 0, split)
+                last = scanner.find_last_end(data, split)
+                self.assertEqual(last or first, expected[-1] if expected else None, (data, split))
+                self.assertEqual(first, max([end for end in expected if end <= split] or [None]), (data, split))
+
+
+class ReadRecordBlocksTest(GeneratedFileTestCase):
+
+    def assert_blocks(self, block_size):
+        with io.open(self.csv_file_name, 'rb') as csv_fp:
+            blocks = list(CSVIO.read_record_blocks(csv_fp, block_size))
+            self.assertEqual(blocks[-1][1], csv_fp.tell())
+        rows = []
+        position = 0
+        for data, end in blocks:
+            position += len(data)
+            self.assertEqual(end, position)
+            rows.extend(CSVIO().reader_for_bytes(data))
+        self.assertEqual(rows, read_rows(self.csv_file_name))
+
+    def test_blocks_end_on_records(self):
+        write_stray_quotes(self.csv_file_name, self.rows, [5, 700, 701, 1200])
+        # blocks smaller than a record as well as ones holding many
+        for block_size in [16, 1000, 64 * 1024]:
+            self.assert_blocks(block_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
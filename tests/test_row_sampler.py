@@ -0,0 +1,73 @@
+import io
+import unittest
+from tadc_import_validator.csv_io import CSVIO
+from tadc_import_validator.row_sampler import RowSampler
+from .generated_files import GeneratedFileTestCase
+
+__author__ = 'timhodson'
+
+
+def quote_all(rows):
+    """
+    The rows as CSV with every value quoted, so that every newline could be inside a quoted field.
+    """
+    return b''.join(b','.join(b'"' + value.replace(u'"', u'""').encode('utf-8') + b'"' for value in row) + b'\r\n'
+                    for row in rows)
+
+
+class RowSamplerTest(GeneratedFileTestCase):
+    """
+    Every sampled row is a whole record of the file, found at the offset given for it, whatever quotes and
+    newlines are around the place the sampler seeked to.
+    """
+
+    def get_sample(self, sample_size, **options):
+        read_size = options.pop('read_size', None)
+        sampler = RowSampler(self.csv_file_name, sample_size, header_rows=1, **options)
+        if read_size is not None:
+            sampler.READ_SIZE = read_size
+            sampler.CHECK_SIZE = read_size // 2
+        return list(sampler.iter_rows())
+
+    def assert_records(self, sample):
+        with io.open(self.csv_file_name, 'rb') as csv_fp:
+            data = csv_fp.read()
+        offsets = [offset for offset, row in sample]
+        self.assertEqual(offsets, sorted(set(offsets)))
+        for offset, row in sample:
+            self.assertIn(row, self.rows[1:])
+            self.assertEqual(next(iter(CSVIO().reader_for_bytes(data[offset:]))), row)
+
+    def test_sample(self):
+        sample = self.get_sample(50)
+        self.assertEqual(len(sample), 50)
+        self.assert_records(sample)
+
+    def test_small_reads(self):
+        # records are longer than a read, so more has to be read to find where they end
+        sample = self.get_sample(50, read_size=64)
+        self.assertEqual(len(sample), 50)
+        self.assert_records(sample)
+
+    def test_quote_all(self):
+        with io.open(self.csv_file_name, 'wb') as csv_fp:
+            csv_fp.write(quote_all(self.rows))
+        for read_size in [None, 64]:
+            sample = self.get_sample(50, read_size=read_size)
+            self.assertEqual(len(sample), 50)
+            self.assert_records(sample)
+
+    def test_random(self):
+        sample = self.get_sample(50, random_sample=True, seed=3)
+        self.assert_records(sample)
+        self.assertEqual(self.get_sample(50, random_sample=True, seed=3), sample)
+
+    def test_more_than_rows(self):
+        sample = self.get_sample(self.ROWS * 2)
+        self.assertLessEqual(len(sample), self.ROWS)
+        self.assert_records(sample)
+        self.assertEqual(sample[0][1], self.rows[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import random
+import unittest
+from tadc_import_validator.tadc_import_row import TADCImportRow, RuleSchema, validate_rows, validate_batches
+from .generated_files import generate_rows, OLD_DATE_FORMAT
+
+__author__ = 'timhodson'
+
+# values which take the rules down their different branches
+EDGE_VALUES = [u'', u' ', u'a', u'A', u'Article', u'c', u'CHAPTER', u'p', u'Page Range', u'Book', u'2016/02/22',
+               u'2016/2/22', u'22/02/2016', u'99/99/2016', u'12', u'12-15', u'0', u'y', u'N', u'maybe', u'D',
+               u'Z', u' padded ', u'1990', u'x' * 300]
+
+
+def fuzzed_rows(count, seed=1):
+    """
+    Generated rows with values swapped for edge values at random.
+    """
+    rows = generate_rows(count, seed=seed)[1:]
+    chooser = random.Random(seed)
+    for row in rows:
+        for index in range(len(row)):
+            if chooser.random() < 0.2:
+                row[index] = chooser.choice(EDGE_VALUES)
+    # rows which are short or long
+    rows.append(rows[0][:5])
+    rows.append(rows[1] + [u'extra'])
+    rows.append([])
+    return rows
+
+
+class SchemaValidatorTest(unittest.TestCase):
+    """
+    TADCImportRow, BatchValidator and a SchemaValidator for the default schema are separate implementations of
+    the same rules, so check that they give the same results.
+    """
+
+    def assert_engines_agree(self, rows):
+        schema = RuleSchema.default()
+        for fix_missing in [False, True]:
+            expected = list(validate_rows(rows, old_date_format=OLD_DATE_FORMAT, fix_missing=fix_missing))
+            self.assertTrue(any(result.valid for result in expected))
+            self.assertTrue(any(result.errors for result in expected))
+            batch = list(validate_batches(rows, old_date_format=OLD_DATE_FORMAT, fix_missing=fix_missing,
+                                          batch_size=97))
+            self.assertEqual(batch, expected)
+            compiled = list(validate_batches(rows, old_date_format=OLD_DATE_FORMAT, fix_missing=fix_missing,
+                                             batch_size=97, schema=schema))
+            self.assertEqual(compiled, expected)
+
+    def test_generated_rows(self):
+        self.assert_engines_agree(generate_rows(3000))
+
+    def test_fuzzed_rows(self):
+        self.assert_engines_agree(fuzzed_rows(3000))
+
+    def test_every_rule_fails(self):
+        rules = set(column['rule'] for column in TADCImportRow.validationRules.values() if 'rule' in column)
+        failed = set()
+        for result in validate_batches(fuzzed_rows(3000), old_date_format=OLD_DATE_FORMAT,
+                                       schema=RuleSchema.default()):
+            for error in result.errors:
+                failed.add(TADCImportRow.validationRules[error['column']]['rule'])
+        self.assertEqual(failed, rules)
+
+    def test_changed_rule(self):
+        schema = RuleSchema.default().schema
+        schema['columns']['C']['checks'] = [{"required": True, "regex": "[0-9]+$"}]
+        schema['columns']['C']['error'] = "Should be a number"
+        schema['columns']['C']['rule'] = "validate_number"
+        rows = [[u'EPM742', u'Course', u'lots']]
+        results = list(validate_batches(rows, old_date_format=OLD_DATE_FORMAT, schema=RuleSchema(schema)))
+        errors = [error for error in results[0].errors if error['column'] == 'C']
+        self.assertEqual(errors, [{"column": "C", "rule": "validate_number",
+                                   "message": u"Student numbers value: 'lots' error: Should be a number"}])
+
+
+class RuleSchemaTest(unittest.TestCase):
+
+    def assert_invalid(self, change):
+        schema = RuleSchema.default().schema
+        change(schema['columns'])
+        self.assertRaises(ValueError, RuleSchema, schema)
+
+    def test_default(self):
+        schema = RuleSchema.default()
+        self.assertEqual(sorted(schema.columns), sorted(TADCImportRow.COLUMNS))
+
+    def test_invalid_schemas(self):
+        self.assertRaises(ValueError, RuleSchema, [])
+        self.assertRaises(ValueError, RuleSchema, {"format": 1, "version": 1, "columns": []})
+
+        def set_value(letter, key, value):
+            def change(columns):
+                if key is None:
+                    columns[letter] = value
+                else:
+                    columns[letter][key] = value
+            return change
+
+        self.assert_invalid(set_value('A', None, "required"))
+        self.assert_invalid(set_value('A', None, ["required"]))
+        self.assert_invalid(set_value('AA', None, {"name": "Extra"}))
+        self.assert_invalid(set_value('A', 'checks', {"required": True}))
+        self.assert_invalid(set_value('A', 'checks', ["required"]))
+        self.assert_invalid(set_value('A', 'checks', [{"requried": True}]))
+        self.assert_invalid(set_value('A', 'checks', [{"required": True}, {"allow_empty": True}]))
+        self.assert_invalid(set_value('A', 'checks', [{"when": {"column": "H"}, "required": True}]))
+        self.assert_invalid(set_value('A', 'checks', [{"required": True, "unless_present": "B"}]))
+        self.assert_invalid(set_value('A', 'checks', [{"enum": "abc"}]))
+        self.assert_invalid(set_value('A', 'checks', [{"regex": "("}]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import json
+import socket
+import threading
+from tadc_import_validator.validation_server import ValidationServer
+from .generated_files import GeneratedFileTestCase, OLD_DATE_FORMAT
+
+try:
+    from httplib import HTTPConnection
+except ImportError:
+    # Python 3
+    from http.client import HTTPConnection
+
+__author__ = 'timhodson'
+
+
+class ValidationServerTest(GeneratedFileTestCase):
+
+    ROWS = 100
+
+    def setUp(self):
+        GeneratedFileTestCase.setUp(self)
+        self.root_dir = os.path.join(self.work_dir, 'root')
+        os.makedirs(self.root_dir)
+        os.rename(self.csv_file_name, os.path.join(self.root_dir, 'requests.csv'))
+        with open(os.path.join(self.work_dir, 'secret.csv'), 'w') as secret_fp:
+            secret_fp.write('secret\n')
+        os.symlink(os.path.join(self.work_dir, 'secret.csv'), os.path.join(self.root_dir, 'link.csv'))
+        self.server = ValidationServer(OLD_DATE_FORMAT, port=0, max_body_size=100 * 1024, root_dir=self.root_dir)
+        self.thread = threading.Thread(target=self.server.http_server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.http_server.shutdown()
+        self.thread.join()
+        self.server.close()
+        GeneratedFileTestCase.tearDown(self)
+
+    def post(self, query, body=b'', headers=None):
+        connection = HTTPConnection(*self.server.http_server.server_address[:2])
+        try:
+            connection.request('POST', '/validate?' + query, body, headers or {})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read().decode('utf-8'))
+        finally:
+            connection.close()
+
+    def post_raw(self, data):
+        """
+        Send a request as it is, for bodies which HTTPConnection won't send.
+        :return: the status of the response
+        """
+        connection = socket.create_connection(self.server.http_server.server_address[:2])
+        try:
+            connection.sendall(data)
+            return int(connection.makefile('rb').readline().split()[1])
+        finally:
+            connection.close()
+
+    def test_path(self):
+        status, response = self.post('path=requests.csv')
+        self.assertEqual((status, response["rows"]), (200, self.ROWS))
+        status, response = self.post('path=' + os.path.join(self.root_dir, 'requests.csv'))
+        self.assertEqual((status, response["rows"]), (200, self.ROWS))
+        self.assertEqual(self.post('path=missing.csv')[0], 400)
+
+    def test_path_outside_root(self):
+        for path in [os.path.join(self.work_dir, 'secret.csv'), '../secret.csv', 'link.csv', '/etc/passwd']:
+            status, response = self.post('path=' + path)
+            self.assertEqual(status, 403, path)
+            self.assertNotIn('secret', json.dumps(response.get("errors")))
+        self.server.root_dir = None
+        self.assertEqual(self.post('path=requests.csv')[0], 403)
+
+    def test_bad_bodies(self):
+        self.assertEqual(self.post('header_rows=0', b'\xff\xfe,x\n')[0], 400)
+        self.assertEqual(self.post_raw(b'POST /validate HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n'
+                                       b'zz\r\n'), 400)
+        self.assertEqual(self.post_raw(b'POST /validate HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n'
+                                       b'-5\r\n'), 400)
+        self.assertEqual(self.post_raw(b'POST /validate HTTP/1.1\r\nHost: x\r\nContent-Length: x\r\n\r\n'), 400)
+        self.assertEqual(self.post_raw(b'POST /validate HTTP/1.1\r\nHost: x\r\nContent-Length: 200000\r\n\r\n'), 413)